@@ -7,6 +7,7 @@ import reporting.analyze as az
 import reporting.tbapi as tbapi
 import reporting.vmcolumns as vmc
 import reporting.dictionary as dct
+import reporting.filecache as fc
 import reporting.vendormatrix as vm
 import reporting.importhandler as ih
 
@@ -40,6 +41,20 @@ def handle_exception(exc_type, exc_value, exc_traceback):
 sys.excepthook = handle_exception
 
 
+def api_limit(value):
+    """
+    Parses an --api_limits value of the form name:limit.
+
+    :param value: The value as passed on the command line
+    :return: Tuple of the api name and its concurrent request limit
+    """
+    name, sep, limit = value.partition(':')
+    if not name or not sep or not limit.isdigit():
+        raise argparse.ArgumentTypeError(
+            'api limit must be name:int, got {}'.format(value))
+    return name, int(limit)
+
+
 def get_args(arguments=None):
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -62,6 +77,22 @@ def get_args(arguments=None):
     parser.add_argument('--tab', action='store_true')
     parser.add_argument('--basic', action='store_true')
     parser.add_argument('--nolog', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--spill', action='store_true')
+    parser.add_argument('--memory', action='store_true')
+    parser.add_argument('--cache', action='store_true')
+    parser.add_argument('--cache_days', type=int, default=30)
+    parser.add_argument('--cache_mb', type=int, default=2048)
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--explain', action='store_true')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'])
+    parser.add_argument('--parquet', action='store_true')
+    parser.add_argument('--categorical', action='store_true')
+    parser.add_argument('--rule_stats', action='store_true')
+    parser.add_argument('--api_workers', type=int, default=1)
+    parser.add_argument('--api_limits', nargs='+', default=[],
+                        type=api_limit)
+    parser.add_argument('--exp_workers', type=int, default=1)
     if arguments:
         args, unknown = parser.parse_known_args(arguments.split())
     else:
@@ -87,7 +118,8 @@ def main(arguments=None):
         aly.do_analysis_and_fix_processor(pre_run=True)
         matrix = vm.VendorMatrix()
     if args.api:
-        api = ih.ImportHandler(args.api, matrix)
+        api = ih.ImportHandler(args.api, matrix, workers=args.api_workers,
+                               api_limits=dict(args.api_limits))
         api.api_loop()
     if args.ftp:
         ftp = ih.ImportHandler(args.ftp, matrix)
@@ -102,11 +134,23 @@ def main(arguments=None):
         azu = ih.ImportHandler(args.azu, matrix)
         azu.azu_loop()
     if not args.noprocess:
+        raw_cache = None
+        if args.cache:
+            raw_cache = fc.RawFileCache(max_age=args.cache_days,
+                                        max_size=args.cache_mb)
+        source_cache = None
+        if args.incremental:
+            source_cache = fc.SourceCache(explain=args.explain)
         if args.analyze:
             aly = az.Analyze(df=df, file_name=OUTPUT_FILE, matrix=matrix)
             aly.do_analysis_and_fix_processor(new_files=True)
             matrix = vm.VendorMatrix()
-        df = matrix.vm_loop_with_costs(OUTPUT_FILE)
+        df = matrix.vm_loop_with_costs(
+            OUTPUT_FILE, workers=args.workers, spill=args.spill,
+            trace_memory=args.memory, raw_cache=raw_cache,
+            source_cache=source_cache, compression=args.compress,
+            sidecar=args.parquet, categorical=args.categorical,
+            rule_stats=args.rule_stats)
         if args.analyze:
             logging.info('Post run - analyzing data.')
             aly = az.Analyze(df=df, file_name=OUTPUT_FILE, matrix=matrix)
@@ -114,9 +158,15 @@ def main(arguments=None):
             if fixes_to_run:
                 logging.info('Fixes applied, rerunning processor.')
                 matrix = vm.VendorMatrix()
-                df = matrix.vm_loop_with_costs(OUTPUT_FILE)
+                df = matrix.vm_loop_with_costs(
+                    OUTPUT_FILE, workers=args.workers, spill=args.spill,
+                    trace_memory=args.memory, raw_cache=raw_cache,
+                    source_cache=source_cache, compression=args.compress,
+                    sidecar=args.parquet,
+                    categorical=args.categorical,
+                    rule_stats=args.rule_stats)
     if args.exp:
-        exp_class = exp.ExportHandler()
+        exp_class = exp.ExportHandler(workers=args.exp_workers)
         if exp_class.config_loaded:
             exp_class.export_loop(args.exp)
     if args.tab:
@@ -19,6 +19,8 @@ Returns {model_id: {'combined': float, 'live': float,
 """
 import logging
 import time
+import numpy as np
+import reporting.utils as utl
 
 logger = logging.getLogger(__name__)
 
@@ -156,17 +158,16 @@ class AliSearch:
         try:
             enabled = enabled or {'bm25', 'tfidf'}
             model_name = db_model.__name__
-            by_model = self._scores_by_model(message)
+            by_model = self._scores_by_model(
+                message, model_name, top_k * 2)
             if 'bm25' in enabled:
                 _merge_transformer_scores(
-                    results,
-                    by_model['bm25'].get(model_name, [])[:top_k * 2],
+                    results, by_model['bm25'],
                     self.transformer_dict, model_name,
                     weight=WEIGHT_BM25, score_key='bm25')
             if 'tfidf' in enabled:
                 _merge_transformer_scores(
-                    results,
-                    by_model['tfidf'].get(model_name, [])[:top_k * 2],
+                    results, by_model['tfidf'],
                     self.transformer_dict, model_name,
                     weight=WEIGHT_TFIDF, score_key='tfidf')
         except Exception as e:
@@ -174,63 +175,85 @@ class AliSearch:
                 'Transformer search failed: {}'.format(e))
 
     def _full_scores(self, message):
-        """Full sorted BM25 + TF-IDF score lists for ``message``.
+        """BM25 + TF-IDF score arrays over the corpus for ``message``.
 
         The scores don't depend on the model being searched, but
         get_response searches every chat model with the same
         message — so both corpus scans are memoized on the per-
         request ``ali_chat`` and computed once per message instead
-        of once per model.
+        of once per model. Either array is ``None`` when the message
+        has no terms to score.
         """
-        cache = getattr(self.ali_chat, 'transformer_score_cache', None)
-        if cache is None:
-            cache = {}
-            setattr(self.ali_chat, 'transformer_score_cache', cache)
+        cache = self._score_cache()
         if message not in cache:
             n_docs = len(self.transformer_dict)
             self._bump('corpus_docs', n_docs)
             t0 = time.perf_counter()
-            bm25 = self.transformer.bm25_search(message, top_k=n_docs)
+            bm25 = self.transformer.bm25_scores(message)
             t1 = time.perf_counter()
-            tfidf = self.transformer.search(message, top_k=n_docs)
+            tfidf = self.transformer.cosine_scores(message)
             t2 = time.perf_counter()
             self._bump('bm25_scan_ms', (t1 - t0) * 1000)
             self._bump('tfidf_scan_ms', (t2 - t1) * 1000)
             cache[message] = (bm25, tfidf)
         return cache[message]
 
-    def _scores_by_model(self, message):
-        """``{'bm25'|'tfidf': {model_name: [(idx, score), ...]}}``.
+    def _score_cache(self):
+        """The per-request score cache memoized on ``ali_chat``."""
+        cache = getattr(self.ali_chat, 'transformer_score_cache', None)
+        if cache is None:
+            cache = {}
+            setattr(self.ali_chat, 'transformer_score_cache', cache)
+        return cache
+
+    def _model_docs(self):
+        """``{model_name: array of doc indices}`` from transformer_dict.
 
-        Groups the full sorted score lists by the doc's model,
-        keeping per-model rank order and dropping non-positive
-        scores — the full lists include every corpus doc, and
-        zero-score docs would otherwise surface as junk matches
-        on messages with no term overlap. Memoized per message
-        alongside the full lists.
+        Built once per request so picking a model's docs is an index
+        lookup rather than a pass over every doc's metadata.
         """
-        bm25_full, tfidf_full = self._full_scores(message)
-        cache = getattr(self.ali_chat, 'transformer_score_cache')
-        cache_key = (message, 'by_model')
+        cache = self._score_cache()
+        cache_key = ('model_docs',)
         if cache_key not in cache:
-            group_start = time.perf_counter()
-            grouped = {'bm25': {}, 'tfidf': {}}
-            for key, full in (('bm25', bm25_full),
-                              ('tfidf', tfidf_full)):
-                for doc_idx, score in full:
-                    if score <= 0:
-                        continue
-                    doc_info = self.transformer_dict.get(str(doc_idx))
-                    if not doc_info:
-                        continue
-                    model_name = doc_info.get('model')
-                    grouped[key].setdefault(
-                        model_name, []).append((doc_idx, score))
-            self._bump('group_ms',
-                       (time.perf_counter() - group_start) * 1000)
-            cache[cache_key] = grouped
+            model_docs = {}
+            for doc_idx, doc_info in self.transformer_dict.items():
+                if not doc_info or not str(doc_idx).isdigit():
+                    continue
+                model_docs.setdefault(
+                    doc_info.get('model'), []).append(int(doc_idx))
+            cache[cache_key] = {
+                k: np.sort(np.array(v, dtype=np.int64))
+                for k, v in model_docs.items()}
         return cache[cache_key]
 
+    def _scores_by_model(self, message, model_name, limit):
+        """``{'bm25'|'tfidf': [(idx, score), ...]}`` for one model.
+
+        Takes the top ``limit`` docs of ``model_name`` by each score,
+        in rank order, dropping non-positive scores — zero-score docs
+        would otherwise surface as junk matches on messages with no
+        term overlap. Only the model's docs are read and only the
+        selected ones sorted.
+        """
+        bm25_full, tfidf_full = self._full_scores(message)
+        group_start = time.perf_counter()
+        docs = self._model_docs().get(model_name)
+        grouped = {'bm25': [], 'tfidf': []}
+        for key, full in (('bm25', bm25_full),
+                          ('tfidf', tfidf_full)):
+            if full is None or docs is None:
+                continue
+            model_docs = docs[docs < len(full)]
+            scores = full[model_docs]
+            positive = scores > 0
+            model_docs, scores = model_docs[positive], scores[positive]
+            order = utl.top_k_indices(scores, limit)
+            grouped[key] = list(zip(model_docs[order].tolist(),
+                                    scores[order].tolist()))
+        self._bump('group_ms',
+                   (time.perf_counter() - group_start) * 1000)
+        return grouped
+
 
 def _merge_transformer_scores(results, scores, text_dict,
                               model_name, weight=0.5,
@@ -22,6 +22,7 @@ import reporting.awapi as aw
 import reporting.utils as utl
 import reporting.vmcolumns as vmc
 import reporting.dictionary as dct
+import reporting.filecache as fc
 import reporting.vendormatrix as vm
 import reporting.dictcolumns as dctc
 import xml.etree.ElementTree as et
@@ -104,7 +105,7 @@ class Analyze(object):
                  transformer=None, transformer_dict=None,
                  write_authority=None):
         self.analysis_dict = []
-        self.df = df
+        self.df = utl.decategorize(df)
         self.file_name = file_name
         self.matrix = matrix
         self.load_chat = load_chat
@@ -149,7 +150,7 @@ class Analyze(object):
         return analysis_dict_format
 
     def load_df_from_file(self):
-        self.df = utl.import_read_csv(self.file_name)
+        self.df = utl.decategorize(utl.read_output_file(self.file_name))
 
     def add_to_analysis_dict(self, key_col, message='', data='',
                              param='', param2='', split='',
@@ -313,6 +314,13 @@ class Analyze(object):
                                   data=df.to_dict())
         return True
 
+    @staticmethod
+    def exclude_raw_cache(tar_info):
+        cache_dir = os.path.basename(fc.cache_path)
+        if cache_dir in tar_info.name.split('/'):
+            return None
+        return tar_info
+
     def backup_files(self):
         bu = os.path.join(utl.backup_path, dt.date.today().strftime('%Y%m%d'))
         logging.info('Backing up all files to {}'.format(bu))
@@ -325,7 +333,8 @@ class Analyze(object):
             file_name = '{}.tar.gz'.format(file_path.replace('/', ''))
             file_name = os.path.join(bu, file_name)
             tar = tarfile.open(file_name, "w:gz")
-            tar.add(file_path, arcname=file_path.replace('/', ''))
+            tar.add(file_path, arcname=file_path.replace('/', ''),
+                    filter=self.exclude_raw_cache)
             tar.close()
         for file_name in ['logfile.log']:
             if os.path.exists(file_name):
@@ -3581,15 +3590,26 @@ class AliChat(object):
     # index_db_model_by_word loads and word-indexes EVERY row of a
     # model, and get_response runs it for each searched model — an
     # O(sum of table sizes) cost per chat send that grows with the
-    # database. Entries are keyed per model class and reused across
-    # requests for ``word_index_ttl`` seconds. A cached entry is
-    # revalidated against the model's current row count, so creates
-    # and deletes take effect immediately; renames from outside this
-    # process converge within the TTL. In-process writes (heuristic
-    # proposes, tool-loop writes) call invalidate_word_index().
-    # {(model_name, split_underscore): (word_idx, built_at, count)}
+    # database. Indexes are kept per model class in
+    # ``word_index_cache`` on disk, memory mapped and shared by every
+    # worker, and each lookup only reads the small meta file. An
+    # index is reused while the model's ``ali_change_token`` (if it
+    # defines one) is unchanged; after ``word_index_ttl`` seconds it
+    # is revalidated against the row count, so external writes
+    # converge within the TTL. In-process writes call
+    # index_object/unindex_object to patch the shared index, or
+    # invalidate_word_index() to drop it.
+    # {(model_name, split_underscore): (meta, fc.WordIndex)}
     _WORD_INDEX_CACHE = {}
     word_index_ttl = 600
+    # Patches are saved as a delta of the changed objects, folded into a
+    # rebuilt index once it holds this many.
+    word_index_delta_max = 1000
+    # None keeps the indexes in this process only.
+    word_index_cache = fc.WordIndexCache()
+    # Compact the transformer once this share of its docs has changed
+    # since it was built, bringing the drifted idf back to exact.
+    corpus_compact_ratio = 0.2
 
     # Optional callable(dict) the app layer attaches per call-site
     # to persist LLM timing/usage (the AliRun/AliStep envelope).
@@ -3619,6 +3639,8 @@ class AliChat(object):
         self.transformer = transformer
         self.transformer_dict = transformer_dict or {}
         self.write_authority = write_authority
+        # {(model_name, id): obj} loaded by load_db_objects this request
+        self.loaded_objects = {}
 
     def _propose_column_write(self, cur_model, column, new_val):
         """setattr+commit a heuristic column write, gated by the
@@ -3661,12 +3683,15 @@ class AliChat(object):
         """Drop cached per-model word indexes.
 
         Called after any in-process write ALI makes so its own
-        creates/edits are immediately findable; external writers
-        are covered by the row-count check + TTL. ``model_names``
-        limits the drop to those models' entries (both
-        split-underscore variants); ``None`` drops everything —
-        most writes touch one known model, so targeted callers
-        keep every other model's index warm."""
+        creates/edits are immediately findable in every worker;
+        external writers are covered by the change token and the
+        row-count check after the TTL. ``model_names`` limits the
+        drop to those models' entries (both split-underscore
+        variants); ``None`` drops everything — most writes touch one
+        known model, so targeted callers keep every other model's
+        index warm."""
+        if cls.word_index_cache is not None:
+            cls.word_index_cache.remove(model_names)
         if model_names is None:
             cls._WORD_INDEX_CACHE = {}
             return
@@ -3733,20 +3758,41 @@ class AliChat(object):
 
     def index_db_model_by_word(self, db_model, model_is_list=False,
                                split_underscore=False):
-        cache_key = None
-        row_count = None
-        if not model_is_list and hasattr(db_model, '__name__'):
-            cache_key = (db_model.__name__, split_underscore)
+        if model_is_list or not hasattr(db_model, '__name__'):
+            return self.build_word_index(
+                db_model, model_is_list, split_underscore)[0]
+        cache_key = (db_model.__name__, split_underscore)
+        token = self.get_change_token(db_model)
+        meta, word_idx = self._load_word_index(cache_key)
+        if self._word_index_valid(db_model, cache_key, meta, token):
+            return word_idx
+        with self._word_index_lock(cache_key):
+            meta, word_idx = self._load_word_index(cache_key)
+            if self._word_index_valid(db_model, cache_key, meta, token):
+                return word_idx
             try:
                 row_count = self.scoped_index_query(db_model).count()
             except Exception:
-                cache_key = None
-            cached = (AliChat._WORD_INDEX_CACHE.get(cache_key)
-                      if cache_key else None)
-            if (cached and cached[2] == row_count
-                    and time.time() - cached[1] < self.word_index_ttl):
-                return cached[0]
+                row_count = None
+            word_idx, id_words = self.build_word_index(
+                db_model, split_underscore=split_underscore)
+            if row_count is None:
+                return word_idx
+            return self._save_word_index(
+                cache_key, word_idx, id_words, token, row_count)
+
+    def build_word_index(self, db_model, model_is_list=False,
+                         split_underscore=False):
+        """
+        Word indexes every row of db_model.
+
+        :param db_model: The db model class, or a list of names
+        :param model_is_list: db_model is a list of names
+        :param split_underscore: Whether to split words on underscores
+        :return: Tuple of the dict of word to ids and of id to words
+        """
         word_idx = {}
+        id_words = {}
         db_all = db_model
         if not model_is_list:
             db_all = self.scoped_index_query(db_model).all()
@@ -3754,22 +3800,301 @@ class AliChat(object):
             if model_is_list:
                 obj = FakeDbModel(name=obj, object_id=idx)
             obj_name = obj.name  # evaluate the (heavy) name property once
-            if obj_name:
-                used_words = set()
-                words = utl.lower_words_from_str(
-                    obj_name, split_underscore=split_underscore)
-                for word in words:
-                    if word in used_words:
-                        continue
-                    if word in word_idx:
-                        word_idx[word].append(obj.id)
-                    else:
-                        word_idx[word] = [obj.id]
-                    used_words.add(word)
-        if cache_key:
-            AliChat._WORD_INDEX_CACHE[cache_key] = (
-                word_idx, time.time(), row_count)
-        return word_idx
+            self._add_to_word_index(word_idx, id_words, obj.id, obj_name,
+                                    split_underscore)
+        return word_idx, id_words
+
+    @staticmethod
+    def get_change_token(db_model):
+        """
+        The model's ``ali_change_token``, a cheap value that changes
+        whenever its rows do (e.g. the latest updated time), or '' if it
+        does not define one.
+        """
+        if not hasattr(db_model, 'ali_change_token'):
+            return ''
+        try:
+            return str(db_model.ali_change_token())
+        except Exception as e:
+            logging.warning('Change token failed for {}: {}'.format(
+                db_model.__name__, e))
+            return None
+
+    def _word_index_lock(self, cache_key):
+        if self.word_index_cache is None:
+            return fc.FileLock()
+        return self.word_index_cache.lock(cache_key)
+
+    def _load_word_index(self, cache_key):
+        """
+        The meta and WordIndex of cache_key, keeping the mapped index of
+        the current version in this process.
+
+        :param cache_key: Tuple of the model name and split underscore
+        :return: Tuple of the meta dict and WordIndex, or of None
+        """
+        cached = AliChat._WORD_INDEX_CACHE.get(cache_key)
+        if self.word_index_cache is None or (
+                cached and cached[0]['version'] is None):
+            return cached or (None, None)
+        meta = self.word_index_cache.load_meta(cache_key)
+        if not meta:
+            return None, None
+        if cached and cached[0]['version'] == meta['version']:
+            if cached[0].get('delta_seq') == meta.get('delta_seq'):
+                return meta, cached[1]
+            word_idx = self.word_index_cache.load(cache_key, meta, cached[1])
+        else:
+            word_idx = self.word_index_cache.load(cache_key, meta)
+        if word_idx is None:
+            return None, None
+        AliChat._WORD_INDEX_CACHE[cache_key] = (meta, word_idx)
+        return meta, word_idx
+
+    def _word_index_valid(self, db_model, cache_key, meta, token):
+        if not meta or token is None or meta['token'] != token:
+            return False
+        if time.time() - meta['built_at'] < self.word_index_ttl:
+            return True
+        try:
+            row_count = self.scoped_index_query(db_model).count()
+        except Exception:
+            return False
+        if row_count != meta['row_count']:
+            return False
+        meta['built_at'] = time.time()
+        if self.word_index_cache is not None:
+            self.word_index_cache.save_meta(cache_key, meta)
+        return True
+
+    def _save_word_index(self, cache_key, word_idx, id_words, token,
+                         row_count, built_at=None):
+        """
+        Saves a word index to the shared cache, or to this process only
+        when word_index_cache is None or cannot be written.
+
+        :param cache_key: Tuple of the model name and split underscore
+        :param word_idx: Dict of word to ids
+        :param id_words: Dict of id to words
+        :param token: The model's change token
+        :param row_count: The model's row count
+        :param built_at: When the index was built, defaults to now
+        :return: The saved WordIndex, or word_idx kept in this process
+            if its ids are not ints
+        """
+        meta = {'token': token, 'row_count': row_count, 'version': None,
+                'built_at': built_at or time.time()}
+        try:
+            index = fc.WordIndex.from_dict(word_idx, id_words)
+        except (TypeError, ValueError, OverflowError):
+            meta['id_words'] = id_words
+            AliChat._WORD_INDEX_CACHE[cache_key] = (meta, word_idx)
+            return word_idx
+        if self.word_index_cache is not None:
+            try:
+                meta = self.word_index_cache.save(cache_key, index, meta)
+            except OSError as e:
+                logging.warning('Could not save word index, keeping word '
+                                'indexes in process: {}'.format(e))
+                AliChat.word_index_cache = None
+        AliChat._WORD_INDEX_CACHE[cache_key] = (meta, index)
+        return index
+
+    @staticmethod
+    def _add_to_word_index(word_idx, id_words, obj_id, obj_name,
+                           split_underscore=False):
+        used_words = []
+        id_words[obj_id] = used_words
+        if not obj_name:
+            return
+        words = utl.lower_words_from_str(
+            obj_name, split_underscore=split_underscore)
+        for word in words:
+            if word in used_words:
+                continue
+            if word in word_idx:
+                word_idx[word].append(obj_id)
+            else:
+                word_idx[word] = [obj_id]
+            used_words.append(word)
+
+    @staticmethod
+    def _remove_from_word_index(word_idx, id_words, obj_id):
+        for word in id_words.pop(obj_id, []):
+            ids = word_idx.get(word, [])
+            if obj_id in ids:
+                ids.remove(obj_id)
+            if not ids:
+                word_idx.pop(word, None)
+
+    def _update_word_index(self, db_model, obj_id, obj_name=None,
+                           delete=False):
+        """
+        Applies one object's change to the saved word indexes of its
+        model, both split-underscore variants, without reading the
+        table. A saved index only writes the delta of changed objects.
+        The row count and change token are kept in step so the index
+        stays valid.
+
+        :param db_model: The db model class of the object
+        :param obj_id: Id of the changed object
+        :param obj_name: The object's current name, unused on delete
+        :param delete: True if the object was deleted
+        :return: None
+        """
+        token = self.get_change_token(db_model)
+        for split_underscore in [False, True]:
+            cache_key = (db_model.__name__, split_underscore)
+            with self._word_index_lock(cache_key):
+                meta, word_idx = self._load_word_index(cache_key)
+                if not meta:
+                    continue
+                if isinstance(word_idx, dict):
+                    id_words = meta['id_words']
+                    existed = obj_id in id_words
+                    self._remove_from_word_index(word_idx, id_words, obj_id)
+                else:
+                    existed = word_idx.has_id(obj_id)
+                    id_words = dict(word_idx.delta_words)
+                    id_words.pop(obj_id, None)
+                    removed = set(word_idx.removed)
+                    if word_idx.in_arrays(obj_id):
+                        removed.add(obj_id)
+                if not delete:
+                    self._add_to_word_index(
+                        word_idx if isinstance(word_idx, dict) else {},
+                        id_words, obj_id, obj_name, split_underscore)
+                row_count = meta['row_count']
+                if delete:
+                    row_count -= 1 if existed else 0
+                else:
+                    row_count += 0 if existed else 1
+                if isinstance(word_idx, dict):
+                    self._save_word_index(cache_key, word_idx, id_words,
+                                          token, row_count, meta['built_at'])
+                else:
+                    word_idx = word_idx.with_delta(id_words, removed)
+                    self._save_word_index_delta(cache_key, meta, word_idx,
+                                                token, row_count)
+
+    def _save_word_index_delta(self, cache_key, meta, word_idx, token,
+                               row_count):
+        """
+        Saves the delta of a patched WordIndex, or rebuilds the index with
+        the delta folded in once it passes word_index_delta_max objects.
+
+        :param cache_key: Tuple of the model name and split underscore
+        :param meta: The meta dict of the version word_idx was loaded from
+        :param word_idx: The WordIndex with its new delta
+        :param token: The model's change token
+        :param row_count: The model's row count
+        :return: None
+        """
+        if word_idx.delta_size() > self.word_index_delta_max:
+            word_idx, id_words = word_idx.to_dicts()
+            self._save_word_index(cache_key, word_idx, id_words, token,
+                                  row_count, meta['built_at'])
+            return
+        meta = dict(meta, token=token, row_count=row_count)
+        if self.word_index_cache is not None and meta['version']:
+            try:
+                meta = self.word_index_cache.save_delta(
+                    cache_key, word_idx, meta)
+            except OSError as e:
+                logging.warning('Could not save word index, keeping word '
+                                'indexes in process: {}'.format(e))
+                AliChat.word_index_cache = None
+        AliChat._WORD_INDEX_CACHE[cache_key] = (meta, word_idx)
+
+    @staticmethod
+    def _corpus_key(doc_info):
+        model_name = doc_info.get('model') or ''
+        model_id = doc_info.get('{}_id'.format(model_name.lower()),
+                                doc_info.get('id'))
+        return model_name, model_id
+
+    def _update_search_corpus(self, model_name, obj_id, text=None,
+                              delete=False):
+        """
+        Applies one object's change to the transformer and
+        transformer_dict, keyed by (model_name, obj_id).  Compacts once
+        the changes since the last build pass corpus_compact_ratio of the
+        docs.
+
+        :param model_name: Name of the db model class
+        :param obj_id: Id of the changed object
+        :param text: The object's current text, unused on delete
+        :param delete: True if the object was deleted
+        :return: None
+        """
+        transformer = self.transformer
+        if transformer is None:
+            return
+        if not transformer.key_docs and self.transformer_dict:
+            for doc_idx, doc_info in self.transformer_dict.items():
+                doc_idx = int(doc_idx) if str(doc_idx).isdigit() else -1
+                if doc_info and 0 <= doc_idx < len(transformer.doc_keys):
+                    key = self._corpus_key(doc_info)
+                    transformer.doc_keys[doc_idx] = key
+                    transformer.key_docs[key] = doc_idx
+        key = (model_name, obj_id)
+        old_idx = transformer.key_docs.get(key)
+        if old_idx is not None:
+            self.transformer_dict.pop(str(old_idx), None)
+        if delete:
+            transformer.delete_doc(key)
+        else:
+            doc_idx = transformer.update_doc(key, text)
+            self.transformer_dict[str(doc_idx)] = {
+                'model': model_name, 'id': obj_id, 'text': text}
+        if (transformer.pending_changes >
+                len(transformer.doc_tokens) * self.corpus_compact_ratio):
+            self.compact_search_corpus()
+        self.transformer_score_cache = None
+
+    def compact_search_corpus(self):
+        """
+        Compacts the transformer, making its idf exact, and renumbers
+        transformer_dict in place to the compacted doc indices.
+
+        :return: None
+        """
+        if self.transformer is None:
+            return
+        doc_map = self.transformer.compact()
+        transformer_dict = {
+            str(new): self.transformer_dict[str(old)]
+            for old, new in doc_map.items()
+            if str(old) in self.transformer_dict}
+        self.transformer_dict.clear()
+        self.transformer_dict.update(transformer_dict)
+        self.transformer_score_cache = None
+
+    def index_object(self, db_model, obj, text=None):
+        """
+        Adds or updates obj in the word index and search corpus without
+        rescanning the table, for the app to call on write.
+
+        :param db_model: The db model class of obj
+        :param obj: The created or changed object
+        :param text: Text to score obj on, defaults to obj.name
+        :return: None
+        """
+        obj_name = obj.name
+        self._update_word_index(db_model, obj.id, obj_name)
+        self._update_search_corpus(
+            db_model.__name__, obj.id, obj_name if text is None else text)
+
+    def unindex_object(self, db_model, obj_id):
+        """
+        Removes a deleted object from the word index and search corpus.
+
+        :param db_model: The db model class of the object
+        :param obj_id: Id of the deleted object
+        :return: None
+        """
+        self._update_word_index(db_model, obj_id, delete=True)
+        self._update_search_corpus(db_model.__name__, obj_id, delete=True)
 
     def convert_model_ids_to_message(
             self, db_model, model_ids, message='',
@@ -3783,8 +4108,9 @@ class AliChat(object):
         message = message + '<br>'
         html_response = ''
         is_dict = isinstance(model_ids, dict)
+        objs = self.load_db_objects(db_model, model_ids)
         for idx, model_id in enumerate(model_ids):
-            obj = self.db.session.get(db_model, model_id)
+            obj = objs[model_id]
             if not obj:
                 continue
             scores = (
@@ -3804,10 +4130,43 @@ class AliChat(object):
                     table_elem)
         return message, html_response
 
+    def load_db_objects(self, db_model, model_ids):
+        """Objects of db_model for model_ids, loading the ones not yet
+        loaded this request in one IN query.
+
+        Models can define ``ali_load_options`` returning loader
+        options (e.g. selectinload of the relationships ``name`` and
+        ``get_url`` read) so those load with the batch instead of per
+        object. Loaded objects are kept in ``loaded_objects`` so the
+        run/edit/table checks and the response reuse them.
+
+        :param db_model: SQLAlchemy model class of the objects
+        :param model_ids: Iterable of ids
+        :returns: Dict of {id: obj}, obj None for ids not found
+        """
+        model_name = db_model.__name__
+        model_ids = list(model_ids)
+        missing = list(dict.fromkeys(
+            x for x in model_ids
+            if (model_name, x) not in self.loaded_objects))
+        if missing:
+            query = self.db.session.query(db_model).filter(
+                db_model.id.in_(missing))
+            if hasattr(db_model, 'ali_load_options'):
+                query = query.options(*db_model.ali_load_options())
+            for obj in query.all():
+                self.loaded_objects[(model_name, obj.id)] = obj
+            for model_id in missing:
+                self.loaded_objects.setdefault((model_name, model_id), None)
+        return {x: self.loaded_objects[(model_name, x)] for x in model_ids}
+
+    def get_db_object(self, db_model, model_id):
+        return self.load_db_objects(db_model, [model_id])[model_id]
+
     def check_db_model_table(self, db_model, words, model_ids):
         table_response = ''
         tables = [x for x in db_model.get_table_name_to_task_dict().keys()]
-        cur_model = self.db.session.get(db_model, next(iter(model_ids)))
+        cur_model = self.get_db_object(db_model, next(iter(model_ids)))
         cur_model_name = re.split(r'[_\s]|(?<=[a-z])(?=[A-Z])', cur_model.name)
         cur_model_name = [x.lower() for x in cur_model_name]
         for table in tables:
@@ -3874,6 +4233,7 @@ class AliChat(object):
             self, db_model, words, model_ids):
         """Look up matched IDs, run/edit if requested, build
         response text and HTML."""
+        self.load_db_objects(db_model, model_ids)
         response = self.run_db_model(
             db_model, words, model_ids)
         if response:
@@ -4345,7 +4705,7 @@ class AliChat(object):
         model_ids, words = self.find_db_model(
             db_model, message, remove_punctuation=remove_punctuation)
         if model_ids:
-            cur_model = self.db.session.get(db_model, next(iter(model_ids)))
+            cur_model = self.get_db_object(db_model, next(iter(model_ids)))
             old_model = other_db_model.query.filter_by(
                 name=cur_model.name).first()
             if old_model:
@@ -4526,7 +4886,7 @@ class AliChat(object):
                       'add']
         is_edit = utl.is_list_in_list(edit_words, words)
         if is_edit:
-            cur_model = self.db.session.get(db_model, next(iter(model_ids)))
+            cur_model = self.get_db_object(db_model, next(iter(model_ids)))
             response = self.check_children_for_edit(cur_model, words)
         return response
 
@@ -4543,7 +4903,7 @@ class AliChat(object):
         edit_words = ['run']
         is_run = utl.is_list_in_list(edit_words, words)
         if is_run:
-            cur_model = self.db.session.get(db_model, next(iter(model_ids)))
+            cur_model = self.get_db_object(db_model, next(iter(model_ids)))
             response = self.check_db_object_run(cur_model, words)
         return response
 
@@ -4907,6 +5267,141 @@ class AliChat(object):
         return response
 
 
+class TermDocMatrix(object):
+    """
+    Sparse doc by term matrix stored as CSR rows, with postings lists of
+    the docs and values of each term for scoring only the query terms.
+    """
+    def __init__(self, indptr, indices, data, n_terms):
+        """
+        :param indptr: Offsets of each doc's entries, length docs + 1
+        :param indices: Term index of each entry, sorted within a doc
+        :param data: Value of each entry
+        :param n_terms: Number of terms, the width of the matrix
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.float32)
+        self.shape = (len(self.indptr) - 1, n_terms)
+        self.term_ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        self.term_docs = np.zeros(0, dtype=np.int32)
+        self.term_data = np.zeros(0, dtype=np.float32)
+        self.build_postings()
+
+    @classmethod
+    def from_dense(cls, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(0, 0)
+        rows, cols = np.nonzero(matrix)
+        indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=matrix.shape[0]),
+                  out=indptr[1:])
+        return cls(indptr, cols, matrix[rows, cols], matrix.shape[1])
+
+    def row_ids(self):
+        return np.repeat(np.arange(self.shape[0], dtype=np.int32),
+                         np.diff(self.indptr))
+
+    def build_postings(self):
+        order = np.argsort(self.indices, kind='stable')
+        self.term_docs = self.row_ids()[order]
+        self.term_data = self.data[order]
+        np.cumsum(np.bincount(self.indices, minlength=self.shape[1]),
+                  out=self.term_ptr[1:])
+
+    def any(self):
+        return bool(self.data.any())
+
+    @property
+    def nbytes(self):
+        return sum(x.nbytes for x in [
+            self.indptr, self.indices, self.data, self.term_ptr,
+            self.term_docs, self.term_data])
+
+    def to_dense(self):
+        matrix = np.zeros(self.shape, dtype=np.float32)
+        matrix[self.row_ids(), self.indices] = self.data
+        return matrix
+
+    def row_norms(self):
+        return np.sqrt(np.bincount(
+            self.row_ids(), weights=self.data.astype(np.float64) ** 2,
+            minlength=self.shape[0]))
+
+    def append_row(self, indices, data, n_terms):
+        """
+        Adds a doc as the last row, inserting its entries at the end of
+        each term's postings so they stay in doc order.
+
+        :param indices: Sorted term indices of the doc's entries
+        :param data: Value of each entry
+        :param n_terms: Number of terms, widening the matrix for new terms
+        :return: Index of the new doc
+        """
+        indices = np.asarray(indices, dtype=np.int32)
+        data = np.asarray(data, dtype=np.float32)
+        if n_terms > self.shape[1]:
+            self.term_ptr = np.concatenate([self.term_ptr, np.full(
+                n_terms - self.shape[1], self.term_ptr[-1])])
+        doc = self.shape[0]
+        self.shape = (doc + 1, max(n_terms, self.shape[1]))
+        self.indptr = np.append(self.indptr, self.indptr[-1] + len(indices))
+        self.indices = np.concatenate([self.indices, indices])
+        self.data = np.concatenate([self.data, data])
+        positions = self.term_ptr[indices + 1]
+        self.term_docs = np.insert(self.term_docs, positions, doc)
+        self.term_data = np.insert(self.term_data, positions, data)
+        self.term_ptr[1:] += np.cumsum(
+            np.bincount(indices, minlength=self.shape[1]))
+        return doc
+
+    def clear_row(self, doc):
+        """
+        Zeroes a doc's entries in the rows and the postings.
+
+        :param doc: Index of the doc
+        :return: None
+        """
+        start, end = self.indptr[doc], self.indptr[doc + 1]
+        for term in self.indices[start:end]:
+            t_start, t_end = self.term_ptr[term], self.term_ptr[term + 1]
+            pos = t_start + np.searchsorted(
+                self.term_docs[t_start:t_end], doc)
+            self.term_data[pos] = 0
+        self.data[start:end] = 0
+
+    def postings(self, term_idx):
+        """
+        Gathers the postings of several terms.
+
+        :param term_idx: Indices of the terms
+        :return: Tuple of arrays with the doc, value and position in
+            term_idx of each posting
+        """
+        term_idx = np.asarray(term_idx, dtype=np.int64)
+        starts = self.term_ptr[term_idx]
+        lengths = self.term_ptr[term_idx + 1] - starts
+        owner = np.repeat(np.arange(len(term_idx)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        pos = starts[owner] + offsets
+        return self.term_docs[pos], self.term_data[pos], owner
+
+    def dot(self, term_idx, weights):
+        """
+        Multiplies the matrix by a vector that is zero outside term_idx,
+        reading only the postings of those terms.
+
+        :param term_idx: Indices of the terms in the vector
+        :param weights: Values of the vector at term_idx
+        :return: Array of the dot product of each doc with the vector
+        """
+        docs, data, owner = self.postings(term_idx)
+        return np.bincount(docs, weights=data * np.asarray(weights)[owner],
+                           minlength=self.shape[0])
+
+
 class TfIdfTransformer(object):
     def __init__(self, texts=None, ali_chat=None, eps=1e-6):
         self.texts = texts
@@ -4916,28 +5411,106 @@ class TfIdfTransformer(object):
             self.ali_chat = AliChat()
         self.tutorial_texts = []
         self.doc_tokens = []
-        self.unique_words = set()
+        self.unique_words = []
         self.indexed_words = {}
         self.idf = np.zeros(0)
-        self.tfidf_matrix = np.zeros(0)
+        self.tfidf_matrix = TermDocMatrix.from_dense(np.zeros((0, 0)))
+        self.doc_norms = np.zeros(0)
         self.doc_lengths = []
         self.doc_freqs = []
         self.avg_dl = 0.0
-        self.bm25_idf = {}
+        self.bm25_idf_dict = None
+        self.term_counts = TermDocMatrix.from_dense(np.zeros((0, 0)))
+        self.bm25_idf_values = np.zeros(0)
+        self.bm25_norms = {}
+        self.word_doc_counts = np.zeros(0, dtype=np.float32)
+        self.doc_keys = []
+        self.key_docs = {}
+        self.deleted = set()
+        self.pending_changes = 0
         if self.texts:
             self.tfidf_matrix = self.train(texts)
 
-    def train(self, texts):
+    def __setstate__(self, state):
+        """
+        Loads transformers pickled before tfidf_matrix was sparse, converting
+        the dense matrix to a TermDocMatrix.
+
+        :param state: The unpickled attributes
+        :return: None
+        """
+        matrix = state.get('tfidf_matrix')
+        if not isinstance(matrix, TermDocMatrix):
+            if matrix is None:
+                matrix = np.zeros((0, 0))
+            state['tfidf_matrix'] = TermDocMatrix.from_dense(matrix)
+            state['doc_norms'] = state['tfidf_matrix'].row_norms()
+        bm25_idf = state.pop('bm25_idf', {})
+        state.setdefault('bm25_idf_dict', None)
+        self.__dict__.update(state)
+        if 'term_counts' not in state:
+            self.build_bm25_index(bm25_idf)
+        if 'word_doc_counts' not in state:
+            self.word_doc_counts = np.diff(
+                self.term_counts.term_ptr).astype(np.float32)
+            self.doc_keys = [None] * len(self.doc_tokens)
+            self.key_docs = {}
+            self.deleted = set()
+            self.pending_changes = 0
+
+    @property
+    def bm25_idf(self):
+        """
+        Dict of each term's bm25 idf, built from bm25_idf_values when first
+        read after the idf changes.
+        """
+        if self.bm25_idf_dict is None:
+            self.bm25_idf_dict = dict(zip(self.unique_words,
+                                          self.bm25_idf_values.tolist()))
+        return self.bm25_idf_dict
+
+    def build_bm25_index(self, bm25_idf):
         """
-        Create a tf-idf matrix based on texts
+        Builds the term count postings and bm25 idf array from doc_freqs,
+        for transformers pickled before they were stored.
+
+        :param bm25_idf: The pickled dict of each term's bm25 idf
+        :return: None
+        """
+        indptr = np.zeros(len(self.doc_freqs) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in self.doc_freqs], out=indptr[1:])
+        indices = [self.indexed_words[w] for x in self.doc_freqs for w in x]
+        counts = [c for x in self.doc_freqs for c in x.values()]
+        self.term_counts = TermDocMatrix(indptr, indices, counts,
+                                         len(self.unique_words))
+        self.bm25_idf_values = np.array(
+            [bm25_idf.get(w, 0.0) for w in self.unique_words],
+            dtype=np.float64)
+        self.bm25_norms = {}
+
+    def train(self, texts, keys=None):
+        """
+        Create a sparse tf-idf matrix based on texts
 
         :param texts: List of documents/words
+        :param keys: Optional (model, id) key of each text, used by
+            update_doc and delete_doc
         :return: tf-idf matrix
         """
         doc_tokens = []
         for text in texts:
             tokens = self.ali_chat.get_unigrams_and_bigrams(text)
             doc_tokens.append(tokens)
+        return self.build(doc_tokens, keys)
+
+    def build(self, doc_tokens, keys=None):
+        """
+        Create a sparse tf-idf matrix and bm25 postings from tokenized docs.
+
+        :param doc_tokens: List of the tokens of each doc
+        :param keys: Optional (model, id) key of each doc
+        :return: tf-idf matrix
+        """
         self.doc_tokens = doc_tokens
         self.unique_words = set()
         for tokens in doc_tokens:
@@ -4945,62 +5518,207 @@ class TfIdfTransformer(object):
         self.unique_words = sorted(list(self.unique_words))
         self.indexed_words = {w: i for i, w in enumerate(self.unique_words)}
         doc_count = len(doc_tokens)
-        word_doc_counts = np.zeros(len(self.unique_words), dtype=np.float32)
         self.doc_lengths = []
-        total_length = 0
-        for tokens in doc_tokens:
-            unique_in_doc = set(tokens)
-            for w in unique_in_doc:
-                word_doc_counts[self.indexed_words[w]] += 1
-            self.doc_lengths.append(len(tokens))
-            total_length += len(tokens)
-        self.avg_dl = (total_length / doc_count) if doc_count else 0.0
-        self.idf = np.log((doc_count + self.eps) / (word_doc_counts + self.eps))
-        self.tfidf_matrix = np.zeros((doc_count, len(self.unique_words)),
-                                     dtype=np.float32)
         self.doc_freqs = []
-        for d_idx, tokens in enumerate(doc_tokens):
+        doc_terms = []
+        doc_counts = []
+        for tokens in doc_tokens:
             freq_dict = {}
             for w in tokens:
                 freq_dict[w] = freq_dict.get(w, 0) + 1
             self.doc_freqs.append(freq_dict)
-            total_tokens = len(tokens)
-            for w, count in freq_dict.items():
-                w_idx = self.indexed_words[w]
-                tf = count / total_tokens
-                self.tfidf_matrix[d_idx, w_idx] = tf * self.idf[w_idx]
-        self.bm25_idf = {}
-        for idx, term in enumerate(self.unique_words):
-            df = word_doc_counts[idx]
-            numerator = (doc_count - df + 0.5)
-            denominator = (df + 0.5)
-            self.bm25_idf[term] = np.log((numerator / denominator) + 1.0)
+            self.doc_lengths.append(len(tokens))
+            terms = np.fromiter((self.indexed_words[w] for w in freq_dict),
+                                dtype=np.int32, count=len(freq_dict))
+            order = np.argsort(terms)
+            doc_terms.append(terms[order])
+            doc_counts.append(np.fromiter(freq_dict.values(), dtype=np.int64,
+                                          count=len(freq_dict))[order])
+        self.doc_keys = list(keys) if keys else [None] * doc_count
+        self.key_docs = {k: i for i, k in enumerate(self.doc_keys)
+                         if k is not None}
+        self.deleted = set()
+        self.pending_changes = 0
+        indptr = np.zeros(doc_count + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in doc_terms], out=indptr[1:])
+        indices = np.concatenate(doc_terms or [np.zeros(0, dtype=np.int32)])
+        counts = np.concatenate(doc_counts or [np.zeros(0, dtype=np.int64)])
+        self.word_doc_counts = np.bincount(
+            indices, minlength=len(self.unique_words)).astype(np.float32)
+        self.refresh_idf()
+        tf = counts / np.repeat(self.doc_lengths, np.diff(indptr))
+        data = tf.astype(np.float32) * self.idf[indices]
+        self.tfidf_matrix = TermDocMatrix(indptr, indices, data,
+                                          len(self.unique_words))
+        self.doc_norms = self.tfidf_matrix.row_norms()
+        self.term_counts = TermDocMatrix(indptr, indices, counts,
+                                         len(self.unique_words))
         return self.tfidf_matrix
 
-    def compute_vector(self, text):
+    def refresh_idf(self):
         """
-        Compute the tf-idf vector for an arbitrary piece of text.
+        Recomputes the tf-idf and bm25 idf of every term and the average
+        doc length from the live docs.
+
+        :return: None
+        """
+        doc_count = len(self.doc_tokens) - len(self.deleted)
+        total_length = sum(self.doc_lengths)
+        self.avg_dl = (total_length / doc_count) if doc_count else 0.0
+        self.idf = np.log((doc_count + self.eps) /
+                          (self.word_doc_counts + self.eps))
+        df = self.word_doc_counts.astype(np.float64)
+        self.bm25_idf_values = np.log((doc_count - df + 0.5) / (df + 0.5) + 1)
+        self.bm25_idf_dict = None
+        self.bm25_norms = {}
+
+    def add_doc(self, text, key=None):
+        """
+        Adds a doc without retraining.  Idf is refreshed for queries and
+        bm25, but the tf-idf values already stored for other docs keep the
+        idf they were added with until compact.
+
+        :param text: Text of the doc
+        :param key: Optional (model, id) key, replacing any doc with it
+        :return: Index of the new doc
+        """
+        if key is not None and key in self.key_docs:
+            self.delete_doc(key)
+        tokens = self.ali_chat.get_unigrams_and_bigrams(text)
+        freq_dict = {}
+        for w in tokens:
+            freq_dict[w] = freq_dict.get(w, 0) + 1
+            if w not in self.indexed_words:
+                self.indexed_words[w] = len(self.unique_words)
+                self.unique_words.append(w)
+        new_terms = len(self.unique_words) - len(self.word_doc_counts)
+        if new_terms:
+            self.word_doc_counts = np.concatenate([
+                self.word_doc_counts, np.zeros(new_terms, dtype=np.float32)])
+        terms = np.array(sorted(self.indexed_words[w] for w in freq_dict),
+                         dtype=np.int32)
+        counts = np.array([freq_dict[self.unique_words[x]] for x in terms],
+                          dtype=np.int64)
+        self.doc_tokens.append(tokens)
+        self.doc_freqs.append(freq_dict)
+        self.doc_lengths.append(len(tokens))
+        self.doc_keys.append(key)
+        self.word_doc_counts[terms] += 1
+        self.refresh_idf()
+        data = (counts / max(len(tokens), 1)).astype(np.float32)
+        data = data * self.idf[terms]
+        n_terms = len(self.unique_words)
+        doc_idx = self.tfidf_matrix.append_row(terms, data, n_terms)
+        self.term_counts.append_row(terms, counts, n_terms)
+        self.doc_norms = np.append(self.doc_norms, np.linalg.norm(data))
+        if key is not None:
+            self.key_docs[key] = doc_idx
+        self.pending_changes += 1
+        return doc_idx
+
+    def delete_doc(self, key):
+        """
+        Removes the doc with key from scoring.  Its row stays, zeroed,
+        until compact.
+
+        :param key: The (model, id) key of the doc
+        :return: Index of the removed doc or None if key is unknown
+        """
+        doc_idx = self.key_docs.pop(key, None)
+        if doc_idx is None:
+            return None
+        terms = [self.indexed_words[w] for w in self.doc_freqs[doc_idx]]
+        self.word_doc_counts[terms] -= 1
+        self.tfidf_matrix.clear_row(doc_idx)
+        self.term_counts.clear_row(doc_idx)
+        self.doc_norms[doc_idx] = 0
+        self.doc_tokens[doc_idx] = []
+        self.doc_freqs[doc_idx] = {}
+        self.doc_lengths[doc_idx] = 0
+        self.doc_keys[doc_idx] = None
+        self.deleted.add(doc_idx)
+        self.refresh_idf()
+        self.pending_changes += 1
+        return doc_idx
+
+    def update_doc(self, key, text):
+        """
+        Replaces the text of the doc with key, adding it if it is new.
+
+        :param key: The (model, id) key of the doc
+        :param text: New text of the doc
+        :return: Index of the doc's new row
+        """
+        return self.add_doc(text, key=key)
+
+    def compact(self):
+        """
+        Rebuilds from the live docs, dropping deleted rows and making the
+        stored tf-idf values exact again.
+
+        :return: Dict of old doc index to new doc index for live docs
+        """
+        live = [x for x in range(len(self.doc_tokens))
+                if x not in self.deleted]
+        self.build([self.doc_tokens[x] for x in live],
+                   [self.doc_keys[x] for x in live])
+        return {old: new for new, old in enumerate(live)}
+
+    def compute_query_terms(self, text):
+        """
+        Compute the tf-idf weights of the known terms in text.
 
         :param text: Text to compute
-        :return: vector
+        :return: Tuple of the term indices and their tf-idf weights
         """
         words = self.ali_chat.get_unigrams_and_bigrams(text)
         freq_dict = {}
         for w in words:
-            if w in freq_dict:
-                freq_dict[w] += 1
-            else:
-                freq_dict[w] = 1
-        vec = np.zeros(len(self.unique_words), dtype=np.float32)
+            if w in self.indexed_words:
+                freq_dict[w] = freq_dict.get(w, 0) + 1
         total_tokens = len(words)
-        if total_tokens:
-            for w, count in freq_dict.items():
-                if w in self.indexed_words:
-                    w_idx = self.indexed_words[w]
-                    tf = count / total_tokens
-                    vec[w_idx] = tf * self.idf[w_idx]
+        term_idx = np.fromiter((self.indexed_words[w] for w in freq_dict),
+                               dtype=np.int64, count=len(freq_dict))
+        tf = np.fromiter(freq_dict.values(), dtype=np.float64,
+                         count=len(freq_dict)) / max(total_tokens, 1)
+        weights = tf.astype(np.float32) * self.idf[term_idx]
+        return term_idx, weights
+
+    def compute_vector(self, text):
+        """
+        Compute the tf-idf vector for an arbitrary piece of text.
+
+        :param text: Text to compute
+        :return: vector
+        """
+        vec = np.zeros(len(self.unique_words), dtype=np.float32)
+        term_idx, weights = self.compute_query_terms(text)
+        vec[term_idx] = weights
         return vec
 
+    def cosine_scores(self, text):
+        """
+        Cosine similarity of text's tf-idf vector with every trained doc.
+
+        :param text: Text to score the docs against
+        :return: Array of the similarity of each doc, or None if text has
+            no terms in the trained vocabulary
+        """
+        if not self.tfidf_matrix.any() or self.tfidf_matrix.shape[0] == 0:
+            return None
+        term_idx, weights = self.compute_query_terms(text)
+        query_norm = np.linalg.norm(weights)
+        if query_norm < 1e-10:
+            return None
+        if len(self.doc_norms) != self.tfidf_matrix.shape[0]:
+            self.doc_norms = self.tfidf_matrix.row_norms()
+        dots = self.tfidf_matrix.dot(term_idx, weights)
+        sims = np.divide(
+            dots, self.doc_norms * query_norm,
+            out=np.zeros_like(dots, dtype=np.float64),
+            where=self.doc_norms >= 1e-10)
+        return sims
+
     def search(self, text, top_k=1):
         """
         Given text returns most similar of the trained documents.
@@ -5009,32 +5727,54 @@ class TfIdfTransformer(object):
         :param top_k: Number of results to return
         :return: List of the similar documents
         """
-        if not self.tfidf_matrix.any() or self.tfidf_matrix.shape[0] == 0:
-            return []
-        query_vec = self.compute_vector(text)
-
-        # Cosine similarity with each doc, vectorized:
-        # sim = (matrix @ query) / (norm(query) * norms(docs)).
-        # Doc norms are cached on the instance; the getattr guard
-        # covers transformers unpickled from before the attribute
-        # existed (pickle restores state without __init__).
-        query_norm = np.linalg.norm(query_vec)
-        if query_norm < 1e-10:
+        sims = self.cosine_scores(text)
+        if sims is None:
             return []
-        doc_norms = getattr(self, 'doc_norms', None)
-        if doc_norms is None or len(doc_norms) != self.tfidf_matrix.shape[0]:
-            doc_norms = np.linalg.norm(self.tfidf_matrix, axis=1)
-            self.doc_norms = doc_norms
-        dots = self.tfidf_matrix @ query_vec
-        sims = np.divide(
-            dots, doc_norms * query_norm,
-            out=np.zeros_like(dots, dtype=np.float64),
-            where=doc_norms >= 1e-10)
-        similar_docs = list(enumerate(sims.tolist()))
-        similar_docs.sort(key=lambda x: x[1], reverse=True)
-        similar_docs = similar_docs[:top_k]
+        order = utl.top_k_indices(sims, top_k)
+        similar_docs = list(zip(order.tolist(), sims[order].tolist()))
         return similar_docs
 
+    def bm25_length_norms(self, k1=1.5, b=0.75):
+        """
+        Per doc length normalization of the bm25 denominator, cached for
+        each k1 and b.
+
+        :param k1: Term frequency saturation
+        :param b: Doc length normalization
+        :return: Array of k1 * (1 - b + b * doc_len / avg_dl) for each doc
+        """
+        if (k1, b) not in self.bm25_norms:
+            doc_lengths = np.asarray(self.doc_lengths, dtype=np.float64)
+            rel_lengths = doc_lengths / self.avg_dl if self.avg_dl else 0.
+            self.bm25_norms[(k1, b)] = k1 * (1.0 - b + b * rel_lengths)
+        return self.bm25_norms[(k1, b)]
+
+    def bm25_scores(self, text, k1=1.5, b=0.75):
+        """
+        BM25 score of every trained doc, summed over the postings of the
+        distinct query terms.
+
+        :param text: Text to score the docs against
+        :param k1: Term frequency saturation
+        :param b: Doc length normalization
+        :return: Array of the score of each doc, or None if text has no
+            tokens or nothing is trained
+        """
+        if not self.doc_tokens:
+            return None
+        q_tokens = self.ali_chat.get_unigrams_and_bigrams(text)
+        if not q_tokens:
+            return None
+        term_idx = list({self.indexed_words[x]: None for x in q_tokens
+                         if x in self.indexed_words})
+        docs, tf, owner = self.term_counts.postings(term_idx)
+        tf = tf.astype(np.float64)
+        norms = self.bm25_length_norms(k1, b)
+        idf = self.bm25_idf_values[np.asarray(term_idx, dtype=np.int64)]
+        weights = idf[owner] * (tf * (k1 + 1.0)) / (tf + norms[docs])
+        return np.bincount(docs, weights=weights,
+                           minlength=self.term_counts.shape[0])
+
     def bm25_search(self, text, top_k=1, k1=1.5, b=0.75):
         """
         BM25-based retrieval,
@@ -5045,26 +5785,8 @@ class TfIdfTransformer(object):
         :param b: Doc length normalization
         :return: List of the similar documents
         """
-        if not self.doc_tokens:
-            return []
-        q_tokens = self.ali_chat.get_unigrams_and_bigrams(text)
-        if not q_tokens:
+        scores = self.bm25_scores(text, k1=k1, b=b)
+        if scores is None:
             return []
-        query_freqs = {}
-        for qt in q_tokens:
-            query_freqs[qt] = query_freqs.get(qt, 0) + 1
-        scores = []
-        for doc_idx, freq_dict in enumerate(self.doc_freqs):
-            score = 0.0
-            doc_len = self.doc_lengths[doc_idx]
-            for term, q_count in query_freqs.items():
-                if term not in freq_dict:
-                    continue
-                tf = freq_dict[term]
-                idf_val = self.bm25_idf.get(term, 0.0)
-                numerator = tf * (k1 + 1.0)
-                denominator = tf + k1 * (1.0 - b + b * (doc_len / self.avg_dl))
-                score += idf_val * (numerator / denominator)
-            scores.append((doc_idx, score))
-        scores.sort(key=lambda x: x[1], reverse=True)
-        return scores[:top_k]
+        order = utl.top_k_indices(scores, top_k)
+        return list(zip(order.tolist(), scores[order].tolist()))
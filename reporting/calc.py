@@ -72,6 +72,8 @@ def clicks_by_place_date(df):
     """
     if dctc.PN not in df.columns:
         return df
+    if isinstance(df[dctc.PN].dtype, pd.CategoricalDtype):
+        df[dctc.PN] = df[dctc.PN].astype(object)
     df[dctc.PN] = df[dctc.PN].replace(np.nan, 'None')
     df[PLACE_DATE] = (df[vmc.date].astype('U') + df[dctc.PN].astype('U'))
     df_cpd = df.loc[df[dctc.BM].isin([
@@ -171,6 +173,155 @@ def net_cost(df, cost_col=vmc.cost, bm_col=dctc.BM, br_col=dctc.BR):
         return df[cost_col]
 
 
+def before_date(date_col):
+    return lambda df: df[vmc.date] < df[date_col]
+
+
+def after_date(date_col):
+    return lambda df: df[vmc.date] >= df[date_col]
+
+
+def between_dates(start_col, end_col):
+    return lambda df: (df[end_col] > df[vmc.date]) & (
+        df[vmc.date] >= df[start_col])
+
+
+def on_date(date_col):
+    return lambda df: df[vmc.date] == df[date_col]
+
+
+def has_col(col):
+    return lambda df: col in df
+
+
+def rate_times(metric, rate=None, per=None):
+    """
+    Builds a cost expression of rate multiplied by a metric column.
+
+    :param metric: Metric column the rate is applied to
+    :param rate: Rate column, or None to use the br_col passed to the engine
+    :param per: Divisor applied to the metric first, 1000 for CPM style rates
+    :return: Function of the df and br_col returning the cost series
+    """
+    def cost(df, br_col):
+        metric_val = df[metric] if per is None else df[metric] / per
+        return df[rate or br_col] * metric_val
+    return cost
+
+
+# Vectorized equivalent of net_cost.  Each buy model maps to ordered tiers
+# of (condition, cost).  Like the if/elif chain the first condition a row
+# meets prices it, None always matches and a row meeting no condition has
+# no cost.  Rates given as None use the br_col passed to net_cost_engine.
+NET_COST_MODELS = {
+    BM_CPM: [(None, rate_times(vmc.impressions, per=1000))],
+    BM_AV: [(None, rate_times(vmc.impressions, per=1000))],
+    BM_CPC: [(None, rate_times(vmc.clicks))],
+    BM_CPV: [(None, rate_times(vmc.views))],
+    BM_CPCV: [(None, rate_times(vmc.views100))],
+    BM_CPLP: [(None, rate_times(vmc.landingpage))],
+    BM_CPVM: [(None, rate_times(vmc.view_imps, per=1000))],
+    BM_PA: [(None, lambda df, br_col: df[vmc.cost] / .85)],
+    BM_CPE: [(has_col(vmc.engagements), rate_times(vmc.engagements))],
+    BM_FLAT: [(on_date(dctc.PD), rate_times(CLI_PD))],
+    BM_FLAT2: [(on_date(dctc.PD), rate_times(CLI_PD))],
+    BM_FLATIMP: [(on_date(dctc.PD), rate_times(IMP_PD))],
+    BM_FLATCOUNT: [(None, rate_times(CLI_PD))],
+    BM_CPACPM: [
+        (before_date(dctc.PD), rate_times(vmc.conv1)),
+        (None, rate_times(vmc.impressions, rate=dctc.BR2, per=1000))],
+    BM_CPNUCPSU: [(None, lambda df, br_col: (
+        rate_times(vmc.newuser)(df, br_col) +
+        rate_times(vmc.signup, rate=dctc.BR2)(df, br_col)))],
+    BM_CPA: [(has_col(vmc.conv1), rate_times(vmc.conv1, rate=dctc.BR))],
+    BM_CPA2: [
+        (before_date(dctc.PD), rate_times(vmc.conv1, rate=dctc.BR)),
+        (None, rate_times(vmc.conv1, rate=dctc.BR2))],
+    BM_CPLP2: [
+        (before_date(dctc.PD), rate_times(vmc.landingpage, rate=dctc.BR)),
+        (None, rate_times(vmc.landingpage, rate=dctc.BR2))],
+    BM_CPA3: [
+        (after_date(dctc.PD2), rate_times(vmc.conv1, rate=dctc.BR3)),
+        (before_date(dctc.PD), rate_times(vmc.conv1, rate=dctc.BR)),
+        (between_dates(dctc.PD, dctc.PD2),
+         rate_times(vmc.conv1, rate=dctc.BR2))],
+    BM_CPLP3: [
+        (after_date(dctc.PD2), rate_times(vmc.landingpage, rate=dctc.BR3)),
+        (before_date(dctc.PD), rate_times(vmc.landingpage, rate=dctc.BR)),
+        (between_dates(dctc.PD, dctc.PD2),
+         rate_times(vmc.landingpage, rate=dctc.BR2))],
+    BM_CPA4: [
+        (after_date(dctc.PD3), rate_times(vmc.conv1, rate=dctc.BR4)),
+        (before_date(dctc.PD), rate_times(vmc.conv1, rate=dctc.BR)),
+        (between_dates(dctc.PD2, dctc.PD3),
+         rate_times(vmc.conv1, rate=dctc.BR3)),
+        (between_dates(dctc.PD, dctc.PD2),
+         rate_times(vmc.conv1, rate=dctc.BR2))],
+    BM_CPA5: [
+        (after_date(dctc.PD4), rate_times(vmc.conv1, rate=dctc.BR5)),
+        (before_date(dctc.PD), rate_times(vmc.conv1, rate=dctc.BR)),
+        (between_dates(dctc.PD3, dctc.PD4),
+         rate_times(vmc.conv1, rate=dctc.BR4)),
+        (between_dates(dctc.PD2, dctc.PD3),
+         rate_times(vmc.conv1, rate=dctc.BR3)),
+        (between_dates(dctc.PD, dctc.PD2),
+         rate_times(vmc.conv1, rate=dctc.BR2))],
+}
+
+
+def add_buy_model(buy_model, tiers):
+    """
+    Registers a buy model with the vectorized net cost engine.
+
+    :param buy_model: Name of the buy model as it appears in the dictionary
+    :param tiers: Ordered list of (condition, cost) tuples, see
+        NET_COST_MODELS
+    :return: None
+    """
+    NET_COST_MODELS[buy_model] = tiers
+    if buy_model not in BUY_MODELS:
+        BUY_MODELS.append(buy_model)
+
+
+def net_cost_engine(df, cost_col=vmc.cost, bm_col=dctc.BM, br_col=dctc.BR):
+    """
+    Vectorized net_cost, pricing every buy model in NET_COST_MODELS with
+    masked column expressions.  Buy models not in the registry keep their
+    cost_col value as net_cost does.
+
+    :param df: The df to calculate cost for
+    :param cost_col: Cost column returned for unregistered buy models
+    :param bm_col: Buy model column
+    :param br_col: Default rate column
+    :return: Float series of the cost indexed as df
+    """
+    calc_ser = pd.Series(np.nan, index=df.index, dtype=float)
+    buy_models = df[bm_col].to_numpy()
+    unpriced = np.ones(len(df), dtype=bool)
+    for buy_model, tiers in NET_COST_MODELS.items():
+        model_rows = np.flatnonzero(buy_models == buy_model)
+        if not model_rows.size:
+            continue
+        unpriced[model_rows] = False
+        for condition, cost in tiers:
+            mdf = df.iloc[model_rows]
+            if condition is not None:
+                is_met = np.broadcast_to(
+                    np.asarray(condition(mdf), dtype=bool), model_rows.shape)
+                met_rows = model_rows[is_met]
+                model_rows = model_rows[~is_met]
+                mdf = df.iloc[met_rows]
+            else:
+                met_rows, model_rows = model_rows, model_rows[:0]
+            if met_rows.size:
+                calc_ser.iloc[met_rows] = cost(mdf, br_col).to_numpy()
+            if not model_rows.size:
+                break
+    if unpriced.any():
+        calc_ser.iloc[unpriced] = df[cost_col].iloc[unpriced].to_numpy()
+    return calc_ser
+
+
 def net_cost_calculation(df):
     logging.info('Calculating Net Cost')
     df = clicks_by_place_date(df)
@@ -183,7 +334,7 @@ def net_cost_calculation(df):
             logging.warning('{} buy model specified '
                             'without conversion {}.'.format(col[0], col[1]))
             df[col[1]] = 0
-    calc_ser = df[df[dctc.BM].isin(BUY_MODELS)].apply(net_cost, axis=1)
+    calc_ser = net_cost_engine(df[df[dctc.BM].isin(BUY_MODELS)])
     if not calc_ser.empty:
         df.loc[calc_ser.index, vmc.cost] = calc_ser
     return df
@@ -201,7 +352,7 @@ def net_plan_comp(df, p_col=dctc.PFPN, n_cost=vmc.cost, p_cost=dctc.PNC):
     if p_col not in nc_pnc.columns:
         logging.warning('{} not in df, continuing.'.format(p_col))
         return df
-    nc_pnc = nc_pnc.groupby(p_col)[[p_cost, n_cost]].sum()
+    nc_pnc = nc_pnc.groupby(p_col, observed=True)[[p_cost, n_cost]].sum()
     nc_pnc = nc_pnc[nc_pnc[p_cost] > 0]
     if p_cost not in nc_pnc.columns:
         nc_pnc[p_cost] = 0
@@ -222,7 +373,7 @@ def net_cum_sum(df, p_col=dctc.PFPN, n_cost=vmc.cost):
     :return: The df with the calculation made in the cumulative sum column
     """
     df = utl.data_to_type(df, float_col=[n_cost])
-    nc_cum_sum = (df.groupby([p_col, vmc.date])[n_cost].sum()
+    nc_cum_sum = (df.groupby([p_col, vmc.date], observed=True)[n_cost].sum()
                   .groupby(level=[0]).cumsum()).reset_index()
     nc_cum_sum.columns = [p_col] + NC_CUM_SUM_COL
     df = df.merge(nc_cum_sum, on=[p_col, vmc.date], how='left')
@@ -230,7 +381,8 @@ def net_cum_sum(df, p_col=dctc.PFPN, n_cost=vmc.cost):
 
 
 def net_sum_date(df, p_col=dctc.PFPN, n_cost=vmc.cost):
-    nc_sum_date = df.groupby([p_col, vmc.date])[n_cost].sum().reset_index()
+    nc_sum_date = (df.groupby([p_col, vmc.date], observed=True)[n_cost]
+                   .sum().reset_index())
     nc_sum_date.columns = [p_col] + NC_SUM_DATE_COL
     df = df.merge(nc_sum_date, on=[p_col, vmc.date], how='left')
     return df
@@ -239,7 +391,7 @@ def net_sum_date(df, p_col=dctc.PFPN, n_cost=vmc.cost):
 def net_cost_final(df, p_col=dctc.PFPN, n_cost=vmc.cost):
     dim_cols = [vmc.date, p_col]
     tdf = df[df[NC_CUM_SUM] > df[DIF_PNC]][dim_cols]
-    tdf = tdf.groupby([p_col]).min().reset_index()
+    tdf = tdf.groupby([p_col], observed=True).min().reset_index()
     if not tdf.empty:
         tdf = tdf[dim_cols]
         tdf[NC_CUM_SUM_MIN_DATE] = True
@@ -263,6 +415,10 @@ def net_cost_final_calculation(df, p_col=dctc.PFPN, n_cost=vmc.cost,
     """
     Caps a metric at another metric based on a grouped dimension column
 
+    Sums by p_col and date are made once and taken back onto the rows by
+    group number, so the df is not merged with each intermediate column as
+    in net_plan_comp, net_cum_sum, net_sum_date and net_cost_final.
+
     :param df: The dataframe with all metrics/dimensions
     :param p_col: The column with the dimension to group by
     :param n_cost: The column with the metric to be capped
@@ -273,10 +429,48 @@ def net_cost_final_calculation(df, p_col=dctc.PFPN, n_cost=vmc.cost,
     if p_col not in df.columns:
         logging.warning('{} not in df, could not calculate.'.format(p_col))
         return df
-    df = net_plan_comp(df, p_col=p_col, n_cost=n_cost, p_cost=p_cost)
-    df = net_cum_sum(df, p_col=p_col, n_cost=n_cost)
-    df = net_sum_date(df, p_col=p_col, n_cost=n_cost)
-    df = net_cost_final(df, p_col=p_col, n_cost=n_cost)
+    df = utl.data_to_type(df, float_col=[p_cost])
+    for col in [p_cost, vmc.cost]:
+        if col not in df.columns:
+            df[col] = 0
+    df[p_cost] = df[p_cost].fillna(0)
+    df = utl.data_to_type(df, float_col=[n_cost])
+    df = df.reset_index(drop=True)
+    plan_df = df
+    if dctc.UNC in df.columns:
+        plan_df = df[df[dctc.UNC] != True]
+    plan = plan_df.groupby(p_col, observed=True)[p_cost].sum()
+    plan = plan[plan > 0]
+    groups = df.groupby([p_col, vmc.date], observed=True)
+    sum_date = groups[n_cost].sum()
+    cum_sum = sum_date.groupby(level=0, observed=True).cumsum().to_numpy()
+    dif_pnc = plan.reindex(sum_date.index.get_level_values(0)).to_numpy()
+    over = cum_sum > dif_pnc
+    first_over = over & (pd.Series(over).groupby(
+        sum_date.index.codes[0]).cumsum().to_numpy() == 1)
+    group_num = groups.ngroup().to_numpy()
+    has_group = ~np.isnan(group_num)
+    group_num = group_num[has_group].astype(int)
+    row_over = np.zeros(len(df.index), dtype=bool)
+    row_over[has_group] = over[group_num]
+    if not row_over.any():
+        df[NCF] = df[n_cost]
+    else:
+        row_first = np.zeros(len(df.index), dtype=bool)
+        row_first[has_group] = first_over[group_num]
+        group_cols = []
+        for group_ser in [sum_date.to_numpy(), cum_sum, dif_pnc]:
+            row_ser = np.full(len(df.index), np.nan)
+            row_ser[has_group] = group_ser[group_num]
+            group_cols.append(row_ser)
+        nc_sum_date, nc_cum_sum, nc_dif_pnc = group_cols
+        n_cost_ser = df[n_cost].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            capped = (n_cost_ser - (n_cost_ser / nc_sum_date) *
+                      (nc_cum_sum - nc_dif_pnc))
+        df[NCF] = np.where(row_over, np.where(row_first, capped, 0),
+                           df[vmc.cost])
+    df = utl.col_removal(df, 'Raw Data', DROP_COL, warn=False)
     return df
 
 
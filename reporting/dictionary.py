@@ -10,6 +10,106 @@ import reporting.vmcolumns as vmc
 csv_path = utl.dict_path
 
 
+class ConfigRegistry(object):
+    """
+    Run scoped store of the config csvs the dictionaries read for every data
+    source.  Each file is parsed once and handed out as a copy, so callers
+    can change it freely, and is parsed again when its mtime or size change.
+    """
+    configs = {}
+    parsed = 0
+    reused = 0
+
+    @classmethod
+    def read(cls, filename, path=None, **kwargs):
+        """
+        Reads a config csv through utl.import_read_csv, reusing the parsed
+        df while the file is unchanged.
+
+        :param filename: Name of the csv
+        :param path: Directory of the csv
+        :param kwargs: Further arguments passed to utl.import_read_csv
+        :return: A copy of the parsed df
+        """
+        full_name = os.path.join(path, filename) if path else filename
+        if not os.path.isfile(full_name):
+            return utl.import_read_csv(filename, path, **kwargs)
+        stat = os.stat(full_name)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        key = (os.path.abspath(full_name), tuple(sorted(kwargs.items())))
+        if key in cls.configs and cls.configs[key][0] == stamp:
+            cls.reused += 1
+        else:
+            df = utl.import_read_csv(filename, path, **kwargs)
+            if not isinstance(df, pd.DataFrame):
+                return df
+            cls.configs[key] = (stamp, df)
+            cls.parsed += 1
+        return cls.configs[key][1].copy()
+
+    @classmethod
+    def invalidate(cls, full_name):
+        full_name = os.path.abspath(full_name)
+        cls.configs = {k: v for k, v in cls.configs.items()
+                       if k[0] != full_name}
+
+    @classmethod
+    def reset(cls):
+        cls.configs = {}
+        cls.parsed = 0
+        cls.reused = 0
+
+    @classmethod
+    def log(cls, label):
+        logging.info('{} config reads  parsed: {}  reused: {}'.format(
+            label, cls.parsed, cls.reused))
+
+
+class DictIndex(object):
+    """
+    Hash index of the key column of a dictionary, usually Full Placement
+    Name, so data can be matched to placements with a lookup instead of a
+    merge with the whole dictionary.  Keeps the raw keys, for merges, and
+    the keys with missing values filled as error reports compare them.
+    """
+    def __init__(self, raw_keys):
+        """
+        :param raw_keys: The key column of the dictionary
+        """
+        self.raw_keys = pd.Index(raw_keys)
+        self.keys = pd.Index(pd.Series(raw_keys).fillna(''))
+
+    def matches(self, raw_keys):
+        raw_keys = pd.Index(raw_keys)
+        return (raw_keys.dtype == self.raw_keys.dtype and
+                raw_keys.equals(self.raw_keys))
+
+    def merge(self, df, data_dict, colname):
+        """
+        Left merges a dictionary onto df by looking up the raw keys, giving
+        the same frame as df.merge(data_dict, on=colname, how='left').
+
+        :param df: The df to merge the dictionary onto
+        :param data_dict: The dictionary df this index was built from
+        :param colname: The key column
+        :return: The merged df, or None if the lookup does not apply, like
+            when keys repeat or are missing
+        """
+        dict_cols = [x for x in data_dict.columns if x != colname]
+        if (colname not in df.columns or df.columns.duplicated().any() or
+                df[colname].dtype != object or
+                self.raw_keys.dtype != object or
+                not self.raw_keys.is_unique or self.raw_keys.hasnans or
+                df[colname].hasnans or
+                [x for x in dict_cols if x in df.columns]):
+            return None
+        positions = self.raw_keys.get_indexer(df[colname])
+        right = data_dict[dict_cols].reset_index(drop=True)
+        right = right.reindex(positions).reset_index(drop=True)
+        df = df.reset_index(drop=True)
+        return pd.concat([df, right], axis=1)
+
+
 class Dict(object):
     def __init__(self, filename=None, vk=None, df=None):
         utl.dir_check(csv_path)
@@ -22,6 +122,7 @@ class Dict(object):
         self.comb_key = ':::'
         self.dict_path = csv_path
         self.data_dict = pd.DataFrame(columns=dctc.COLS, index=None)
+        self.index = None
         if filename:
             self.dict_path_filename = os.path.join(self.dict_path,
                                                    self.filename)
@@ -38,9 +139,13 @@ class Dict(object):
         return data_dict
 
     def read(self):
-        if not os.path.isfile(self.dict_path_filename):
-            self.create_new_dictionary()
-        self.data_dict = utl.import_read_csv(self.filename, self.dict_path)
+        if utl.WriteJournal.contains(self.dict_path_filename):
+            self.data_dict = utl.WriteJournal.read(self.dict_path_filename)
+        else:
+            if not os.path.isfile(self.dict_path_filename):
+                self.create_new_dictionary()
+            self.data_dict = utl.import_read_csv(self.filename,
+                                                 self.dict_path)
         if not isinstance(self.data_dict, pd.DataFrame) and not self.data_dict:
             self.data_dict = self.create_new_dictionary()
         self.clean()
@@ -49,10 +154,25 @@ class Dict(object):
     def get(self):
         return self.data_dict
 
+    def get_index(self, colname=dctc.FPN):
+        """
+        Gets the DictIndex of the dictionary keys, building it again only
+        when the keys changed since the last call.
+
+        :param colname: The key column
+        :return: The DictIndex
+        """
+        raw_keys = self.data_dict[colname]
+        if self.index is None or not self.index.matches(raw_keys):
+            self.index = DictIndex(raw_keys)
+        return self.index
+
     def merge(self, df, colname):
         logging.info('Merging {}'.format(self.filename))
-        df = df.merge(self.data_dict, on=colname, how='left')
-        return df
+        ndf = self.get_index(colname).merge(df, self.data_dict, colname)
+        if ndf is None:
+            ndf = df.merge(self.data_dict, on=colname, how='left')
+        return ndf
 
     def auto_functions(self, err, autodicord, placement, rc_auto):
         self.auto(err, autodicord, placement, rc_auto)
@@ -476,7 +596,7 @@ class Dict(object):
         if df is None:
             df = self.data_dict
         try:
-            df.to_csv(self.dict_path_filename, index=False, encoding='utf-8')
+            utl.WriteJournal.write(df, self.dict_path_filename)
         except IOError:
             logging.warning('{} could not be opened.  This dictionary'
                             'was not saved.'.format(self.filename))
@@ -503,12 +623,13 @@ class RelationalConfig(object):
         try:
             df.to_csv(os.path.join(self.csv_path, configfile), index=False,
                       encoding='utf-8')
+            ConfigRegistry.invalidate(os.path.join(self.csv_path, configfile))
         except IOError:
             logging.warning('{} could not be opened.  This dictionary'
                             'was not saved.'.format(configfile))
 
     def read(self, configfile):
-        self.df = utl.import_read_csv(configfile, self.csv_path)
+        self.df = ConfigRegistry.read(configfile, self.csv_path)
         if self.df.empty:
             logging.debug('No Relational Dictionary config')
             return None
@@ -573,8 +694,11 @@ class DictRelational(object):
             logging.info('Creating {}'.format(self.filename))
             df = pd.DataFrame(columns=self.columns, index=None)
             df.to_csv(self.full_file_path, index=False, encoding='utf-8')
-        self.df = utl.import_read_csv(self.filename, self.csv_path,
-                                      empty_df=True)
+        if utl.WriteJournal.contains(self.full_file_path):
+            self.df = utl.WriteJournal.read(self.full_file_path, empty_df=True)
+        else:
+            self.df = ConfigRegistry.read(self.filename, self.csv_path,
+                                          empty_df=True)
         if self.df.empty:
             self.df = pd.DataFrame(columns=self.columns)
         self.df = utl.data_to_type(self.df, str_col=[self.key])
@@ -616,7 +740,8 @@ class DictRelational(object):
         if df is None:
             df = self.df
         try:
-            df.to_csv(self.full_file_path, index=False, encoding='utf-8')
+            utl.WriteJournal.write(df, self.full_file_path, shared=True)
+            ConfigRegistry.invalidate(self.full_file_path)
         except IOError:
             logging.warning('{} could not be opened.  This dictionary '
                             'was not saved.'.format(self.filename))
@@ -624,8 +749,9 @@ class DictRelational(object):
     def apply_to_dict(self, data_dict):
         if self.key not in data_dict.columns:
             return data_dict
-        self.read()
-        self.add_key_values(data_dict)
+        with utl.SharedFileLock():
+            self.read()
+            self.add_key_values(data_dict)
         data_dict = utl.data_to_type(data_dict, str_col=[self.key])
         cols = [x for x in data_dict.columns if x[-2:] != '_x']
         data_dict = data_dict[cols]
@@ -669,12 +795,13 @@ class DictConstantConfig(object):
         self.dict_constants = None
 
     def read_raw_df(self, configfile):
-        try:
-            self.df = utl.import_read_csv(configfile, self.csv_path)
-        except IOError:
-            logging.debug('No Constant Dictionary config')
-            return None
-        self.check_for_dict_col(configfile)
+        with utl.SharedFileLock():
+            try:
+                self.df = ConfigRegistry.read(configfile, self.csv_path)
+            except IOError:
+                logging.debug('No Constant Dictionary config')
+                return None
+            self.check_for_dict_col(configfile)
 
     def read(self, configfile):
         self.read_raw_df(configfile)
@@ -692,6 +819,7 @@ class DictConstantConfig(object):
         try:
             df.to_csv(os.path.join(self.csv_path, configfile), index=False,
                       encoding='utf-8')
+            ConfigRegistry.invalidate(os.path.join(self.csv_path, configfile))
         except IOError:
             logging.warning('{} could not be opened.  This dictionary'
                             'was not saved.'.format(configfile))
@@ -722,7 +850,7 @@ class DictTranslationConfig(object):
 
     def read(self, configfile):
         try:
-            self.df = utl.import_read_csv(configfile, self.csv_path)
+            self.df = ConfigRegistry.read(configfile, self.csv_path)
         except IOError:
             logging.debug('No Translational Dictionary config')
             return None
@@ -740,6 +868,7 @@ class DictTranslationConfig(object):
         try:
             df.to_csv(os.path.join(self.csv_path, configfile), index=False,
                       encoding='utf-8')
+            ConfigRegistry.invalidate(os.path.join(self.csv_path, configfile))
         except IOError:
             logging.warning('{} could not be opened.  This dictionary '
                             'was not saved.'.format(configfile))
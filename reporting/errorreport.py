@@ -3,6 +3,7 @@ import os.path
 import sys
 import pandas as pd
 import reporting.utils as utl
+import reporting.dictionary as dct
 import reporting.dictcolumns as dctc
 
 csv_path = utl.error_path
@@ -66,14 +67,18 @@ class ErrorReport(object):
                              if x in self.df.columns]
             cols_to_merge = list(dict.fromkeys(cols_to_merge))
             self.df = utl.data_to_type(self.df, str_col=self.merge_col)
-            self.dictionary = utl.data_to_type(
-                self.dictionary, str_col=self.merge_col)
-            self.dictionary[self.merge_col] = self.dictionary[
-                self.merge_col].fillna('')
             self.df[self.merge_col] = self.df[self.merge_col].fillna('')
-            self.merge_df = pd.merge(
-                self.df[cols_to_merge], self.dictionary,
-                on=self.merge_col, how='left', indicator=True)
+            index = self.get_index()
+            if index is not None:
+                self.merge_df = self.merge_unmatched(index, cols_to_merge)
+            else:
+                self.dictionary = utl.data_to_type(
+                    self.dictionary, str_col=self.merge_col)
+                self.dictionary[self.merge_col] = self.dictionary[
+                    self.merge_col].fillna('')
+                self.merge_df = pd.merge(
+                    self.df[cols_to_merge], self.dictionary,
+                    on=self.merge_col, how='left', indicator=True)
         data_err = self.merge_df[self.merge_df['_merge'] == 'left_only']
         if self.pn is None:
             merge_col = [self.merge_col]
@@ -85,6 +90,42 @@ class ErrorReport(object):
         data_err = self.drop_error_df_duplicates(data_err, merge_col=merge_col)
         return data_err
 
+    def get_index(self):
+        """
+        Gets the DictIndex of the dictionary keys if the unmatched rows can
+        be found with it, which needs the keys to be unique strings.
+
+        :return: The DictIndex or None
+        """
+        if (self.merge_col not in self.df.columns or
+                self.merge_col not in self.dictionary.columns):
+            return None
+        if isinstance(self.dic, pd.DataFrame):
+            index = dct.DictIndex(self.dictionary[self.merge_col])
+        else:
+            index = self.dic.get_index(self.merge_col)
+        if (index.keys.dtype != object or not index.keys.is_unique or
+                self.df[self.merge_col].dtype != object):
+            return None
+        return index
+
+    def merge_unmatched(self, index, cols_to_merge):
+        """
+        Looks up the keys of df in the dictionary index and merges only the
+        rows not found, which gives the left only rows of a merge of all of
+        df with the dictionary.
+
+        :param index: DictIndex of the dictionary keys
+        :param cols_to_merge: The columns of df to merge
+        :return: The unmatched rows merged with the dictionary columns
+        """
+        df = self.df[cols_to_merge].reset_index(drop=True)
+        df = df[~df[self.merge_col].isin(index.keys)]
+        dictionary = self.dictionary.iloc[:0].astype({self.merge_col: object})
+        merge_df = pd.merge(df, dictionary, on=self.merge_col, how='left',
+                            indicator=True)
+        return merge_df.set_axis(df.index)
+
     @staticmethod
     def drop_error_df_duplicates(data_err, merge_col):
         data_err = data_err[merge_col].drop_duplicates()
@@ -98,14 +139,14 @@ class ErrorReport(object):
         error_file = os.path.join(csv_path, filename)
         if self.data_err.empty:
             try:
-                os.remove(error_file)
+                utl.WriteJournal.remove(error_file)
                 logging.info('All placements defined!  '
                              '{} was deleted.'.format(filename))
             except OSError:
                 logging.info('All placements defined!')
         else:
             try:
-                self.data_err.to_csv(error_file, index=False, encoding='utf-8')
+                utl.WriteJournal.write(self.data_err, error_file)
                 logging.warning('Not all placements defined.  {}'
                                 ' was generated'.format(filename))
             except IOError:
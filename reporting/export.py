@@ -3,9 +3,10 @@ import re
 import io
 import sys
 import json
-import math
+import copy
 import time
 import logging
+import threading
 import psycopg2
 import numpy as np
 import pandas as pd
@@ -18,16 +19,18 @@ import reporting.awss3 as awss3
 import reporting.tbapi as tbapi
 import reporting.azapi as azu
 import reporting.expcolumns as exc
+from concurrent.futures import ThreadPoolExecutor
 
 log = logging.getLogger()
 config_path = utl.config_path
 
 
 class ExportHandler(object):
-    def __init__(self, config_file=None):
+    def __init__(self, config_file=None, workers=1):
         self.export_list = None
         self.config = None
         self.args = None
+        self.workers = workers
         self.config_file = (config_file
                             or os.environ.get('EXP_HANDLER_FILE')
                             or 'config/export_handler.csv')
@@ -63,7 +66,7 @@ class ExportHandler(object):
             self.export_s3(exp_key, azu.AzuApi)
 
     def export_db(self, exp_key, test=False):
-        dbu = DBUpload()
+        dbu = DBUpload(workers=self.workers)
         output_file = exc.test_file if test else exc.output_file
         config_file = exc.test_config if test else exc.config_file
         upload_success = dbu.upload_to_db(
@@ -154,7 +157,10 @@ class ExportHandler(object):
 
 
 class DBUpload(object):
-    def __init__(self):
+    def __init__(self, workers=1):
+        """
+        :param workers: Threads uploading tables of the same level at once
+        """
         self.db = None
         self.dbs = None
         self.dft = None
@@ -162,10 +168,15 @@ class DBUpload(object):
         self.id_col = None
         self.name = None
         self.values = None
+        self.workers = workers
+        self.id_maps = {}
+        self.id_locks = {}
+        self.id_lock = threading.Lock()
 
     def upload_to_db(self, db_file, schema_file, translation_file, data_file,
                      test=False):
         self.db = DB(db_file)
+        self.db.pool_size = max(self.db.pool_size, self.workers + 1)
         if test:
             data_file = os.path.join(exc.test_path, data_file)
         logging.info('Uploading {} to {}'.format(data_file, self.db.db))
@@ -174,8 +185,13 @@ class DBUpload(object):
         if self.dft.df.empty:
             logging.warning('Dataframe empty stopping upload.')
             return False
-        for table in self.dbs.table_list:
-            self.upload_table_to_db(table)
+        self.id_maps = {}
+        for level in self.dbs.get_upload_levels():
+            if self.workers > 1 and len(level) > 1:
+                self.upload_tables_concurrent(level)
+            else:
+                for table in level:
+                    self.upload_table_to_db(table)
         logging.info(
             '{} successfully uploaded to {}'.format(data_file, self.db.db))
         return True
@@ -201,6 +217,34 @@ class DBUpload(object):
         self.update_rows(df, df_rds.columns, table)
         self.delete_rows(df, table)
         self.insert_rows(df, table)
+        with self.get_id_lock(table):
+            self.id_maps.pop(table, None)
+
+    def upload_tables_concurrent(self, tables):
+        """
+        Uploads tables across a pool of threads, each with its own copy of
+        the schema and a connection from the shared pool.
+        Errors are raised once the other tables have finished.
+
+        :param tables: List of tables that do not take ids from each other
+        :return: None
+        """
+        logging.info('Uploading {} tables with {} workers.'.format(
+            len(tables), self.workers))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.upload_table_with_copy, table)
+                       for table in tables]
+        for future in futures:
+            future.result()
+
+    def upload_table_with_copy(self, table):
+        dbu = copy.copy(self)
+        dbu.dbs = copy.copy(self.dbs)
+        dbu.db = self.db.pool_copy()
+        try:
+            dbu.upload_table_to_db(table)
+        finally:
+            dbu.db.close()
 
     def get_upload_df(self, table):
         cols = self.dbs.get_cols_for_export(table)
@@ -224,7 +268,8 @@ class DBUpload(object):
         return ul_df
 
     def read_rds_table(self, table, cols, where_col, where_val):
-        df_rds = self.db.read_rds_table(table, where_col, where_val)
+        df_rds = self.db.read_rds_table(table, where_col, where_val,
+                                        select_cols=cols)
         df_rds = df_rds[cols]
         df_rds = self.dft.clean_types_for_upload(df_rds)
         df_rds = self.delete_rds_duplicates(df_rds, table, cols,
@@ -253,35 +298,24 @@ class DBUpload(object):
             updated_index.extend(df_changed.index)
         if updated_index:
             df_update = self.get_right_df(df_update)
-            df_update = df_update.loc[updated_index]
+            df_update = df_update[df_update.index.isin(updated_index)]
             df_update = df_update[[self.name] + set_cols]
-            set_vals = [tuple(x) for x in df_update.values]
-            set_vals = self.size_check_and_split(set_vals)
-            for set_val in set_vals:
-                if exc.upload_id_col + '_x' in df.columns:
-                    self.db.update_rows_two_where(table, set_cols, set_val,
-                                                  self.name, exc.upload_id_col,
-                                                  self.dft.upload_id)
-                else:
-                    self.db.update_rows(table, set_cols, set_val, self.name)
-
-    @staticmethod
-    def size_check_and_split(set_vals):
-        size = sys.getsizeof(set_vals)
-        max_mem = 1048576.0
-        lists_needed = size / max_mem
-        n = int(math.ceil(len(set_vals) / lists_needed))
-        set_vals = [set_vals[i:i + n] for i in range(0, len(set_vals), n)]
-        return set_vals
+            if exc.upload_id_col + '_x' in df.columns:
+                self.db.update_rows_staged(table, set_cols, df_update,
+                                           self.name, exc.upload_id_col,
+                                           self.dft.upload_id)
+            else:
+                self.db.update_rows_staged(table, set_cols, df_update,
+                                           self.name)
 
     def delete_rows(self, df, table):
         if exc.upload_id_col + '_x' not in df.columns:
             return None
         df_delete = df[df['_merge'] == 'left_only']
-        delete_vals = df_delete[self.name].tolist()
-        if delete_vals:
-            self.db.delete_rows(table, exc.upload_id_col, self.dft.upload_id,
-                                self.name, delete_vals)
+        if not df_delete.empty:
+            self.db.delete_rows_staged(table, exc.upload_id_col,
+                                       self.dft.upload_id,
+                                       df_delete[[self.name]])
 
     def insert_rows(self, df, table):
         df_insert = df[df['_merge'] == 'right_only']
@@ -315,15 +349,47 @@ class DBUpload(object):
         return sliced_df
 
     def format_and_read_rds(self, table, id_config, sliced_df):
+        """
+        Reads the ids of the names in sliced_df from table.  Ids are kept in
+        id_maps for the run so only names not read before are queried.
+
+        :param table: The table with the ids
+        :param id_config: Dict of table to its id and name columns
+        :param sliced_df: The df with the names to read ids for
+        :return: The df of ids and names read from table
+        """
         self.set_id_info(table, id_config, sliced_df)
         self.dbs.set_table(table)
+        with self.get_id_lock(table):
+            df_rds, read_names = self.id_maps.get(table, (None, set()))
+            values = [x for x in dict.fromkeys(self.values)
+                      if x not in read_names]
+            if values or df_rds is None:
+                new_rds = self.read_id_map(table, values)
+                if df_rds is not None:
+                    new_rds = pd.concat([df_rds, new_rds], ignore_index=True)
+                df_rds = new_rds
+                self.id_maps[table] = (df_rds, read_names.union(values))
+        return df_rds[df_rds[self.name].isin(self.values)]
+
+    def get_id_lock(self, table):
+        """
+        Gets the lock guarding the id map of a table, so reading the ids of
+        one table does not hold up the lookups of the others.
+
+        :param table: The table with the ids
+        :return: The lock for table
+        """
+        with self.id_lock:
+            return self.id_locks.setdefault(table, threading.Lock())
+
+    def read_id_map(self, table, values):
         if exc.upload_id_col in self.dbs.cols:
             df_rds = self.db.read_rds_two_where(table, self.id_col, self.name,
-                                                self.values, exc.upload_id_col,
+                                                values, exc.upload_id_col,
                                                 self.dft.upload_id)
         else:
-            df_rds = self.db.read_rds(table, self.id_col, self.name,
-                                      self.values)
+            df_rds = self.db.read_rds(table, self.id_col, self.name, values)
         return df_rds
 
     def set_id_info(self, table, id_config, sliced_df):
@@ -349,6 +415,8 @@ class DB(object):
         self.cursor = None
         self.output = None
         self.conn_string = None
+        self.pool_size = 5
+        self.max_in_values = 1000
         self.config = config
         if self.config:
             self.input_config(self.config)
@@ -360,6 +428,8 @@ class DB(object):
         self.check_config()
         self.conn_string = ('postgresql://{0}:{1}@{2}:{3}/{4}'.
                             format(*self.config_list))
+        self.close()
+        self.engine = None
 
     def load_config(self):
         try:
@@ -386,10 +456,24 @@ class DB(object):
                 logging.warning(item + 'not in DB config file.  Aborting.')
                 sys.exit(0)
 
+    def create_engine(self):
+        connect_args = {}
+        if self.conn_string.startswith('postgresql'):
+            connect_args['sslmode'] = 'prefer'
+        self.engine = sqa.create_engine(self.conn_string,
+                                        connect_args=connect_args,
+                                        pool_size=self.pool_size)
+        return self.engine
+
     def connect(self):
+        """
+        Checks out a connection from the engine pool, returning the last one
+        this instance held so each call starts on a clean transaction.
+        """
         logging.debug('Connecting to DB at Host: ' + self.host)
-        self.engine = sqa.create_engine(self.conn_string,
-                                        connect_args={'sslmode': 'prefer'})
+        if self.engine is None:
+            self.create_engine()
+        self.close()
         try:
             self.connection = self.engine.raw_connection()
         except AssertionError:
@@ -400,6 +484,55 @@ class DB(object):
             self.connect()
         self.cursor = self.connection.cursor()
 
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+        self.cursor = None
+
+    def pool_copy(self):
+        """
+        Copies this instance to share its engine and connection pool, so
+        another thread can connect without the cost of a new engine.
+
+        :return: The copied DB, without a connection checked out
+        """
+        if self.engine is None:
+            self.create_engine()
+        db = copy.copy(self)
+        db.connection = None
+        db.cursor = None
+        db.output = None
+        return db
+
+    def in_filter(self, table, where_col, where_val):
+        """
+        Builds the IN clause filtering where_col of table to where_val.
+        Lists longer than max_in_values are copied to a temp table that is
+        joined on instead of being sent as query parameters.
+
+        :param table: The table where_col is filtered in
+        :param where_col: The column to filter on
+        :param where_val: List of values to keep
+        :return: Tuple of the clause and its query parameters
+        """
+        if len(where_val) <= self.max_in_values:
+            clause = 'IN ({})'.format(', '.join(['%s'] * len(where_val)))
+            return clause, list(where_val)
+        tmp_table = 'tmp_{}_{}'.format(table, where_col)
+        self.cursor.execute("""
+                            CREATE TEMP TABLE {0} ON COMMIT DROP AS
+                             SELECT {1}.{2}.{3} FROM {1}.{2} WITH NO DATA
+                            """.format(tmp_table, self.schema, table,
+                                       where_col))
+        tmp_df = pd.DataFrame({where_col: where_val}).drop_duplicates()
+        output = io.StringIO()
+        tmp_df.to_csv(output, header=False, index=False)
+        output.seek(0)
+        self.cursor.copy_expert(
+            'COPY {} FROM STDIN WITH (FORMAT csv)'.format(tmp_table), output)
+        return 'IN (SELECT {} FROM {})'.format(where_col, tmp_table), []
+
     def df_to_output(self, df):
         if sys.version_info[0] == 3:
             self.output = io.StringIO()
@@ -419,6 +552,103 @@ class DB(object):
         self.connection.commit()
         cur.close()
 
+    def copy_to_staging(self, table, df):
+        """
+        Copies df to a temp table with the columns of df typed as in table.
+        Rows are sent as csv so quotes and backslashes in values are kept.
+        Drivers without COPY, i.e. sqlite3, insert the rows instead.
+
+        :param table: The table the staged rows are applied to
+        :param df: The df of rows to stage
+        :return: The name of the staging table
+        """
+        staging = 'staging_{}'.format(table)
+        cols = ', '.join('"{}"'.format(x) for x in df.columns)
+        self.cursor.execute("""
+                            CREATE TEMP TABLE {0} AS
+                             SELECT {1} FROM {2}.{3} WHERE 1 = 0
+                            """.format(staging, cols, self.schema, table))
+        if hasattr(self.cursor, 'copy_expert'):
+            output = io.StringIO()
+            df.to_csv(output, header=False, index=False)
+            output.seek(0)
+            self.cursor.copy_expert(
+                'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                    staging, cols), output)
+        else:
+            place = '?' if self.engine.dialect.paramstyle == 'qmark' else '%s'
+            self.cursor.executemany(
+                'INSERT INTO {} ({}) VALUES ({})'.format(
+                    staging, cols, ', '.join([place] * len(df.columns))),
+                df.astype(object).values.tolist())
+        return staging
+
+    def update_rows_staged(self, table, set_cols, df, where_col,
+                           where_col2=None, where_val2=None):
+        """
+        Updates set_cols of the rows of table matching where_col in df, with
+        one UPDATE from a staging table df is copied to.
+
+        :param table: The table to update
+        :param set_cols: List of columns to set from df
+        :param df: The df with where_col and set_cols of the changed rows
+        :param where_col: The column rows are matched on
+        :param where_col2: Optional column also filtered to where_val2
+        :param where_val2: The value of where_col2 of the rows to update
+        :return: The number of rows updated
+        """
+        start_time = time.time()
+        self.connect()
+        staging = self.copy_to_staging(table, df[[where_col] + set_cols])
+        command = """
+                  UPDATE {0}.{1} AS t
+                   SET {2}
+                   FROM {3} AS s
+                   WHERE s."{4}" = t."{4}"
+                  """.format(self.schema, table,
+                             ', '.join('"{0}" = s."{0}"'.format(x)
+                                       for x in set_cols),
+                             staging, where_col)
+        if where_col2:
+            command += ' AND t."{}" = {}'.format(where_col2, where_val2)
+        self.cursor.execute(command)
+        row_count = self.cursor.rowcount
+        self.cursor.execute('DROP TABLE {}'.format(staging))
+        self.connection.commit()
+        logging.info('Updated {} row(s) of {} from {} staged row(s) in '
+                     '{:.2f}s'.format(row_count, table, len(df.index),
+                                      time.time() - start_time))
+        return row_count
+
+    def delete_rows_staged(self, table, where_col, where_val, df):
+        """
+        Deletes the rows of table with where_val in where_col and a value of
+        the single column of df, with one DELETE joined to a staging table.
+
+        :param table: The table to delete from
+        :param where_col: The column filtered to where_val
+        :param where_val: The value of where_col of the rows to delete
+        :param df: The df with the column and values of the rows to delete
+        :return: The number of rows deleted
+        """
+        start_time = time.time()
+        self.connect()
+        staging = self.copy_to_staging(table, df)
+        command = """
+                  DELETE FROM {0}.{1}
+                   WHERE "{2}" IN ({3})
+                   AND "{4}" IN (SELECT "{4}" FROM {5})
+                  """.format(self.schema, table, where_col, where_val,
+                             df.columns[0], staging)
+        self.cursor.execute(command)
+        row_count = self.cursor.rowcount
+        self.cursor.execute('DROP TABLE {}'.format(staging))
+        self.connection.commit()
+        logging.info('Deleted {} row(s) of {} from {} staged row(s) in '
+                     '{:.2f}s'.format(row_count, table, len(df.index),
+                                      time.time() - start_time))
+        return row_count
+
     def insert_rds(self, table, columns, values, return_col):
         self.connect()
         command = """
@@ -438,33 +668,32 @@ class DB(object):
         logging.info('Deleting ' + str(len(where_vals2)) +
                      ' row(s) from ' + table)
         self.connect()
+        in_clause, params = self.in_filter(table, where_col2, where_vals2)
         command = """
                   DELETE FROM {0}.{1}
-                   WHERE {0}.{1}.{2} IN ({3}) AND {0}.{1}.{4} IN ({5})
+                   WHERE {0}.{1}.{2} IN ({3}) AND {0}.{1}.{4} {5}
                   """.format(self.schema, table, where_col, where_val,
-                             where_col2,
-                             ', '.join(['%s'] * len(where_vals2)))
-        self.cursor.execute(command, where_vals2)
+                             where_col2, in_clause)
+        self.cursor.execute(command, params)
         self.connection.commit()
 
     def read_rds_two_where(self, table, select_col, where_col, where_val,
                            where_col2, where_val2):
         self.connect()
+        in_clause, params = self.in_filter(table, where_col, where_val)
         if select_col == where_col:
             command = """
                       SELECT {0}.{1}.{2} FROM {0}.{1}
-                       WHERE {0}.{1}.{3} IN ({4}) AND {0}.{1}.{5} IN ({6})
+                       WHERE {0}.{1}.{3} {4} AND {0}.{1}.{5} IN ({6})
                       """.format(self.schema, table, select_col, where_col,
-                                 ', '.join(['%s'] * len(where_val)),
-                                 where_col2, where_val2)
+                                 in_clause, where_col2, where_val2)
         else:
             command = """
                       SELECT {0}.{1}.{2}, {0}.{1}.{3} FROM {0}.{1}
-                       WHERE {0}.{1}.{3} IN ({4}) AND {0}.{1}.{5} IN ({6})
+                       WHERE {0}.{1}.{3} {4} AND {0}.{1}.{5} IN ({6})
                       """.format(self.schema, table, select_col, where_col,
-                                 ', '.join(['%s'] * len(where_val)),
-                                 where_col2, where_val2)
-        self.cursor.execute(command, where_val)
+                                 in_clause, where_col2, where_val2)
+        self.cursor.execute(command, params)
         data = self.cursor.fetchall()
         if select_col == where_col:
             data = pd.DataFrame(data=data, columns=[select_col])
@@ -474,21 +703,22 @@ class DB(object):
 
     def read_rds(self, table, select_col, where_col, where_val):
         self.connect()
+        in_clause, params = self.in_filter(table, where_col, where_val)
         if select_col == where_col:
             command = """
                       SELECT {0}.{1}.{2}
                        FROM {0}.{1}
-                       WHERE {0}.{1}.{3} IN ({4})
+                       WHERE {0}.{1}.{3} {4}
                       """.format(self.schema, table, select_col, where_col,
-                                 ', '.join(['%s'] * len(where_val)))
+                                 in_clause)
         else:
             command = """
                       SELECT {0}.{1}.{2}, {0}.{1}.{3}
                        FROM {0}.{1}
-                       WHERE {0}.{1}.{3} IN ({4})
+                       WHERE {0}.{1}.{3} {4}
                       """.format(self.schema, table, select_col, where_col,
-                                 ', '.join(['%s'] * len(where_val)))
-        self.cursor.execute(command, where_val)
+                                 in_clause)
+        self.cursor.execute(command, params)
         data = self.cursor.fetchall()
         if select_col == where_col:
             data = pd.DataFrame(data=data, columns=[select_col])
@@ -496,60 +726,25 @@ class DB(object):
             data = pd.DataFrame(data=data, columns=[select_col, where_col])
         return data
 
-    def read_rds_table(self, table, where_col, where_val):
+    def read_rds_table(self, table, where_col, where_val, select_cols=None):
         self.connect()
+        in_clause, params = self.in_filter(table, where_col, where_val)
+        select = '*'
+        if select_cols:
+            select = ', '.join('{0}.{1}."{2}"'.format(self.schema, table, x)
+                               for x in select_cols)
         command = """
-                  SELECT *
+                  SELECT {4}
                    FROM {0}.{1}
-                   WHERE {0}.{1}.{2} IN ({3})
-                  """.format(self.schema, table, where_col,
-                             ', '.join(['%s'] * len(where_val)))
-        self.cursor.execute(command, where_val)
+                   WHERE {0}.{1}.{2} {3}
+                  """.format(self.schema, table, where_col, in_clause,
+                             select)
+        self.cursor.execute(command, params)
         columns = [i[0] for i in self.cursor.description]
         data = self.cursor.fetchall()
         data = pd.DataFrame(data=data, columns=columns)
         return data
 
-    def update_rows(self, table, set_cols, set_vals, where_col):
-        logging.info('Updating ' + str(len(set_vals)) +
-                     ' row(s) from ' + table)
-        self.connect()
-        command = """
-                  UPDATE {0}.{1} AS t
-                   SET {2}
-                   FROM (VALUES {3})
-                   AS c({4})
-                   WHERE c.{5} = t.{5}
-                  """.format(self.schema, table,
-                             (', '.join(x + ' = c.' + x
-                              for x in [where_col] + set_cols)),
-                             ', '.join(['%s'] * len(set_vals)),
-                             ', '.join([where_col] + set_cols),
-                             where_col)
-        self.cursor.execute(command, set_vals)
-        self.connection.commit()
-
-    def update_rows_two_where(self, table, set_cols, set_vals, where_col,
-                              where_col2, where_val2):
-        logging.info('Updating ' + str(len(set_vals)) +
-                     ' row(s) from ' + table)
-        self.connect()
-        command = """
-                  UPDATE {0}.{1} AS t
-                   SET {2}
-                   FROM (VALUES {3})
-                   AS c({4})
-                   WHERE c.{5} = t.{5}
-                   AND t.{6} = {7}
-                  """.format(self.schema, table,
-                             (', '.join(x + ' = c.' + x
-                              for x in [where_col] + set_cols)),
-                             ', '.join(['%s'] * len(set_vals)),
-                             ', '.join([where_col] + set_cols),
-                             where_col, where_col2, where_val2)
-        self.cursor.execute(command, set_vals)
-        self.connection.commit()
-
     @staticmethod
     def read_file(filename):
         with open('config/' + str(filename), 'r') as f:
@@ -615,6 +810,26 @@ class DBSchema(object):
         cols_list = [x for x in cols_list if x not in fk_list]
         return fk_list + cols_list
 
+    def get_upload_levels(self):
+        """
+        Groups table_list into levels of tables that can upload at the same
+        time, each table after every table in its FK it takes ids from.
+        Tables in a cycle upload one at a time in table_list order.
+
+        :return: List of lists of tables in upload order
+        """
+        levels = []
+        remaining = list(self.table_list)
+        while remaining:
+            level = [x for x in remaining
+                     if not any(y in remaining and y != x
+                                for y in self.config[exc.fk][x])]
+            if not level:
+                level = remaining[:1]
+            levels.append(level)
+            remaining = [x for x in remaining if x not in level]
+        return levels
+
 
 class DFTranslation(object):
     def __init__(self, config_file, data_file, db=None):
@@ -679,7 +894,7 @@ class DFTranslation(object):
         return df
 
     def load_df(self, datafile):
-        self.df = utl.import_read_csv(datafile)
+        self.df = utl.read_output_file(datafile)
         if self.df.empty:
             logging.warning('Dataframe empty, stopping upload.')
             return False
@@ -0,0 +1,694 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import datetime as dt
+import reporting.utils as utl
+import reporting.vmcolumns as vmc
+import reporting.dictcolumns as dctc
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+cache_path = os.path.join(utl.raw_path, '.cache')
+source_path = os.path.join(cache_path, 'sources')
+word_index_path = os.path.join(cache_path, 'word_index')
+
+
+class FileCache(object):
+    """
+    Shared file handling of the caches: atomic writes, so worker processes
+    can share a cache, and content hashes of files that are only recomputed
+    when the mtime or size of the file changes.
+    """
+    hash_suffix = '.hash'
+
+    def __init__(self, path=cache_path):
+        self.path = path
+
+    def write_atomic(self, file_name, write_func):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_file = '{}.{}{}'.format(file_name, os.getpid(),
+                                    utl.tmp_file_suffix)
+        try:
+            write_func(tmp_file)
+            os.replace(tmp_file, file_name)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    @staticmethod
+    def hash_file(file_name, chunk_size=1024 ** 2):
+        file_hash = hashlib.sha1()
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def get_file_hash(self, file_name):
+        """
+        Gets the content hash of a file, only reading the file when its mtime
+        or size changed since the hash was last stored.
+
+        :param file_name: Path of the file to hash
+        :return: The hex digest of the file contents
+        """
+        stat = os.stat(file_name)
+        path_hash = hashlib.sha1(os.path.abspath(file_name).encode('utf-8'))
+        hash_file = os.path.join(self.path,
+                                 path_hash.hexdigest() + self.hash_suffix)
+        if os.path.isfile(hash_file):
+            with open(hash_file, 'r') as f:
+                hash_dict = json.load(f)
+            if (hash_dict['mtime'] == stat.st_mtime_ns and
+                    hash_dict['size'] == stat.st_size):
+                return hash_dict['hash']
+        hash_dict = {'mtime': stat.st_mtime_ns, 'size': stat.st_size,
+                     'hash': self.hash_file(file_name)}
+
+        def write_hash(tmp_file):
+            with open(tmp_file, 'w') as tf:
+                json.dump(hash_dict, tf)
+        self.write_atomic(hash_file, write_hash)
+        return hash_dict['hash']
+
+
+class RawFileCache(FileCache):
+    """
+    Keeps the parsed, header adjusted frame of each raw file as parquet so
+    unchanged files are not parsed again on the next run.  Entries are keyed
+    on a hash of the file contents and the vendor matrix settings used to
+    read it.  The hash is reused while the mtime and size of the file are
+    unchanged.  Frames that do not round trip through parquet exactly are
+    marked and read from the raw file every run.
+    """
+    cache_suffix = '.parquet'
+    skip_suffix = '.skip'
+
+    def __init__(self, path=cache_path, max_age=30, max_size=2048):
+        """
+        :param path: Directory the cache is kept in
+        :param max_age: Days an entry is kept after it was last used
+        :param max_size: MB the cached frames may take up in total
+        """
+        super().__init__(path)
+        self.max_age = max_age
+        self.max_size = max_size
+
+    def get_key(self, file_name, params):
+        """
+        Builds the cache key from the file contents, any sheet names and the
+        settings used to read it.
+
+        :param file_name: The raw file name, including sheets for xlsx
+        :param params: List of settings that change the parsed frame
+        :return: The hex digest key
+        """
+        file_name = file_name.split(utl.sheet_name_splitter)
+        key = [self.get_file_hash(file_name[0]), file_name[1:], params]
+        key = json.dumps(key, default=str).encode('utf-8')
+        return hashlib.sha1(key).hexdigest()
+
+    def write_frame(self, df, cache_file):
+        """
+        Writes a frame to the cache if it reads back from parquet identical,
+        otherwise marks it to be skipped.
+
+        :param df: The frame to cache
+        :param cache_file: Path of the parquet file to write
+        :return: True if the frame was cached
+        """
+        def write_parquet(tmp_file):
+            df.to_parquet(tmp_file)
+            pd.testing.assert_frame_equal(df, pd.read_parquet(tmp_file),
+                                          check_exact=True)
+        try:
+            self.write_atomic(cache_file, write_parquet)
+            return True
+        except (AssertionError, ValueError, TypeError, pa.ArrowException) as e:
+            logging.info('Not caching {}: {}'.format(cache_file, e))
+            skip_file = cache_file.replace(self.cache_suffix, self.skip_suffix)
+            self.write_atomic(skip_file, lambda x: open(x, 'w').close())
+            return False
+
+    def load(self, file_name, params, read_func):
+        """
+        Returns the cached frame of a raw file or reads and caches it.
+
+        :param file_name: The raw file name, including sheets for xlsx
+        :param params: List of settings that change the parsed frame
+        :param read_func: Function with no arguments that reads the frame
+        :return: The parsed frame
+        """
+        if not os.path.isfile(file_name.split(utl.sheet_name_splitter)[0]):
+            return read_func()
+        cache_file = os.path.join(
+            self.path, self.get_key(file_name, params) + self.cache_suffix)
+        if os.path.isfile(cache_file):
+            try:
+                df = pd.read_parquet(cache_file)
+                os.utime(cache_file)
+                logging.info('Read {} from raw file cache.'.format(file_name))
+                return df
+            except (OSError, pa.ArrowException) as e:
+                logging.warning('Could not read cache {}: {}'.format(
+                    cache_file, e))
+        df = read_func()
+        skip_file = cache_file.replace(self.cache_suffix, self.skip_suffix)
+        if df is not None and not df.empty and not os.path.isfile(skip_file):
+            self.write_frame(df, cache_file)
+        return df
+
+    def evict(self):
+        """
+        Removes entries not used within max_age days, then the least
+        recently used frames until the cache is within max_size.
+
+        :return: Number of files removed
+        """
+        if not os.path.isdir(self.path):
+            return 0
+        files = [os.path.join(self.path, x) for x in os.listdir(self.path)]
+        files = sorted([(os.path.getmtime(x), os.path.getsize(x), x)
+                        for x in files if os.path.isfile(x)], reverse=True)
+        oldest_time = time.time() - self.max_age * 24 * 60 * 60
+        max_size = self.max_size * 1024 ** 2
+        removed = 0
+        total_size = 0
+        for mtime, size, file_name in files:
+            is_frame = file_name.endswith(self.cache_suffix)
+            if mtime < oldest_time or (is_frame and
+                                       total_size + size > max_size):
+                os.remove(file_name)
+                removed += 1
+            elif is_frame:
+                total_size += size
+        if removed:
+            logging.info('Removed {} files from raw file cache.'.format(
+                removed))
+        return removed
+
+
+class SourceCache(FileCache):
+    """
+    Keeps the processed frame of each data source with a fingerprint of
+    everything it was built from, so an incremental vm_loop only rebuilds
+    sources whose inputs changed.  A source that filled in a date from today
+    also has the day in its fingerprint, so it is rebuilt the next day.
+    """
+    frame_suffix = '.pkl'
+    fingerprint_suffix = '.json'
+    merge_types = ['Merge', 'MergeReplace', 'MergeReplaceExclude']
+    config_files = [os.path.join(utl.config_path, x) for x in
+                    [dctc.filename_rel_config, dctc.filename_con_config]]
+    config_dirs = [os.path.join(utl.dict_path, 'Relational'),
+                   os.path.join(utl.dict_path, dctc.filepath_tran_config)]
+
+    def __init__(self, path=source_path, explain=False):
+        """
+        :param path: Directory the cache is kept in
+        :param explain: Log why each data source is rebuilt
+        """
+        super().__init__(path)
+        self.explain = explain
+
+    @staticmethod
+    def hash_value(value):
+        value = json.dumps(value, sort_keys=True, default=str)
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+    def hash_files(self, file_names):
+        return self.hash_value([
+            [x, self.get_file_hash(x) if os.path.isfile(x) else None]
+            for x in file_names])
+
+    def get_config_files(self):
+        file_names = list(self.config_files)
+        for config_dir in self.config_dirs:
+            if os.path.isdir(config_dir):
+                file_names.extend(os.path.join(config_dir, x)
+                                  for x in sorted(os.listdir(config_dir)))
+        return file_names
+
+    @classmethod
+    def get_merge_sources(cls, transform):
+        """
+        Gets the files or vendor keys the merge transforms of a data source
+        read from.
+
+        :param transform: The transform value of the data source
+        :return: List of merge file names or vendor keys
+        """
+        if str(transform) == 'nan':
+            return []
+        transforms = [x.split('::') for x in transform.split(':::')]
+        return [x[1] for x in transforms
+                if x[0] in cls.merge_types and len(x) > 1]
+
+    def get_fingerprint(self, params, vm_rules, merge_params=None,
+                        date_sensitive=False):
+        """
+        Hashes each input of a data source separately, so changes can be
+        explained.  Taken before a build, as building can write to the
+        dictionary it reads.
+
+        :param params: The vendor matrix params of the data source
+        :param vm_rules: The vm rules dict of the vendor matrix
+        :param merge_params: Dict of merge vendor key to its params
+        :param date_sensitive: Include today's date
+        :return: Dict of input name to hash
+        """
+        if merge_params is None:
+            merge_params = {}
+        merges = []
+        for merge_source in self.get_merge_sources(params[vmc.transform]):
+            if merge_source in merge_params:
+                merge_param = merge_params[merge_source]
+                merge_file = merge_param.get(vmc.filename, '')
+                merges.append([merge_param, self.hash_files(
+                    [merge_file.split(utl.sheet_name_splitter)[0]])])
+            else:
+                merges.append(self.hash_files([merge_source]))
+        raw_file = params[vmc.filename].split(utl.sheet_name_splitter)[0]
+        dict_file = os.path.join(utl.dict_path, str(params[vmc.filenamedict]))
+        fingerprint = {
+            'raw file': self.hash_files([raw_file]),
+            'vendor matrix row': self.hash_value(params),
+            'dictionary': self.hash_files([dict_file]),
+            'configs': self.hash_files(self.get_config_files()),
+            'rules': self.hash_value(vm_rules),
+            'merge sources': self.hash_value(merges),
+        }
+        if date_sensitive:
+            fingerprint['date'] = dt.date.today().isoformat()
+        return fingerprint
+
+    def get_file_names(self, vk):
+        name = hashlib.sha1(vk.encode('utf-8')).hexdigest()
+        name = os.path.join(self.path, name)
+        return name + self.fingerprint_suffix, name + self.frame_suffix
+
+    def get_stale_reasons(self, vk, params, vm_rules, merge_params=None):
+        """
+        Compares the stored fingerprint of a data source to its inputs now.
+
+        :param vk: The vendor key of the data source
+        :param params: The vendor matrix params of the data source
+        :param vm_rules: The vm rules dict of the vendor matrix
+        :param merge_params: Dict of merge vendor key to its params
+        :return: List of the inputs that changed, empty if it is fresh
+        """
+        fingerprint_file, frame_file = self.get_file_names(vk)
+        if not (os.path.isfile(fingerprint_file) and
+                os.path.isfile(frame_file)):
+            return ['new']
+        with open(fingerprint_file, 'r') as f:
+            stored = json.load(f)
+        fingerprint = self.get_fingerprint(
+            params, vm_rules, merge_params, 'date' in stored)
+        return [x for x in sorted(set(stored) | set(fingerprint))
+                if stored.get(x) != fingerprint.get(x)]
+
+    def load(self, vk):
+        return pd.read_pickle(self.get_file_names(vk)[1])
+
+    def save(self, vk, df, fingerprint, date_sensitive=False):
+        """
+        Stores the processed frame of a data source with its fingerprint.
+
+        :param vk: The vendor key of the data source
+        :param df: The processed df
+        :param fingerprint: The fingerprint of the inputs the df was built from
+        :param date_sensitive: The df depends on today's date
+        :return: None
+        """
+        if df is None:
+            return None
+        if date_sensitive:
+            fingerprint = dict(fingerprint, date=dt.date.today().isoformat())
+        fingerprint_file, frame_file = self.get_file_names(vk)
+        self.write_atomic(frame_file, df.to_pickle)
+
+        def write_fingerprint(tmp_file):
+            with open(tmp_file, 'w') as f:
+                json.dump(fingerprint, f)
+        self.write_atomic(fingerprint_file, write_fingerprint)
+
+
+class WordIndex(object):
+    """
+    Read only index of the object ids whose name contains each word, held
+    as sorted arrays so it can be memory mapped from a WordIndexCache and
+    shared by every worker process.  The words are one utf-8 byte string
+    with offsets, so the arrays grow with the total length of the words
+    rather than their count times the longest one.  Objects changed since
+    the arrays were built are held in a small delta, which lookups merge
+    and a rebuild folds in.  Reads like the dict of word to list of ids it
+    is built from.
+    """
+    array_names = ['term_text', 'term_offsets', 'term_ptr', 'term_ids',
+                   'obj_ids', 'obj_ptr', 'obj_terms']
+
+    def __init__(self, term_text, term_offsets, term_ptr, term_ids, obj_ids,
+                 obj_ptr, obj_terms, delta_words=None, removed=None):
+        """
+        :param term_text: Bytes of the utf-8 words sorted and concatenated
+        :param term_offsets: Offsets of each word in term_text
+        :param term_ptr: Offsets of each word's ids in term_ids
+        :param term_ids: Ids of each word, in the order they were indexed
+        :param obj_ids: Sorted array of the indexed object ids
+        :param obj_ptr: Offsets of each object's words in obj_terms
+        :param obj_terms: Index in the words of each object's words
+        :param delta_words: Dict of id to words of the objects added or
+            changed since the arrays were built
+        :param removed: Ids in the arrays changed or deleted since
+        """
+        self.term_text = term_text
+        self.term_offsets = term_offsets
+        self.term_ptr = term_ptr
+        self.term_ids = term_ids
+        self.obj_ids = obj_ids
+        self.obj_ptr = obj_ptr
+        self.obj_terms = obj_terms
+        # Plain views for the binary search, slicing a memmap is slow.
+        self.text_view = memoryview(np.asarray(term_text))
+        self.offsets_view = np.asarray(term_offsets)
+        self.delta_words = delta_words if delta_words else {}
+        self.removed = set(removed) if removed else set()
+        self.removed_ids = np.array(sorted(self.removed), dtype=np.int64)
+        self.delta_idx = {}
+        for obj_id, words in self.delta_words.items():
+            for word in words:
+                self.delta_idx.setdefault(word, []).append(obj_id)
+
+    @classmethod
+    def from_dict(cls, word_idx, id_words):
+        """
+        :param word_idx: Dict of word to list of object ids
+        :param id_words: Dict of object id to the list of its words
+        :return: The WordIndex
+        """
+        terms = sorted(word_idx, key=lambda x: x.encode('utf-8'))
+        term_pos = {x: i for i, x in enumerate(terms)}
+        encoded = [x.encode('utf-8') for x in terms]
+        obj_ids = sorted(id_words)
+        return cls(
+            np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            np.cumsum([0] + [len(x) for x in encoded], dtype=np.int64),
+            np.cumsum([0] + [len(word_idx[x]) for x in terms]),
+            np.array([y for x in terms for y in word_idx[x]], dtype=np.int64),
+            np.array(obj_ids, dtype=np.int64),
+            np.cumsum([0] + [len(id_words[x]) for x in obj_ids]),
+            np.array([term_pos[y] for x in obj_ids for y in id_words[x]],
+                     dtype=np.int64))
+
+    def with_delta(self, delta_words, removed):
+        """
+        :param delta_words: Dict of id to words of added or changed objects
+        :param removed: Ids in the arrays changed or deleted
+        :return: WordIndex sharing these arrays with the delta applied
+        """
+        return WordIndex(*[getattr(self, x) for x in self.array_names],
+                         delta_words=delta_words, removed=removed)
+
+    def delta_dict(self):
+        return {'id_words': [[k, v] for k, v in self.delta_words.items()],
+                'removed': sorted(self.removed)}
+
+    def delta_size(self):
+        return len(self.delta_words) + len(self.removed)
+
+    def in_arrays(self, obj_id):
+        try:
+            idx = np.searchsorted(self.obj_ids, obj_id)
+        except (TypeError, ValueError):
+            return False
+        return bool(idx < len(self.obj_ids) and self.obj_ids[idx] == obj_id)
+
+    def has_id(self, obj_id):
+        if obj_id in self.delta_words:
+            return True
+        return obj_id not in self.removed and self.in_arrays(obj_id)
+
+    def term_count(self):
+        return len(self.offsets_view) - 1
+
+    def term_bytes(self, idx):
+        return bytes(self.text_view[
+            self.offsets_view[idx]:self.offsets_view[idx + 1]])
+
+    def to_dicts(self):
+        """
+        :return: Tuple of the dict of word to ids and of id to words
+        """
+        terms = [self.term_bytes(x).decode('utf-8')
+                 for x in range(self.term_count())]
+        term_ids = self.term_ids.tolist()
+        obj_terms = self.obj_terms.tolist()
+        word_idx = {x: term_ids[self.term_ptr[i]:self.term_ptr[i + 1]]
+                    for i, x in enumerate(terms)}
+        id_words = {
+            x: [terms[y] for y in obj_terms[
+                self.obj_ptr[i]:self.obj_ptr[i + 1]]]
+            for i, x in enumerate(self.obj_ids.tolist())}
+        if self.removed:
+            word_idx = {k: [x for x in v if x not in self.removed]
+                        for k, v in word_idx.items()}
+            word_idx = {k: v for k, v in word_idx.items() if v}
+            id_words = {k: v for k, v in id_words.items()
+                        if k not in self.removed}
+        for obj_id, words in self.delta_words.items():
+            id_words[obj_id] = list(words)
+            for word in words:
+                word_idx.setdefault(word, []).append(obj_id)
+        return word_idx, id_words
+
+    def find(self, word):
+        key = word.encode('utf-8')
+        low, high = 0, self.term_count()
+        while low < high:
+            mid = (low + high) // 2
+            if self.term_bytes(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.term_count() and self.term_bytes(low) == key:
+            return low
+        return None
+
+    def array_ids(self, idx):
+        ids = self.term_ids[self.term_ptr[idx]:self.term_ptr[idx + 1]]
+        if self.removed:
+            ids = ids[~np.isin(ids, self.removed_ids)]
+        return ids
+
+    def __contains__(self, word):
+        if word in self.delta_idx:
+            return True
+        idx = self.find(word)
+        return idx is not None and (not self.removed or
+                                    len(self.array_ids(idx)) > 0)
+
+    def __getitem__(self, word):
+        idx = self.find(word)
+        ids = [] if idx is None else self.array_ids(idx).tolist()
+        ids += self.delta_idx.get(word, [])
+        if not ids:
+            raise KeyError(word)
+        return ids
+
+    def get(self, word, default=None):
+        return self[word] if word in self else default
+
+    def __len__(self):
+        return self.term_count() + len(
+            [x for x in self.delta_idx if self.find(x) is None])
+
+
+class FileLock(object):
+    """
+    Exclusive lock on a file shared by processes, a no-op without a file
+    name or where fcntl is not available.
+    """
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.file = None
+
+    def __enter__(self):
+        if fcntl is not None and self.file_name:
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            self.file = open(self.file_name, 'a')
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        return False
+
+
+class WordIndexCache(FileCache):
+    """
+    Keeps a WordIndex per model on disk for every worker process to memory
+    map.  Each index has a json meta file with its version, the change
+    token of the model it was built at, when it was built and the row count.
+    A write saves the arrays under a new version and then replaces the meta
+    file, so readers see either the old or the new index.  Single object
+    changes are saved as a numbered delta file of the version instead.
+    """
+    meta_suffix = '.json'
+    lock_suffix = '.lock'
+    delta_name = 'delta_{}.json'
+
+    def __init__(self, path=word_index_path):
+        super().__init__(path)
+
+    @staticmethod
+    def get_name(key):
+        return '{}_{}'.format(key[0], int(key[1]))
+
+    def get_meta_file(self, key):
+        return os.path.join(self.path, self.get_name(key) + self.meta_suffix)
+
+    def get_version_dir(self, key, version):
+        return os.path.join(self.path,
+                            '{}.{}'.format(self.get_name(key), version))
+
+    def lock(self, key):
+        return FileLock(os.path.join(
+            self.path, self.get_name(key) + self.lock_suffix))
+
+    def load_meta(self, key):
+        meta_file = self.get_meta_file(key)
+        try:
+            with open(meta_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_meta(self, key, meta):
+        def write_meta(tmp_file):
+            with open(tmp_file, 'w') as f:
+                json.dump(meta, f)
+        self.write_atomic(self.get_meta_file(key), write_meta)
+
+    def get_delta_file(self, key, meta, delta_seq):
+        return os.path.join(self.get_version_dir(key, meta['version']),
+                            self.delta_name.format(delta_seq))
+
+    def load(self, key, meta, word_idx=None):
+        """
+        Memory maps the arrays of the index version in meta and applies its
+        delta.
+
+        :param key: Tuple of the model name and split underscore setting
+        :param meta: The meta dict of the version to load
+        :param word_idx: WordIndex of the same version to reuse the arrays
+            of, so only the delta is read
+        :return: The WordIndex or None if its files are gone
+        """
+        version_dir = self.get_version_dir(key, meta['version'])
+        try:
+            if word_idx is None:
+                word_idx = WordIndex(*[
+                    np.load(os.path.join(version_dir, x + '.npy'),
+                            mmap_mode='r')
+                    for x in WordIndex.array_names])
+            delta = {'id_words': [], 'removed': []}
+            if meta.get('delta_seq'):
+                delta_file = self.get_delta_file(key, meta, meta['delta_seq'])
+                with open(delta_file, 'r') as f:
+                    delta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return word_idx.with_delta(
+            {k: v for k, v in delta['id_words']}, delta['removed'])
+
+    def save(self, key, word_idx, meta):
+        """
+        Writes the arrays of word_idx under a new version, points the meta
+        file at it and removes the previous version.
+
+        :param key: Tuple of the model name and split underscore setting
+        :param word_idx: The WordIndex to save
+        :param meta: Dict of token, built_at and row_count to save with it
+        :return: The saved meta dict
+        """
+        old_meta = self.load_meta(key)
+        meta = dict(meta, version='{:x}{:x}'.format(
+            time.time_ns(), os.getpid()))
+        version_dir = self.get_version_dir(key, meta['version'])
+        os.makedirs(version_dir, exist_ok=True)
+        for name in WordIndex.array_names:
+            np.save(os.path.join(version_dir, name + '.npy'),
+                    getattr(word_idx, name))
+        self.save_meta(key, meta)
+        if old_meta:
+            self.remove_version(key, old_meta['version'])
+        return meta
+
+    def save_delta(self, key, word_idx, meta):
+        """
+        Writes the delta of word_idx next to the arrays of its version and
+        points the meta file at it, costing the size of the delta rather
+        than of the index.
+
+        :param key: Tuple of the model name and split underscore setting
+        :param word_idx: The WordIndex whose delta to save
+        :param meta: The meta dict of its version, with the new token and
+            row count
+        :return: The saved meta dict
+        """
+        old_seq = meta.get('delta_seq')
+        meta = dict(meta, delta_seq=(old_seq or 0) + 1)
+        delta = word_idx.delta_dict()
+
+        def write_delta(tmp_file):
+            with open(tmp_file, 'w') as f:
+                json.dump(delta, f)
+        self.write_atomic(self.get_delta_file(key, meta, meta['delta_seq']),
+                          write_delta)
+        self.save_meta(key, meta)
+        if old_seq:
+            try:
+                os.remove(self.get_delta_file(key, meta, old_seq))
+            except OSError:
+                pass
+        return meta
+
+    def remove_version(self, key, version):
+        shutil.rmtree(self.get_version_dir(key, version), ignore_errors=True)
+
+    def remove(self, model_names=None):
+        """
+        Removes the indexes of model_names, or every index if None, so the
+        next lookup in any worker rebuilds them.
+
+        :param model_names: List of model names
+        :return: None
+        """
+        if not os.path.isdir(self.path):
+            return
+        for file_name in os.listdir(self.path):
+            if not file_name.endswith(self.meta_suffix):
+                continue
+            name = file_name[:-len(self.meta_suffix)]
+            key = (name.rsplit('_', 1)[0], name.endswith('_1'))
+            if model_names is not None and key[0] not in model_names:
+                continue
+            meta = self.load_meta(key)
+            try:
+                os.remove(os.path.join(self.path, file_name))
+            except OSError:
+                continue
+            if meta:
+                self.remove_version(key, meta['version'])
+
@@ -3,6 +3,7 @@ import time
 import logging
 import pandas as pd
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import processor.reporting.fbapi as fbapi
 import processor.reporting.awapi as awapi
 import processor.reporting.twapi as twapi
@@ -48,9 +49,19 @@ import processor.reporting.utils as utl
 
 
 class ImportHandler(object):
-    def __init__(self, args, matrix):
+    def __init__(self, args, matrix, workers=1, api_limits=None):
+        """
+        :param args: The api, ftp, db, s3 or azu argument to import for
+        :param matrix: The vendor matrix
+        :param workers: Threads used to pull apis concurrently
+        :param api_limits: Dict of api argument, i.e. 'fb', to the vendor
+            keys of that api pulled at once, to keep within rate limits.
+            Apis not in the dict pull one vendor key at a time.
+        """
         self.args = args
         self.matrix = matrix
+        self.workers = workers
+        self.api_limits = api_limits if api_limits else {}
         self.class_list = {
             vmc.api_fb_key: fbapi.FbApi,
             vmc.api_aw_key: awapi.AwApi,
@@ -224,11 +235,54 @@ class ImportHandler(object):
         """Loops through all APIs and makes function call to retrieve data.
 
         """
+        if self.workers > 1:
+            return self.api_loop_concurrent()
         for key, api in self.class_list.items():
             if (self.arg_check(vmc.api_translation[key]) and
                     self.matrix.vks[key]):
                 self.api_calls(self.matrix.vks[key], api())
 
+    def get_api_lanes(self):
+        """Splits the vendor keys of each API into lanes pulled in order.
+
+        Each API gets as many lanes as its limit in api_limits, default one,
+        so no more of its vendor keys are pulled at once than it allows.
+        """
+        lanes = []
+        for key in self.class_list:
+            api_arg = vmc.api_translation[key]
+            if not (self.arg_check(api_arg) and self.matrix.vks[key]):
+                continue
+            key_list = self.matrix.vks[key]
+            limit = max(1, min(self.api_limits.get(api_arg, 1), len(key_list)))
+            lanes.extend((key, key_list[x::limit]) for x in range(limit))
+        return lanes
+
+    def api_lane(self, key, key_list):
+        """Pulls each vendor key with a new API instance, so config set by
+        input_config for one vendor key does not carry over to the next.
+
+        Keyword arguments:
+        key -- The vendor matrix API key, i.e. vmc.api_fb_key
+        key_list -- list of Vendormatrix keys to pull in order
+        """
+        for vk in key_list:
+            self.api_calls([vk], self.class_list[key]())
+
+    def api_loop_concurrent(self):
+        """Pulls the lanes of all APIs across a pool of threads.
+
+        Errors are raised once the other lanes have finished.
+        """
+        lanes = self.get_api_lanes()
+        logging.info('Pulling {} API lanes with {} workers.'.format(
+            len(lanes), self.workers))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.api_lane, key, key_list)
+                       for key, key_list in lanes]
+        for future in futures:
+            future.result()
+
     def test_api_calls(self, key_list):
         """Makes an API Call to Test Connection
 
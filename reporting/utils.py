@@ -1,6 +1,7 @@
 import os
 import io
 import re
+import sys
 import gzip
 import json
 import time
@@ -10,8 +11,10 @@ import base64
 import zipfile
 import logging
 import requests
+import tracemalloc
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 import datetime as dt
 import urllib3.exceptions as url_ex
 import selenium.webdriver as wd
@@ -24,7 +27,14 @@ import selenium.common.exceptions as ex
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.remote.remote_connection import RemoteConnection
-
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 config_path = 'config/'
@@ -48,7 +58,10 @@ na_values = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
              'null', '-nan', '1.#IND', '1.#QNAN', 'N/A', 'NULL', 'NaN', 'n/a',
              'nan']
 sheet_name_splitter = ':::'
+money_chars = ['$', ',']
 tmp_file_suffix = 'TMP'
+parquet_suffix = '.parquet'
+output_compression = {'gzip': '.gz', 'zstd': '.zst'}
 
 
 def dir_check(directory):
@@ -133,12 +146,123 @@ def write_file(df, file_name):
         return False
 
 
+def get_sidecar_name(file_name):
+    return os.path.splitext(file_name)[0] + parquet_suffix
+
+
+def open_output_file(file_name, compression=None):
+    if compression == 'gzip':
+        return gzip.open(file_name, 'wt', compresslevel=6, encoding='utf-8',
+                         newline='')
+    if compression == 'zstd':
+        writer = zstandard.ZstdCompressor().stream_writer(
+            open(file_name, 'wb'))
+        return io.TextIOWrapper(writer, encoding='utf-8', newline='')
+    return open(file_name, 'w', encoding='utf-8', newline='')
+
+
+def write_output_file(df, file_name, chunk_size=100000, compression=None,
+                      sidecar=False):
+    """
+    Streams a df to csv a chunk of rows at a time, optionally compressed,
+    and can write a parquet sidecar next to it that read_output_file reads
+    instead of parsing the csv.  The csv is written to a temp file and moved
+    into place so a failed write leaves the last output intact.  Outputs of
+    file_name with another compression are removed so none are left stale.
+
+    :param df: The df to write
+    :param file_name: The csv file name
+    :param chunk_size: Rows formatted and written at once
+    :param compression: None, 'gzip' or 'zstd', which add .gz or .zst
+    :param sidecar: Write the df to parquet as well
+    :return: True if the csv was written
+    """
+    if compression == 'zstd' and not zstandard:
+        logging.warning('zstandard not installed, writing gzip instead.')
+        compression = 'gzip'
+    sidecar_name = get_sidecar_name(file_name)
+    variants = [file_name] + [file_name + x
+                              for x in output_compression.values()]
+    if compression:
+        file_name += output_compression[compression]
+    tmp_file = file_name + tmp_file_suffix
+    try:
+        with open_output_file(tmp_file, compression) as f:
+            for start in range(0, max(len(df), 1), chunk_size):
+                df.iloc[start:start + chunk_size].to_csv(
+                    f, index=False, header=start == 0)
+                logging.debug('Wrote {} of {} rows.'.format(
+                    min(start + chunk_size, len(df)), len(df)))
+        os.replace(tmp_file, file_name)
+    except IOError:
+        logging.warning('{} could not be opened.  This file was not saved.'
+                        ''.format(file_name))
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return False
+    for variant in variants:
+        if variant != file_name and os.path.isfile(variant):
+            try:
+                os.remove(variant)
+            except OSError as e:
+                logging.warning('Stale output {} not removed: {}'.format(
+                    variant, e))
+    if os.path.isfile(sidecar_name):
+        os.remove(sidecar_name)
+    if sidecar:
+        tmp_file = sidecar_name + tmp_file_suffix
+        try:
+            df.to_parquet(tmp_file, index=False)
+            os.replace(tmp_file, sidecar_name)
+        except (IOError, ValueError, TypeError, pa.ArrowException) as e:
+            logging.warning('Parquet sidecar not written: {}'.format(e))
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    return True
+
+
+def read_output_file(file_name):
+    """
+    Reads an output written by write_output_file, from its parquet sidecar
+    when it is at least as new as the csv, otherwise from the newest of the
+    plain or compressed csv.
+
+    :param file_name: The csv file name, without a compression suffix
+    :return: The df
+    """
+    csv_files = [file_name] + [file_name + x
+                               for x in output_compression.values()]
+    csv_files = [x for x in csv_files if os.path.isfile(x)]
+    sidecar_name = get_sidecar_name(file_name)
+    if os.path.isfile(sidecar_name) and all(
+            os.stat(sidecar_name).st_mtime_ns >= os.stat(x).st_mtime_ns
+            for x in csv_files):
+        try:
+            return pd.read_parquet(sidecar_name)
+        except (OSError, pa.ArrowException) as e:
+            logging.warning('Could not read {}: {}'.format(sidecar_name, e))
+    if csv_files:
+        file_name = max(csv_files, key=os.path.getmtime)
+    return import_read_csv(file_name)
+
+
 def exceldate_to_datetime(excel_date):
     epoch = dt.datetime(1899, 12, 30)
     delta = dt.timedelta(hours=round(excel_date * 24))
     return epoch + delta
 
 
+date_formats = [
+    (re.compile(r'[0-9]{1,2}/[0-9]{1,2}/[0-9]{2}'), ['%m/%d/%y']),
+    (re.compile(r'[0-9]{1,2}/[0-9]{1,2}/20[0-9]{2}'),
+     ['%m/%d/%Y', '%d/%m/%Y']),
+    (re.compile(r'2[0-9]{7}'), ['%Y%m%d']),
+    (re.compile(r'20[0-9]{2}-[0-9]{2}-[0-9]{2}'), ['%Y-%m-%d', '%Y-%d-%m']),
+    (re.compile(r'20[0-9]{2}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}'),
+     ['%Y-%m-%d %H:%M:%S']),
+]
+
+
 def string_to_date(my_string):
     month_list = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
                   'Jul', 'Aug', 'Sept', 'Oct', 'Nov', 'Dec']
@@ -152,6 +276,7 @@ def string_to_date(my_string):
     elif ('/' in my_string and my_string[-4:][:2] == '20' and
           ':' not in my_string):
         if my_string[0] == '/':
+            TodayTracker.mark()
             new_month = '{:02d}'.format(dt.datetime.today().month)
             my_string = '{}{}'.format(new_month, my_string)
         if '//' in my_string:
@@ -212,6 +337,7 @@ def string_to_date(my_string):
         return dt.datetime.strptime(my_string, '%m%d%Y')
     elif ((len(my_string) == 6 or len(my_string) == 5) and
           my_string[-3:] in month_list):
+        TodayTracker.mark()
         my_string = my_string + '-' + dt.datetime.today().strftime('%Y')
         return dt.datetime.strptime(my_string, '%d-%b-%Y')
     elif len(my_string) == 24 and my_string[-3:] == 'GMT':
@@ -226,6 +352,166 @@ def string_to_date(my_string):
         return my_string
 
 
+def get_date_format(my_string):
+    """
+    Finds the strptime formats string_to_date tries, in order, for a string
+    it parses without adjusting.
+
+    :param my_string: The date string to check
+    :return: Tuple of the compiled pattern and formats or None if not found
+    """
+    for pattern, formats in date_formats:
+        if pattern.fullmatch(my_string):
+            return pattern, formats
+    return None
+
+
+def strings_to_dates(values):
+    """
+    Applies string_to_date to an array of unique strings.  The format of the
+    first string is inferred and every string matching it is parsed at once
+    with pd.to_datetime, the remainder fall back to string_to_date.
+
+    :param values: Array of strings
+    :return: Object array of what string_to_date returns for each string
+    """
+    values = np.asarray(values, dtype=object)
+    dates = np.empty(len(values), dtype=object)
+    is_left = np.ones(len(values), dtype=bool)
+    date_format = get_date_format(values[0]) if len(values) else None
+    if date_format:
+        pattern, formats = date_format
+        is_left = ~pd.Series(values).str.fullmatch(pattern).to_numpy(bool)
+        matched = values[~is_left]
+        parsed = pd.Series(
+            pd.to_datetime(matched, format=formats[0], errors='coerce'))
+        for retry_format in formats[1:]:
+            failed = parsed.isna().to_numpy()
+            parsed[failed] = pd.to_datetime(
+                matched[failed], format=retry_format, errors='coerce')
+        for failed_date in matched[parsed.isna().to_numpy()]:
+            logging.warning('Could not parse date: {}'.format(failed_date))
+        dates[~is_left] = parsed.astype(object).to_numpy()
+    dates[is_left] = [string_to_date(x) for x in values[is_left]]
+    return dates
+
+
+def column_to_date(ser, fill_empty=True):
+    """
+    Converts a series to normalized dates the way string_to_date would cell
+    by cell, but parses each unique value only once and maps the results back.
+
+    :param ser: The series to convert
+    :param fill_empty: Fill empty cells with today rather than NaT
+    :return: Series of datetime64 values with the same index as ser
+    """
+    index = ser.index
+    safe_types = ['string', 'empty', 'date', 'datetime', 'integer',
+                  'floating', 'boolean']
+    is_mixed = (ser.dtype == object and
+                pd.api.types.infer_dtype(ser, skipna=True) not in safe_types)
+    if not is_mixed:
+        codes, uniques = pd.factorize(ser, use_na_sentinel=False)
+        ser = pd.Series(uniques)
+    ser = ser.replace(['1/0/1900', '1/1/1970'], '0')
+    if fill_empty:
+        if ser.hasnans:
+            TodayTracker.mark()
+        ser = ser.astype("object").where(ser.notna(), dt.date.today())
+    else:
+        ser = ser.fillna(pd.Timestamp('nat'))
+    ser = ser.astype('U')
+    if is_mixed:
+        codes, uniques = pd.factorize(ser, use_na_sentinel=False)
+        ser = pd.Series(uniques)
+    dates = pd.Series(strings_to_dates(ser.to_numpy()), dtype=object)
+    dates = pd.to_datetime(dates, errors='coerce').dt.normalize()
+    return dates.take(codes).set_axis(index)
+
+
+def normalize_strings(ser):
+    """
+    Converts a series to strings with runs of whitespace collapsed and the
+    ends stripped, cleaning each unique string only once.
+
+    :param ser: The series to convert
+    :return: Series of str values with the same index as ser
+    """
+    ser = ser.astype('U')
+    codes, uniques = pd.factorize(ser)
+    uniques = pd.Series(uniques, dtype=object)
+    uniques = uniques.str.replace(r"\s+", " ", regex=True).str.strip()
+    return pd.Series(uniques.to_numpy().take(codes), index=ser.index,
+                     name=ser.name, dtype=object)
+
+
+def categorize(df, cols, max_ratio=0.5):
+    """
+    Encodes the string columns of df in cols as categoricals.  Columns that
+    hold anything but strings and nulls, or that have more unique values
+    than max_ratio of their rows, are left as they are.
+
+    :param df: The df to encode, changed in place
+    :param cols: Names of the columns that may be encoded
+    :param max_ratio: Most unique values per row worth encoding
+    :return: The df with the columns encoded
+    """
+    cols = set(cols)
+    for idx, col in enumerate(df.columns):
+        if col not in cols or df.dtypes.iloc[idx] != object:
+            continue
+        ser = df.iloc[:, idx]
+        if pd.api.types.infer_dtype(ser, skipna=True) != 'string':
+            continue
+        if ser.nunique() > len(ser.index) * max_ratio:
+            continue
+        df.isetitem(idx, ser.astype('category'))
+    return df
+
+
+def decategorize(df):
+    """
+    Decodes the categorical columns of df back to object columns.
+
+    :param df: The df to decode
+    :return: The df with no categorical columns
+    """
+    is_cat = [isinstance(x, pd.CategoricalDtype) for x in df.dtypes]
+    if any(is_cat):
+        df = df.copy()
+        for idx in np.flatnonzero(is_cat):
+            df.isetitem(idx, df.iloc[:, idx].astype(object))
+    return df
+
+
+def unify_categories(frames):
+    """
+    Gives each categorical column the sorted union of its categories across
+    frames, so pd.concat keeps it categorical rather than decoding it.
+
+    :param frames: List of dfs about to be concatenated, changed in place
+    :return: The list of dfs
+    """
+    categories = {}
+    for frame in frames:
+        for col, dtype in zip(frame.columns, frame.dtypes):
+            if isinstance(dtype, pd.CategoricalDtype):
+                categories.setdefault(col, []).append(dtype.categories)
+    for col, col_categories in categories.items():
+        if len(col_categories) < 2:
+            continue
+        col_categories = col_categories[0].append(col_categories[1:])
+        dtype = pd.CategoricalDtype(col_categories.unique().sort_values())
+        for frame in frames:
+            for idx, frame_col in enumerate(frame.columns):
+                ser = frame.iloc[:, idx]
+                if (frame_col == col and
+                        isinstance(ser.dtype, pd.CategoricalDtype)):
+                    frame.isetitem(idx, ser.cat.set_categories(
+                        dtype.categories))
+    return frames
+
+
 def data_to_type(df, float_col=None, date_col=None, str_col=None, int_col=None,
                  fill_empty=True):
     df = df.loc[:, ~df.columns.duplicated()]
@@ -240,35 +526,45 @@ def data_to_type(df, float_col=None, date_col=None, str_col=None, int_col=None,
     for col in float_col:
         if col not in df:
             continue
+        is_typed = df[col].dtype == np.float64
+        TypeCounter.add('float', is_typed)
+        if is_typed:
+            if df[col].hasnans:
+                df[col] = df[col].fillna(0)
+            continue
+        if df[col].dtype.kind in 'iu':
+            df[col] = df[col].astype(float)
+            continue
         df[col] = df[col].fillna(0)
         df[col] = df[col].astype('U')
-        df[col] = df[col].apply(lambda x: x.replace('$', ''))
-        df[col] = df[col].apply(lambda x: x.replace(',', ''))
+        for money_char in money_chars:
+            df[col] = df[col].str.replace(money_char, '', regex=False)
         df[col] = pd.to_numeric(df[col], errors='coerce')
         df[col] = df[col].astype(float)
     for col in date_col:
         if col not in df:
             continue
-        df[col] = df[col].replace(['1/0/1900', '1/1/1970'], '0')
-        if fill_empty:
-            df[col] = (
-                df[col]
-                .astype("object")
-                .where(df[col].notna(), dt.date.today())
-            )
-        else:
-            df[col] = df[col].fillna(pd.Timestamp('nat'))
-        df[col] = df[col].astype('U')
-        df[col] = df[col].apply(lambda x: string_to_date(x))
-        df[col] = pd.to_datetime(df[col], errors='coerce').dt.normalize()
+        is_typed = df[col].dtype == 'datetime64[ns]'
+        TypeCounter.add('date', is_typed)
+        if is_typed:
+            if fill_empty and df[col].hasnans:
+                TodayTracker.mark()
+                df[col] = df[col].fillna(pd.Timestamp.today())
+            df[col] = df[col].dt.normalize()
+            continue
+        df[col] = column_to_date(df[col], fill_empty)
     for col in str_col:
         if col not in df:
             continue
-        df[col] = df[col].astype('U')
-        df[col] = df[col].str.replace(r"\s+", " ", regex=True).str.strip()
+        TypeCounter.add('str', False)
+        df[col] = normalize_strings(df[col])
     for col in int_col:
         if col not in df:
             continue
+        is_typed = df[col].dtype == np.int64
+        TypeCounter.add('int', is_typed)
+        if is_typed:
+            continue
         df[col] = df[col].astype('int64')
     return df
 
@@ -345,83 +641,228 @@ def col_removal(df, key, removal_cols, warn=True):
     return df
 
 
-def apply_rules(df, vm_rules, pre_or_post, **kwargs):
-    grouped_q_idx = {}
-    for rule in vm_rules:
-        for item in RULE_CONST:
-            if item not in vm_rules[rule].keys():
-                logging.warning('{} not in vendormatrix for rule {}.  '
-                                'The rule did not run.'.format(item, rule))
-                return df
-        metrics = kwargs[vm_rules[rule][RULE_METRIC]]
-        queries = kwargs[vm_rules[rule][RULE_QUERY]]
-        factor = kwargs[vm_rules[rule][RULE_FACTOR]]
+class RuleQuery(object):
+    """
+    One column::values[::EXCLUDE] filter of a vm rule.  Date bounds are
+    parsed the first time they are used and kept, marking TodayTracker on
+    every use if parsing them took part of the date from today.
+    """
+    def __init__(self, query):
+        self.query = query
+        self.col = query[0]
+        self.malformed = len(query) == 1
+        self.values = [] if self.malformed else query[1].split(',')
+        self.exclude = len(query) == 3 and query[2] == 'EXCLUDE'
+        self.bounds = None
+        self.bounds_day = None
+        self.bounds_today = False
+
+    def get_bounds(self):
+        today = dt.date.today()
+        if self.bounds is None or (self.bounds_today and
+                                   self.bounds_day != today):
+            used = TodayTracker.reset()
+            self.bounds = (string_to_date(self.values[0]),
+                           string_to_date(self.values[1]))
+            self.bounds_today = TodayTracker.reset()
+            self.bounds_day = today
+            if used:
+                TodayTracker.mark()
+        if self.bounds_today:
+            TodayTracker.mark()
+        return self.bounds
+
+    def get_mask(self, df):
+        """
+        Gets the rows of df the query keeps.
+
+        :param df: The df to filter
+        :return: Boolean numpy array with a value per row of df
+        """
+        if self.col == vmc.date:
+            sd, ed = self.get_bounds()
+            mask = (df[self.col] >= sd) & (df[self.col] <= ed)
+        else:
+            mask = df[self.col].isin(self.values)
+            if self.exclude:
+                mask = ~mask
+        return mask.to_numpy(dtype=bool)
+
+
+class VmRule(object):
+    """
+    A vm rule of a data source parsed from its METRIC, QUERY and FACTOR
+    values.  A missing rule setting is kept as missing, so applying the
+    rules stops there as it always has.
+    """
+    def __init__(self, name, rule_cols, **kwargs):
+        self.name = name
+        self.missing = next((x for x in RULE_CONST if x not in rule_cols),
+                            None)
+        self.skip = True
+        if self.missing:
+            return None
+        metrics = kwargs[rule_cols[RULE_METRIC]]
+        queries = kwargs[rule_cols[RULE_QUERY]]
+        self.factor = kwargs[rule_cols[RULE_FACTOR]]
         if (str(metrics) == 'nan' or str(queries) == 'nan' or
-                str(factor) == 'nan'):
-            continue
+                str(self.factor) == 'nan'):
+            return None
+        self.skip = False
         metrics = metrics.split('::')
-        if metrics[0] != pre_or_post:
-            continue
-        set_column_to_value = False
+        self.pre_or_post = metrics[0]
+        self.set_col = None
         if len(metrics) == 3:
-            set_column_to_value = True
-            if metrics[1] not in df.columns:
-                logging.warning(
-                    '{} not in columns setting to 0.'.format(metrics[1]))
-                df[metrics[1]] = 0
-            if metrics[2] in grouped_q_idx:
-                df.loc[~df.index.isin(grouped_q_idx[metrics[2]]),
-                       metrics[2]] = (
-                    df.loc[~df.index.isin(grouped_q_idx[metrics[2]]),
-                           metrics[1]])
-            else:
-                df[metrics[2]] = df[metrics[1]]
+            self.set_col = (metrics[1], metrics[2])
             metrics[1] = metrics[2]
-        tdf = df
-        metrics = metrics[1].split('|')
-        queries = queries.split('|')
-        for query in queries:
-            query = query.split('::')
-            if len(query) == 1:
-                logging.warning('Malformed query: {} \n In rule: {} \n'
-                                'It may only have one :.  It was not used to'
-                                'filter data'.format(query, rule))
-                continue
-            values = query[1].split(',')
-            if query[0] not in df:
-                logging.warning('{} not in data for rule {}.  '
-                                'The rule did not run.'.format(query[0], rule))
+        self.metrics = metrics[1].split('|') if len(metrics) > 1 else None
+        self.queries = [RuleQuery(x.split('::')) for x in queries.split('|')]
+
+
+class RuleEngine(object):
+    """
+    The vm rules of a data source compiled once and applied as boolean
+    masks.  Engines are kept by the rule values they were compiled from, so
+    data sources with the same rules share one.  With report set the rows
+    each rule matched and the time it took are recorded for the run.
+    """
+    engines = {}
+    report = False
+    stats = {}
+
+    def __init__(self, vm_rules, **kwargs):
+        self.rules = []
+        for rule in vm_rules:
+            vm_rule = VmRule(rule, vm_rules[rule], **kwargs)
+            self.rules.append(vm_rule)
+            if vm_rule.missing:
+                break
+
+    @staticmethod
+    def get_key(vm_rules, **kwargs):
+        return tuple((rule, tuple(sorted(cols.items())),
+                      tuple(str(kwargs.get(x)) for x in cols.values()))
+                     for rule, cols in vm_rules.items())
+
+    @classmethod
+    def get(cls, vm_rules, **kwargs):
+        """
+        Gets the compiled engine of the rules of a data source.
+
+        :param vm_rules: The vm rules dict of the vendor matrix
+        :param kwargs: The vendor matrix params of the data source
+        :return: The RuleEngine
+        """
+        key = cls.get_key(vm_rules, **kwargs)
+        if key not in cls.engines:
+            cls.engines[key] = cls(vm_rules, **kwargs)
+        return cls.engines[key]
+
+    @classmethod
+    def reset(cls, report=False):
+        stats = cls.stats
+        cls.stats = {}
+        cls.report = report
+        return stats
+
+    @classmethod
+    def merge(cls, stats):
+        for name, (runs, matches, seconds) in stats.items():
+            cls.add(name, matches, seconds, runs)
+
+    @classmethod
+    def add(cls, name, matches, seconds, runs=1):
+        stat = cls.stats.get(name, [0, 0, 0.])
+        cls.stats[name] = [stat[0] + runs, stat[1] + matches,
+                           stat[2] + seconds]
+
+    @classmethod
+    def log(cls, label):
+        msg = '{} rules'.format(label)
+        for name, (runs, matches, seconds) in sorted(cls.stats.items()):
+            msg += '  {}: {} runs, {} rows matched, {:.3f}s.'.format(
+                name, runs, matches, seconds)
+        if not cls.stats:
+            msg += '  none run.'
+        logging.info(msg)
+        return msg
+
+    def apply(self, df, pre_or_post):
+        """
+        Multiplies the metrics of the rows each rule queries by its factor.
+        Metrics a rule sets from another column are zeroed on the rows no
+        rule setting them matched.
+
+        :param df: The df to apply the rules to
+        :param pre_or_post: Apply the PRE or the POST rules
+        :return: The df with the rules applied
+        """
+        grouped_q_mask = {}
+        for rule in self.rules:
+            if rule.missing:
+                logging.warning('{} not in vendormatrix for rule {}.  The '
+                                'rule did not run.'.format(rule.missing,
+                                                           rule.name))
                 return df
-            if query[0] == vmc.date:
-                sd = string_to_date(values[0])
-                ed = string_to_date(values[1])
-                tdf = tdf.loc[(df[query[0]] >= sd) & (df[query[0]] <= ed)]
-            else:
-                if len(query) == 3 and query[2] == 'EXCLUDE':
-                    tdf = tdf.loc[~tdf[query[0]].isin(values)]
+            if rule.skip or rule.pre_or_post != pre_or_post:
+                continue
+            start = time.perf_counter()
+            if rule.set_col:
+                source_col, set_col = rule.set_col
+                if source_col not in df.columns:
+                    logging.warning(
+                        '{} not in columns setting to 0.'.format(source_col))
+                    df[source_col] = 0
+                if set_col in grouped_q_mask:
+                    not_set = ~grouped_q_mask[set_col][0]
+                    df.loc[not_set, set_col] = df.loc[not_set, source_col]
                 else:
-                    tdf = tdf.loc[tdf[query[0]].isin(values)]
-        q_idx = list(tdf.index.values)
-        for metric in metrics:
+                    df[set_col] = df[source_col]
+            q_mask = np.ones(len(df.index), dtype=bool)
+            for query in rule.queries:
+                if query.malformed:
+                    logging.warning('Malformed query: {} \n In rule: {} \n'
+                                    'It may only have one :.  It was not used '
+                                    'to filter data'.format(query.query,
+                                                            rule.name))
+                    continue
+                if query.col not in df:
+                    logging.warning('{} not in data for rule {}.  The rule '
+                                    'did not run.'.format(query.col,
+                                                          rule.name))
+                    return df
+                q_mask &= query.get_mask(df)
+            if not df.index.is_unique:
+                q_mask = df.index.isin(df.index[q_mask])
+            rule_mask = [q_mask]
+            for metric in rule.metrics:
+                if metric not in df:
+                    logging.warning('{} not in data for rule {}.  The rule '
+                                    'did not run.'.format(metric, rule.name))
+                    continue
+                df = data_to_type(df, float_col=[metric])
+                df.loc[q_mask, metric] = (
+                    df.loc[q_mask, metric].astype(float) * float(rule.factor))
+                if rule.set_col:
+                    if metric not in grouped_q_mask:
+                        grouped_q_mask[metric] = rule_mask
+                    else:
+                        grouped_q_mask[metric][0] = (
+                            grouped_q_mask[metric][0] | q_mask)
+            if self.report:
+                self.add('{} {}'.format(rule.name, pre_or_post),
+                         int(q_mask.sum()), time.perf_counter() - start)
+        for metric in grouped_q_mask:
             if metric not in df:
-                logging.warning('{} not in data for rule {}.  '
-                                'The rule did not run.'.format(metric, rule))
                 continue
-            df = data_to_type(df, float_col=[metric])
-            df.loc[q_idx, metric] = (df.loc[q_idx, metric].astype(float) *
-                                     float(factor))
-            if set_column_to_value:
-                if metric not in grouped_q_idx:
-                    grouped_q_idx[metric] = q_idx
-                else:
-                    grouped_q_idx[metric].extend(q_idx)
-    for metric in grouped_q_idx:
-        if metric not in df:
-            continue
-        df.loc[~df.index.isin(grouped_q_idx[metric]), metric] = (
-                df.loc[~df.index.isin(grouped_q_idx[metric]), metric]
-                .astype(float) * 0)
-    return df
+            not_set = ~grouped_q_mask[metric][0]
+            df.loc[not_set, metric] = (
+                df.loc[not_set, metric].astype(float) * 0)
+        return df
+
+
+def apply_rules(df, vm_rules, pre_or_post, **kwargs):
+    return RuleEngine.get(vm_rules, **kwargs).apply(df, pre_or_post)
 
 
 def add_header(df, header, first_row):
@@ -1866,6 +2307,29 @@ def is_list_in_list(first_list, second_list, contains=False, return_vals=False):
     return in_list
 
 
+def top_k_indices(scores, top_k):
+    """
+    Indices of the top_k highest scores, highest first with ties in index
+    order, the same as a stable descending sort sliced to top_k.  Uses a
+    partition so only the selected scores are sorted.
+
+    :param scores: Array of scores
+    :param top_k: Number of indices to return
+    :return: Array of indices into scores
+    """
+    scores = np.asarray(scores)
+    if top_k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if top_k < len(scores):
+        kth = -np.partition(-scores, top_k - 1)[top_k - 1]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:top_k - len(above)]
+        idx = np.concatenate([above, ties])
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind='stable')]
+
+
 def get_next_value_from_list(first_list, second_list):
     next_values = [first_list[idx + 1] for idx, x in enumerate(first_list) if
                    x in second_list]
@@ -1979,6 +2443,269 @@ def clean_monetary_input(monetary_input):
     return cleaned_input
 
 
+class MemoryTracker(object):
+    """
+    Records the peak memory of a block of work, such as one vm_loop run.
+    With trace set, tracemalloc measures the python heap, which includes
+    numpy and pandas buffers, for only this block.  The resident
+    high-water mark of the process and its finished child processes is
+    always reported where the resource module is available.
+    """
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.started_trace = False
+        self.traced_peak = None
+        self.start_time = None
+        self.elapsed = None
+
+    def start(self):
+        self.start_time = time.time()
+        if self.trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_trace = True
+            tracemalloc.reset_peak()
+        return self
+
+    def stop(self):
+        self.elapsed = time.time() - self.start_time
+        if self.trace:
+            self.traced_peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            if self.started_trace:
+                tracemalloc.stop()
+                self.started_trace = False
+        return self
+
+    @staticmethod
+    def get_peak_rss():
+        """
+        Gets the resident high-water mark of this process and its children.
+
+        :return: Tuple of self and children peak memory in MB or None
+        """
+        if resource is None:
+            return None
+        unit = 1024 ** 2 if sys.platform == 'darwin' else 1024
+        return tuple(resource.getrusage(x).ru_maxrss / unit
+                     for x in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN])
+
+    def log(self, label):
+        msg = '{} took {:.1f}s.'.format(label, self.elapsed)
+        if self.traced_peak is not None:
+            msg += '  Peak traced memory {:.1f} MB.'.format(self.traced_peak)
+        peak_rss = self.get_peak_rss()
+        if peak_rss:
+            msg += ('  Peak resident memory {:.1f} MB, workers {:.1f} '
+                    'MB.'.format(*peak_rss))
+        logging.info(msg)
+        return msg
+
+
+class TypeCounter(object):
+    """
+    Counts the columns data_to_type converts and the columns it skips
+    because their dtype already matches, such as float64 for a float column
+    or datetime64 for a date column.  The counts cover one run, which resets
+    them before and logs them after.
+    """
+    counts = {}
+
+    @classmethod
+    def add(cls, col_type, skipped, count=1):
+        key = (col_type, 'skipped' if skipped else 'converted')
+        cls.counts[key] = cls.counts.get(key, 0) + count
+
+    @classmethod
+    def merge(cls, counts):
+        for (col_type, result), count in counts.items():
+            cls.add(col_type, result == 'skipped', count)
+
+    @classmethod
+    def reset(cls):
+        counts = cls.counts
+        cls.counts = {}
+        return counts
+
+    @classmethod
+    def log(cls, label):
+        msg = '{} type conversions'.format(label)
+        for result in ['skipped', 'converted']:
+            counts = ['{} {}'.format(col_type, count)
+                      for (col_type, x), count in sorted(cls.counts.items())
+                      if x == result]
+            msg += '  {}: {}.'.format(result, ', '.join(counts) or 'none')
+        logging.info(msg)
+        return msg
+
+
+class TodayTracker(object):
+    """
+    Records that a conversion took part of a date from today, like filling
+    an empty date cell, which makes its result depend on the day it ran.
+    """
+    used = False
+
+    @classmethod
+    def mark(cls):
+        cls.used = True
+
+    @classmethod
+    def reset(cls):
+        used = cls.used
+        cls.used = False
+        return used
+
+
+class SharedFileLock(object):
+    """
+    Guards read-modify-writes of files shared by every data source, such as
+    the relational dictionaries, while vm_loop runs in worker processes.
+    Outside of a worker pool no lock is set and entering is a no-op.
+    """
+    lock = None
+
+    @classmethod
+    def set_lock(cls, lock):
+        cls.lock = lock
+
+    def __enter__(self):
+        if self.lock is not None:
+            self.lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.lock is not None:
+            self.lock.release()
+        return False
+
+
+class WriteJournal(object):
+    """
+    Defers the csv writes vm_loop repeats for every data source, like the
+    dictionaries, relational dictionaries and error reports, so each file is
+    written once, atomically, when the journal is flushed.  Reads of a
+    journaled file get the frame as it would have been read from its csv.
+    Outside of a journal writes and removals go straight to disk.
+    """
+    active = False
+    entries = {}
+    avoided = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+    @classmethod
+    def start(cls):
+        cls.active = True
+        cls.entries = {}
+        cls.avoided = 0
+
+    @classmethod
+    def stop(cls):
+        written = cls.flush()
+        cls.active = False
+        logging.info('Write journal flushed {} files, avoided {} writes.'
+                     ''.format(written, cls.avoided))
+        return written
+
+    @classmethod
+    def journal(cls, file_name, df):
+        key = os.path.abspath(file_name)
+        if key in cls.entries:
+            cls.avoided += 1
+        cls.entries[key] = [file_name, df, None]
+
+    @classmethod
+    def write(cls, df, file_name, shared=False):
+        """
+        Writes a df to csv, or journals the write until the next flush.
+
+        :param df: The df to write
+        :param file_name: The csv file name
+        :param shared: The file is shared by every worker process, so it is
+            written straight away when a SharedFileLock is set
+        :return: None
+        """
+        if not cls.active or (shared and SharedFileLock.lock is not None):
+            df.to_csv(file_name, index=False, encoding='utf-8')
+        else:
+            cls.journal(file_name, df.copy())
+
+    @classmethod
+    def remove(cls, file_name):
+        """
+        Removes a file, or journals the removal until the next flush.  Like
+        os.remove, raises an OSError if there is no file to remove.
+
+        :param file_name: The file to remove
+        :return: None
+        """
+        if not cls.active:
+            os.remove(file_name)
+            return None
+        entry = cls.entries.get(os.path.abspath(file_name))
+        if entry is None and not os.path.isfile(file_name) or (
+                entry is not None and entry[1] is None):
+            raise FileNotFoundError(file_name)
+        cls.journal(file_name, None)
+
+    @classmethod
+    def contains(cls, file_name):
+        return os.path.abspath(file_name) in cls.entries
+
+    @classmethod
+    def read(cls, file_name, **kwargs):
+        """
+        Reads a journaled file the way import_read_csv reads it from disk.
+        The parsed df is kept until the file is written again.
+
+        :param file_name: The csv file name
+        :param kwargs: Further arguments passed to import_read_csv
+        :return: A copy of the df, None if its removal is journaled
+        """
+        entry = cls.entries[os.path.abspath(file_name)]
+        if entry[1] is None:
+            return None
+        if entry[2] is None or entry[2][0] != kwargs:
+            buffer = io.StringIO(entry[1].to_csv(index=False))
+            df = import_read_csv(buffer, file_check=False, file_type='.csv',
+                                 **kwargs)
+            entry[2] = (kwargs, df)
+        df = entry[2][1]
+        return df.copy() if isinstance(df, pd.DataFrame) else df
+
+    @classmethod
+    def flush(cls):
+        """
+        Writes every journaled file, through a temp file so a failed write
+        leaves the last version intact, and applies journaled removals.
+
+        :return: Number of files written or removed
+        """
+        for file_name, df, _ in cls.entries.values():
+            tmp_file = file_name + tmp_file_suffix
+            try:
+                if df is None:
+                    if os.path.isfile(file_name):
+                        os.remove(file_name)
+                    continue
+                df.to_csv(tmp_file, index=False, encoding='utf-8')
+                os.replace(tmp_file, file_name)
+            except IOError:
+                logging.warning('{} could not be opened.  It was not '
+                                'updated.'.format(file_name))
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+        written = len(cls.entries)
+        cls.entries = {}
+        return written
+
+
 class NpEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.integer):
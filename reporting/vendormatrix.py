@@ -4,15 +4,19 @@ import yaml
 import urllib
 import shutil
 import logging
+import tempfile
 import numpy as np
 import pandas as pd
 import datetime as dt
+import multiprocessing as mp
 import reporting.utils as utl
 import reporting.calc as cal
 import reporting.vmcolumns as vmc
 import reporting.dictionary as dct
+import reporting.filecache as fc
 import reporting.errorreport as er
 import reporting.dictcolumns as dctc
+from concurrent.futures import ProcessPoolExecutor
 
 log = logging.getLogger()
 
@@ -41,6 +45,8 @@ class VendorMatrix(object):
         self.process_omit_list = None
         self.tdf = None
         self.df = None
+        self.raw_cache = None
+        self.source_cache = None
         self.vm_parse()
         self.vm_import_keys()
         self.vm_rules()
@@ -127,6 +133,12 @@ class VendorMatrix(object):
                         update({key_split[2]: key}))
                 else:
                     self.vm_rules_dict[key_split[1]] = {key_split[2]: key}
+        for vk in self.vm_df[vmc.vendorkey]:
+            try:
+                utl.RuleEngine.get(self.vm_rules_dict, **self.vendor_set(vk))
+            except (AttributeError, KeyError):
+                # Malformed rules raise when the data source applies them.
+                continue
 
     def make_omit_lists(self):
         self.plan_omit_list = [k for k, v in self.vm[vmc.omit_plan].items()
@@ -233,8 +245,10 @@ class VendorMatrix(object):
             self.tdf = import_plan_data(vk, self.df, self.plan_omit_list,
                                         **self.ven_param)
         else:
-            ds = DataSource(vk, self.vm_rules_dict, **self.ven_param)
-            self.tdf = ds.import_data()
+            ds = DataSource(vk, self.vm_rules_dict, raw_cache=self.raw_cache,
+                            **self.ven_param)
+            self.tdf = ds.import_and_cache_data(self.source_cache,
+                                                self.get_merge_params(vk))
         return self.tdf
 
     def set_full_filename(self):
@@ -256,17 +270,165 @@ class VendorMatrix(object):
                                           split(utl.sheet_name_splitter)[0]))
         self.vl.append(plan_key)
 
-    def vm_loop(self):
+    def group_vendor_keys(self, vendor_keys):
+        """
+        Groups vendor keys that share a dictionary or error report file so a
+        single worker imports them in order, as the serial loop would.
+
+        :param vendor_keys: List of vendor keys in loop order
+        :return: List of lists of vendor keys, each in loop order
+        """
+        groups = []
+        for vk in vendor_keys:
+            files = {(col, self.vm[col][vk])
+                     for col in [vmc.filenamedict, vmc.filenameerror]}
+            group_files, group_keys = set(files), [vk]
+            for other_files, other_keys in [x for x in groups
+                                            if x[0] & files]:
+                groups.remove((other_files, other_keys))
+                group_files |= other_files
+                group_keys = other_keys + group_keys
+            groups.append((group_files, group_keys))
+        order = {vk: idx for idx, vk in enumerate(vendor_keys)}
+        return [sorted(x[1], key=lambda vk: order[vk]) for x in groups]
+
+    def get_merge_params(self, vk):
+        """
+        Gets the params of the vendor keys a data source merges in.
+
+        :param vk: The vendor key of the data source
+        :return: Dict of merge vendor key to its params
+        """
+        transforms = self.vm[vmc.transform]
+        merge_sources = fc.SourceCache.get_merge_sources(
+            transforms.get(vk, 'nan'))
+        return {x: self.vendor_set(x) for x in merge_sources
+                if x in transforms}
+
+    def get_stale_vendor_keys(self, vendor_keys):
+        """
+        Finds the data sources whose inputs changed since they were stored in
+        the source cache.  Sources sharing a dictionary or error report with
+        a stale source are rebuilt with it, as they would change the same
+        files.
+
+        :param vendor_keys: List of vendor keys in loop order
+        :return: Dict of stale vendor key to the reasons it is rebuilt
+        """
+        stale = {}
+        for vk in vendor_keys:
+            reasons = self.source_cache.get_stale_reasons(
+                vk, self.vendor_set(vk), self.vm_rules_dict,
+                self.get_merge_params(vk))
+            if reasons:
+                stale[vk] = reasons
+        for group in self.group_vendor_keys(vendor_keys):
+            stale_keys = [x for x in group if x in stale]
+            for vk in group:
+                if stale_keys and vk not in stale:
+                    stale[vk] = ['shares files with {}'.format(stale_keys[0])]
+        logging.info('Rebuilding {} of {} data sources.'.format(
+            len(stale), len(vendor_keys)))
+        if self.source_cache.explain:
+            for vk in vendor_keys:
+                reasons = ', '.join(stale[vk]) if vk in stale else 'unchanged'
+                logging.info('{}: {}'.format(vk, reasons))
+        return stale
+
+    def import_data_parallel(self, workers, spill_path=None,
+                             vendor_keys=None, merge_path=None,
+                             rule_stats=False):
+        """
+        Imports non plan data sources in worker processes.
+
+        :param workers: Number of worker processes
+        :param spill_path: Directory workers write their frames to instead
+            of sending them back to the parent
+        :param vendor_keys: List of vendor keys to import, defaults to every
+            non plan data source
+        :param merge_path: Directory of the run's MergeSourceCache
+        :param rule_stats: Record the rows each vm rule matched and its time
+        :return: Dict of vendor key to the imported df or its spill file
+        """
+        if vendor_keys is None:
+            vendor_keys = [x for x in self.vl if x != plan_key]
+        groups = self.group_vendor_keys(vendor_keys)
+        logging.info('Importing {} data sources in {} groups with {} '
+                     'workers.'.format(len(vendor_keys), len(groups), workers))
+        lock = mp.Lock()
+        tdfs = {}
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=utl.SharedFileLock.set_lock,
+                                 initargs=(lock,)) as executor:
+            futures = [executor.submit(
+                import_data_sources, group, self.vm_rules_dict,
+                {vk: self.vendor_set(vk) for vk in group}, spill_path,
+                self.raw_cache, self.source_cache,
+                {vk: self.get_merge_params(vk) for vk in group}, merge_path,
+                rule_stats)
+                for group in groups]
+            for future in futures:
+                group_tdfs, type_counts, rule_counts = future.result()
+                tdfs.update(group_tdfs)
+                utl.TypeCounter.merge(type_counts)
+                utl.RuleEngine.merge(rule_counts)
+        return tdfs
+
+    def vm_loop(self, workers=1, spill=False, trace_memory=False,
+                raw_cache=None, source_cache=None, categorical=False,
+                rule_stats=False):
+        """
+        Imports every data source and combines them into one df.
+
+        :param workers: Number of worker processes importing data sources
+        :param spill: Holds each data source's frame on disk, not in memory,
+            until the single concat at the end of the loop
+        :param trace_memory: Measures the peak python heap of the loop
+        :param raw_cache: RawFileCache to read unchanged raw files from
+        :param source_cache: SourceCache to only rebuild changed data sources
+        :param categorical: Holds the string dictionary columns as
+            categoricals, which the combined df is returned with
+        :param rule_stats: Logs the rows each vm rule matched and its time
+        :return: The combined df
+        """
         logging.info('Initializing Vendor Matrix Loop')
+        self.raw_cache = raw_cache
+        self.source_cache = source_cache
+        tracker = utl.MemoryTracker(trace=trace_memory).start()
+        utl.TypeCounter.reset()
+        utl.RuleEngine.reset(report=rule_stats)
+        dct.ConfigRegistry.reset()
         self.df = pd.DataFrame(columns=[vmc.date, dctc.FPN, dctc.PN, dctc.BM])
         self.sort_vendor_list()
-        for vk in self.vl:
-            self.tdf = self.vendor_get(vk)
-            self.df = pd.concat(
-                [self.df.dropna(axis=1, how="all"),
-                 self.tdf.dropna(axis=1, how="all"),],
-                ignore_index=True,
-            )
+        collector = FrameCollector(spill=spill, categorical=categorical)
+        vendor_keys = [x for x in self.vl if x != plan_key]
+        fresh_keys = []
+        if self.source_cache:
+            stale = self.get_stale_vendor_keys(vendor_keys)
+            fresh_keys = [x for x in vendor_keys if x not in stale]
+            vendor_keys = [x for x in vendor_keys if x in stale]
+        tdfs = {}
+        merge_path = MergeSourceCache.start()
+        try:
+            with utl.WriteJournal():
+                if workers > 1:
+                    tdfs = self.import_data_parallel(
+                        workers, collector.spill_path, vendor_keys,
+                        merge_path, rule_stats)
+                for vk in self.vl:
+                    if vk == plan_key:
+                        self.df = collector.concat(self.df)
+                    if vk in tdfs:
+                        self.tdf = tdfs.pop(vk)
+                    elif vk in fresh_keys:
+                        self.tdf = self.source_cache.load(vk)
+                    else:
+                        self.tdf = self.vendor_get(vk)
+                    collector.add(self.tdf)
+                    self.tdf = None
+        finally:
+            MergeSourceCache.stop()
+        self.df = collector.concat(self.df)
         self.df = full_placement_creation(self.df, plan_key, dctc.PFPN,
                                           self.vm[vmc.fullplacename][plan_key])
         if not os.listdir(er.csv_path):
@@ -275,22 +437,36 @@ class VendorMatrix(object):
                              ' directory.')
                 os.rmdir(er.csv_path)
         self.df = utl.data_to_type(self.df, vmc.datafloatcol, vmc.datadatecol)
+        if categorical:
+            self.df = utl.categorize(self.df, collector.category_cols)
+        if self.raw_cache:
+            self.raw_cache.evict()
+        tracker.stop().log('Vendor Matrix Loop')
+        utl.TypeCounter.log('Vendor Matrix Loop')
+        if rule_stats:
+            utl.RuleEngine.log('Vendor Matrix Loop')
+        dct.ConfigRegistry.log('Vendor Matrix Loop')
         return self.df
 
     @staticmethod
-    def write_output_data(df, output_file):
-        try:
-            logging.info('Writing to: {}'.format(output_file))
-            df.to_csv(output_file, index=False, encoding='utf-8')
+    def write_output_data(df, output_file, compression=None, sidecar=False):
+        logging.info('Writing to: {}'.format(output_file))
+        if utl.write_output_file(df, output_file, compression=compression,
+                                 sidecar=sidecar):
             logging.info('Final Output Successfully generated')
-        except IOError:
-            logging.warning('{} could not be opened.  '
-                            'Final Output not updated.'.format(output_file))
 
-    def vm_loop_with_costs(self, output_file):
-        df = self.vm_loop()
+    def vm_loop_with_costs(self, output_file, workers=1, spill=False,
+                           trace_memory=False, raw_cache=None,
+                           source_cache=None, compression=None,
+                           sidecar=False, categorical=False, rule_stats=False):
+        df = self.vm_loop(workers=workers, spill=spill,
+                          trace_memory=trace_memory, raw_cache=raw_cache,
+                          source_cache=source_cache, categorical=categorical,
+                          rule_stats=rule_stats)
+        utl.TypeCounter.reset()
         df = cal.calculate_cost(df)
-        self.write_output_data(df, output_file)
+        utl.TypeCounter.log('Calculate Cost')
+        self.write_output_data(df, output_file, compression, sidecar)
         return df
 
 
@@ -720,20 +896,303 @@ def ad_cost_calculation(df):
         for col in [cost_col, vmc.impressions, vmc.clicks, model_col, rate_col]:
             if col not in df:
                 df[col] = 0
-        calc_ser = (df[df[model_col].isin(cal.BUY_MODELS) &
-                       df[rate_col] != 0].
-                    apply(cal.net_cost, cost_col=cost_col,
-                          bm_col=model_col, br_col=rate_col, axis=1))
+        calc_ser = cal.net_cost_engine(
+            df[df[model_col].isin(cal.BUY_MODELS) & df[rate_col] != 0],
+            cost_col=cost_col, bm_col=model_col, br_col=rate_col)
         if not calc_ser.empty:
             df = utl.data_to_type(df, float_col=[cost_col])
             df.loc[calc_ser.index, cost_col] = calc_ser
     return df
 
 
+class FrameCollector(object):
+    """
+    Gathers the frame of each data source so vm_loop concatenates once,
+    rather than recopying its growing output for every vendor key.  With
+    spill set the frames wait on disk until the concat.  With categorical
+    set the string dictionary columns are held as categoricals.
+    """
+    category_cols = [x for x in dctc.COLS
+                     if x not in dctc.floatcol + dctc.datecol]
+
+    def __init__(self, spill=False, categorical=False):
+        self.frames = []
+        self.categorical = categorical
+        self.spill_path = None
+        if spill:
+            self.spill_path = tempfile.mkdtemp(prefix='vm_loop_')
+
+    @staticmethod
+    def spill_frame(df, spill_path):
+        """
+        Writes a frame to a new pickle file, which keeps dtypes exact.
+
+        :param df: The df to write
+        :param spill_path: Directory to write the file to
+        :return: Name of the file written
+        """
+        spill_file = tempfile.NamedTemporaryFile(
+            dir=spill_path, suffix='.pkl', delete=False)
+        spill_file.close()
+        df.to_pickle(spill_file.name)
+        return spill_file.name
+
+    def add(self, df):
+        """
+        Adds the frame of a data source, or the spill file a worker wrote.
+
+        :param df: A df or the name of a spill file
+        :return: None
+        """
+        if isinstance(df, str):
+            self.frames.append(df)
+            return None
+        df = df.dropna(axis=1, how='all')
+        if self.categorical:
+            df = utl.categorize(df, self.category_cols)
+        if self.spill_path:
+            df = self.spill_frame(df, self.spill_path)
+        self.frames.append(df)
+
+    @staticmethod
+    def get_sample(df):
+        """
+        Gets a one row df holding the first non null value of each column,
+        which concatenates to the same dtypes as the full df.
+
+        :param df: The df to sample
+        :return: The one row df
+        """
+        if df.columns.empty:
+            return pd.DataFrame(index=[0])
+        cols = [df.iloc[[df.iloc[:, idx].notna().argmax()], [idx]]
+                for idx in range(len(df.columns))]
+        return pd.concat([x.reset_index(drop=True) for x in cols], axis=1)
+
+    def get_concat_dtypes(self, frames):
+        """
+        Gets the dtypes concatenating frames one at a time would produce.
+        pd.concat unifies some mixes, like int and bool columns, differently
+        for many frames than for two, so samples are folded pairwise.
+
+        :param frames: List of dfs in concat order
+        :return: Series of column to dtype
+        """
+        sample = pd.DataFrame()
+        for frame in frames:
+            sample = pd.concat([sample, self.get_sample(frame)],
+                               ignore_index=True)
+        return sample.dtypes
+
+    def concat(self, df):
+        """
+        Concatenates the collected frames onto df in a single pass.
+
+        :param df: The df collected frames are appended to
+        :return: The combined df
+        """
+        frames = [df.dropna(axis=1, how='all')]
+        for frame in self.frames:
+            if isinstance(frame, str):
+                spill_file = frame
+                frame = pd.read_pickle(spill_file)
+                os.remove(spill_file)
+            if self.categorical:
+                frame = utl.categorize(frame, self.category_cols)
+            frames.append(frame)
+        self.frames = []
+        frames = [x for x in frames if len(x.index)]
+        if self.categorical:
+            frames = utl.unify_categories(frames)
+        if len(frames) > 1:
+            dtypes = self.get_concat_dtypes(frames)
+            df = pd.concat(frames, ignore_index=True)
+            for idx, dtype in enumerate(dtypes):
+                if df.dtypes.iloc[idx] != dtype:
+                    df.isetitem(idx, df.iloc[:, idx].astype(dtype))
+        elif frames:
+            df = frames[0]
+        else:
+            df = df.dropna(axis=1, how='all')
+        if self.spill_path and os.path.isdir(self.spill_path):
+            if not os.listdir(self.spill_path):
+                os.rmdir(self.spill_path)
+                self.spill_path = None
+        return df
+
+
+class MergeSourceCache(object):
+    """
+    Run scoped cache of the frames merge transforms read, so a lookup table
+    merged into many data sources is read and transformed once.  Frames are
+    keyed on the merge source and a fingerprint of its file and params, and
+    with a path set are shared with worker processes through pickle files.
+    Outside of a run every merge reads its source as before.
+    """
+    active = False
+    path = None
+    frames = {}
+    matrix = None
+    matrix_stamp = None
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def start(cls, path=None):
+        """
+        Starts caching merge sources for a run.
+
+        :param path: Directory shared with worker processes, a new one is
+            made if not given
+        :return: The path of the cache directory
+        """
+        cls.reset()
+        cls.active = True
+        cls.path = path if path else tempfile.mkdtemp(prefix='merge_')
+        return cls.path
+
+    @classmethod
+    def stop(cls, remove=True):
+        """
+        Stops caching, logs how many reads it saved and removes the cache
+        directory.
+
+        :param remove: Removes the cache directory, False in worker
+            processes that share the directory of the parent
+        :return: None
+        """
+        if cls.hits or cls.misses:
+            logging.info('Merge source cache read {} sources, reused {} '
+                         'times.'.format(cls.misses, cls.hits))
+        if remove and cls.path and os.path.isdir(cls.path):
+            shutil.rmtree(cls.path, ignore_errors=True)
+        cls.reset()
+
+    @classmethod
+    def reset(cls):
+        cls.active = False
+        cls.path = None
+        cls.frames = {}
+        cls.matrix = None
+        cls.matrix_stamp = None
+        cls.hits = 0
+        cls.misses = 0
+
+    @classmethod
+    def get_matrix(cls):
+        """
+        Gets a vendor matrix with full file names, reused while the vendor
+        matrix file is unchanged and a run is active.
+
+        :return: The VendorMatrix
+        """
+        file_name = os.path.join(csv_path, csv_file)
+        stamp = None
+        if os.path.isfile(file_name):
+            stat = os.stat(file_name)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        if (cls.active and cls.matrix is not None and
+                cls.matrix_stamp == stamp):
+            return cls.matrix
+        matrix = VendorMatrix(display_log=False)
+        if cls.active:
+            cls.matrix, cls.matrix_stamp = matrix, stamp
+        return matrix
+
+    @staticmethod
+    def stat_file(file_name):
+        file_name = file_name.split(utl.sheet_name_splitter)[0]
+        if not os.path.isfile(file_name):
+            return None
+        stat = os.stat(file_name)
+        return [os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size]
+
+    @staticmethod
+    def read_source(merge_file, matrix=None):
+        """
+        Reads a merge source, a csv file or a data source transformed
+        without its own merges.
+
+        :param merge_file: The file name or vendor key to merge
+        :param matrix: The VendorMatrix the vendor key is in
+        :return: The merge df
+        """
+        if '.' in merge_file:
+            return pd.read_csv(merge_file)
+        ven_param = matrix.vendor_set(merge_file)
+        ds = DataSource(merge_file, matrix.vm_rules_dict, **ven_param)
+        merge_df = ds.get_raw_df_before_transform()
+        if not merge_df.empty and merge_df is not None:
+            merge_df = df_transform(merge_df, ds.p[vmc.transform],
+                                    skip_transforms=['Merge', 'MergeReplace',
+                                                     'MergeReplaceExclude'])
+        return merge_df
+
+    @classmethod
+    def get_key(cls, merge_file, matrix=None, merge_cols=None):
+        if '.' in merge_file:
+            key = ['file', merge_file, cls.stat_file(merge_file)]
+        else:
+            ven_param = matrix.vendor_set(merge_file)
+            key = ['source', merge_file, ven_param, matrix.vm_rules_dict,
+                   cls.stat_file(ven_param.get(vmc.filename, ''))]
+        return fc.SourceCache.hash_value(key + [merge_cols])
+
+    @staticmethod
+    def prepare_source(merge_df, merge_cols=None):
+        if merge_cols and merge_df is not None and not merge_df.empty:
+            merge_df = merge_col_creation(merge_df, merge_cols)
+        return merge_df
+
+    @classmethod
+    def load(cls, merge_file, merge_cols=None):
+        """
+        Gets a copy of the frame of a merge source, reading it only when it
+        is not cached for this run.  With merge_cols the frame is returned
+        with its merge-col key, which is cached as well.
+
+        :param merge_file: The file name or vendor key to merge
+        :param merge_cols: List of columns of the source to join on
+        :return: The merge df
+        """
+        matrix = None if '.' in merge_file else cls.get_matrix()
+        if not cls.active:
+            return cls.prepare_source(cls.read_source(merge_file, matrix),
+                                      merge_cols)
+        key = cls.get_key(merge_file, matrix, merge_cols)
+        cache_file = os.path.join(cls.path, key + '.pkl')
+        if key not in cls.frames and os.path.isfile(cache_file):
+            cls.frames[key] = pd.read_pickle(cache_file)
+        if key in cls.frames:
+            cls.hits += 1
+            merge_df, used_today = cls.frames[key]
+        else:
+            if merge_cols:
+                merge_df = cls.prepare_source(cls.load(merge_file),
+                                              merge_cols)
+                used_today = cls.frames[cls.get_key(merge_file, matrix)][1]
+            else:
+                cls.misses += 1
+                used = utl.TodayTracker.reset()
+                merge_df = cls.read_source(merge_file, matrix)
+                used_today = utl.TodayTracker.reset()
+                if used:
+                    utl.TodayTracker.mark()
+            cls.frames[key] = (merge_df, used_today)
+            fc.FileCache(cls.path).write_atomic(
+                cache_file, lambda x: pd.to_pickle(cls.frames[key], x))
+        if used_today:
+            utl.TodayTracker.mark()
+        if merge_df is not None:
+            merge_df = merge_df.copy()
+        return merge_df
+
+
 class DataSource(object):
-    def __init__(self, key, vm_rules, **ven_param):
+    def __init__(self, key, vm_rules, raw_cache=None, **ven_param):
         self.key = key
         self.vm_rules = vm_rules
+        self.raw_cache = raw_cache
         self.params = ven_param
         self.ic_params = None
         self.p = self.params
@@ -762,9 +1221,7 @@ class DataSource(object):
             self.set_in_vendormatrix(vm_rule[col], new_rule[col], matrix)
         return matrix
 
-    def get_raw_df_before_transform(self, nrows=None):
-        if vmc.filename not in self.p:
-            return pd.DataFrame()
+    def read_raw_df(self, nrows=None):
         df = utl.import_read_csv(self.p[vmc.filename], nrows=nrows)
         if df is None or df.empty:
             return df
@@ -772,6 +1229,16 @@ class DataSource(object):
         df = utl.first_last_adj(df, self.p[vmc.firstrow], self.p[vmc.lastrow])
         return df
 
+    def get_raw_df_before_transform(self, nrows=None):
+        if vmc.filename not in self.p:
+            return pd.DataFrame()
+        if self.raw_cache and nrows is None:
+            params = [self.p[x] for x in [vmc.header, vmc.firstrow,
+                                          vmc.lastrow]]
+            return self.raw_cache.load(self.p[vmc.filename], params,
+                                       self.read_raw_df)
+        return self.read_raw_df(nrows=nrows)
+
     def get_raw_df(self, nrows=None):
         df = self.get_raw_df_before_transform(nrows=nrows)
         if df is None or df.empty:
@@ -859,6 +1326,26 @@ class DataSource(object):
         self.df[vmc.vendorkey] = self.key
         return self.df
 
+    def import_and_cache_data(self, source_cache=None, merge_params=None):
+        """
+        Imports the data source and stores the result in the source cache
+        with a fingerprint of its inputs.  Journaled writes are flushed first
+        so the fingerprint hashes the files as the build reads them.
+
+        :param source_cache: SourceCache to store the df in
+        :param merge_params: Dict of merge vendor key to its params
+        :return: The imported df
+        """
+        if not source_cache:
+            return self.import_data()
+        utl.WriteJournal.flush()
+        fingerprint = source_cache.get_fingerprint(self.p, self.vm_rules,
+                                                   merge_params)
+        utl.TodayTracker.reset()
+        df = self.import_data()
+        source_cache.save(self.key, df, fingerprint, utl.TodayTracker.reset())
+        return df
+
     def add_import_config_params(self, import_type='API_', matrix=None,
                                  ic=None, current_imports=None):
         if not matrix:
@@ -880,6 +1367,48 @@ class DataSource(object):
         utl.write_file(df, self.p[vmc.filename_true])
 
 
+def import_data_sources(vendor_keys, vm_rules, ven_params, spill_path=None,
+                        raw_cache=None, source_cache=None, merge_params=None,
+                        merge_path=None, rule_stats=False):
+    """
+    Imports a group of data sources in order within a worker process.
+
+    :param vendor_keys: List of vendor keys to import
+    :param vm_rules: The vm rules dict of the vendor matrix
+    :param ven_params: Dict of vendor key to its vendor matrix params
+    :param spill_path: Directory to write each df to instead of returning it
+    :param raw_cache: RawFileCache to read unchanged raw files from
+    :param source_cache: SourceCache to store each imported df in
+    :param merge_params: Dict of vendor key to the params of its merges
+    :param merge_path: Directory of the parent's MergeSourceCache
+    :param rule_stats: Record the rows each vm rule matched and its time
+    :return: Dict of vendor key to the imported df or its spill file, the
+        type conversion counts and the vm rule stats of the group
+    """
+    if merge_params is None:
+        merge_params = {}
+    if merge_path:
+        MergeSourceCache.start(merge_path)
+    utl.TypeCounter.reset()
+    utl.RuleEngine.reset(report=rule_stats)
+    tdfs = {}
+    try:
+        with utl.WriteJournal():
+            for vk in vendor_keys:
+                logging.info('Initializing {}'.format(vk))
+                ds = DataSource(vk, vm_rules, raw_cache=raw_cache,
+                                **ven_params[vk])
+                tdfs[vk] = ds.import_and_cache_data(source_cache,
+                                                    merge_params.get(vk))
+                if spill_path:
+                    tdfs[vk] = FrameCollector.spill_frame(
+                        tdfs[vk].dropna(axis=1, how='all'), spill_path)
+    finally:
+        if merge_path:
+            MergeSourceCache.stop(remove=False)
+    return tdfs, utl.TypeCounter.reset(), utl.RuleEngine.reset()
+
+
 def import_plan_data(key, df, plan_omit_list, **kwargs):
     """
     Imports and cleans plan data
@@ -936,6 +1465,76 @@ def df_transform(df, transform, skip_transforms=[]):
     return df
 
 
+def merge_col_creation(df, cols):
+    """
+    Cleans the columns one side of a merge transform joins on and combines
+    them into the merge-col key.
+
+    :param df: The df of one side of the merge
+    :param cols: List of columns to join on
+    :return: The df with the merge-col column
+    """
+    for c in cols:
+        if df[c].dtype == 'float64':
+            df[c] = df[c].fillna(0).astype('int')
+        df[c] = df[c].astype('U')
+        df[c] = df[c].str.strip('.0')
+    return full_placement_creation(df, 'None', 'merge-col', cols)
+
+
+def date_split(df, start_date, end_date, exempt_col=None,
+               chunk_size=1000000):
+    """
+    Splits each row into a row per day from its start_date to its end_date,
+    dividing the numeric columns evenly across the days.  The day offsets
+    are computed for all rows at once, in chunks of about chunk_size
+    expanded rows so the index arrays stay bounded.
+
+    :param df: The df to split
+    :param start_date: Column with the first day, replaced by each day
+    :param end_date: Column with the last day
+    :param exempt_col: List of numeric columns not to divide
+    :param chunk_size: Expanded rows built at a time
+    :return: The df with a row per day
+    """
+    if exempt_col is None:
+        exempt_col = []
+    df = utl.data_to_type(df, date_col=[end_date, start_date])
+    df['days'] = (df[end_date] - df[start_date]).dt.days + 1
+    n_cols = [x for x in df.columns if df[x].dtype in ['int64', 'float64']
+              and x not in exempt_col + ['days']]
+    df[n_cols] = df[n_cols].div(df['days'], axis=0)
+    if df.empty or not df.index.is_unique:
+        # Rows sharing an index label are dated as one run of days here.
+        df = df.loc[df.index.repeat(df['days'])]
+        df[start_date] = (df.groupby(level=0)[start_date].transform(
+            lambda x: pd.date_range(start=x.iat[0], periods=len(x))))
+        df = df.drop('days', axis=1)
+        return df.reset_index(drop=True)
+    days = df['days'].to_numpy().astype(np.int64, casting='safe')
+    df = df.drop('days', axis=1)
+    row_ends = np.cumsum(days)
+    row_starts = row_ends - days
+    bounds = [0]
+    while bounds[-1] < len(days):
+        stop = np.searchsorted(row_ends, row_starts[bounds[-1]] + chunk_size,
+                               side='right')
+        bounds.append(max(stop, bounds[-1] + 1))
+    dfs = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows = np.repeat(np.arange(start, stop), days[start:stop])
+        positions = np.arange(len(rows)) + row_starts[start]
+        offsets = positions - np.repeat(row_starts[start:stop],
+                                        days[start:stop])
+        tdf = df.take(rows)
+        tdf[start_date] = (tdf[start_date].to_numpy() +
+                           offsets.astype('timedelta64[D]'))
+        dfs.append(tdf)
+    if len(dfs) == 1:
+        return dfs[0].reset_index(drop=True)
+    return pd.concat(dfs, ignore_index=True)
+
+
 def df_single_transform(df, transform):
     if str(transform) == 'nan':
         return df
@@ -973,43 +1572,17 @@ def df_single_transform(df, transform):
     if (transform_type == 'Merge' or transform_type == 'MergeReplace'
             or transform_type == 'MergeReplaceExclude'):
         merge_file = transform[1]
-        if '.' in merge_file:
-            merge_df = pd.read_csv(merge_file)
-        else:
-            matrix = VendorMatrix(display_log=False)
-            matrix.sort_vendor_list()
-            ven_param = matrix.vendor_set(merge_file)
-            ds = DataSource(merge_file, matrix.vm_rules_dict, **ven_param)
-            merge_df = ds.get_raw_df_before_transform()
-            if not merge_df.empty and merge_df is not None:
-                merge_df = df_transform(merge_df, ds.p[vmc.transform],
-                                        skip_transforms=['Merge',
-                                                         'MergeReplace',
-                                                         'MergeReplaceExclude']
-                                        )
+        merge_cols = transform[2:]
+        left_merge = merge_cols[::2]
+        right_merge_full = merge_cols[1::2]
+        right_merge = [x.split('|')[0] for x in right_merge_full]
+        merge_df = MergeSourceCache.load(merge_file, right_merge)
         if merge_df is None or merge_df.empty:
             logging.error('Unable to execute merge transform. Requested merge '
                           'source {} returned empty dataframe.'
                           .format(merge_file))
             return df
-        merge_cols = transform[2:]
-        left_merge = merge_cols[::2]
-        right_merge_full = merge_cols[1::2]
-        right_merge = [x.split('|')[0] for x in right_merge_full]
-        dfs = {'left': {'cols': left_merge, 'df': df},
-               'right': {'cols': right_merge, 'df': merge_df}}
-        for side in dfs:
-            col = dfs[side]['cols']
-            cdf = dfs[side]['df']
-            for c in col:
-                if cdf[c].dtype == 'float64':
-                    cdf[c] = cdf[c].fillna(0).astype('int')
-                cdf[c] = cdf[c].astype('U')
-                cdf[c] = cdf[c].str.strip('.0')
-            cdf = full_placement_creation(cdf, 'None', 'merge-col', col)
-            dfs[side]['df'] = cdf
-        df = dfs['left']['df']
-        merge_df = dfs['right']['df']
+        df = merge_col_creation(df, left_merge)
         if (transform_type == 'MergeReplace'
                 or transform_type == 'MergeReplaceExclude'):
             for idx, col in enumerate(right_merge_full):
@@ -1037,16 +1610,7 @@ def df_single_transform(df, transform):
             exempt_col = transform[3].split('|')
         else:
             exempt_col = []
-        df = utl.data_to_type(df, date_col=[end_date, start_date])
-        df['days'] = (df[end_date] - df[start_date]).dt.days + 1
-        n_cols = [x for x in df.columns if df[x].dtype in ['int64', 'float64']
-                  and x not in exempt_col + ['days']]
-        df[n_cols] = df[n_cols].div(df['days'], axis=0)
-        df = df.loc[df.index.repeat(df['days'])]
-        df[start_date] = (df.groupby(level=0)[start_date].transform(
-            lambda x: pd.date_range(start=x.iat[0], periods=len(x))))
-        df = df.drop('days', axis=1)
-        df = df.reset_index(drop=True)  # type: pd.DataFrame
+        df = date_split(df, start_date, end_date, exempt_col)
     if transform_type == 'Stack':
         header_col_name = transform[1]
         hold_col_name = transform[2]
@@ -0,0 +1,830 @@
+import os
+import sys
+import time
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+import datetime as dt
+import processor.reporting.calc as cal
+import processor.reporting.analyze as az
+import processor.reporting.utils as utl
+import processor.reporting.filecache as fc
+import processor.reporting.dictionary as dct
+import processor.reporting.errorreport as er
+import processor.reporting.vmcolumns as vmc
+import processor.reporting.vendormatrix as vm
+import processor.reporting.dictcolumns as dctc
+
+
+def time_func(func, *args, **kwargs):
+    """
+    Runs a function once and returns its result and elapsed time.
+
+    :param func: The function to time
+    :param args: Positional arguments passed to func
+    :param kwargs: Keyword arguments passed to func
+    :return: Tuple of the result and elapsed seconds
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def string_to_date_per_cell(ser, fill_empty=True):
+    """
+    The per cell date conversion data_to_type used before column_to_date.
+
+    :param ser: The series to convert
+    :param fill_empty: Fill empty cells with today rather than NaT
+    :return: Series of datetime64 values
+    """
+    ser = ser.replace(['1/0/1900', '1/1/1970'], '0')
+    if fill_empty:
+        ser = ser.astype('object').where(ser.notna(), dt.date.today())
+    else:
+        ser = ser.fillna(pd.Timestamp('nat'))
+    ser = ser.astype('U').apply(utl.string_to_date)
+    return pd.to_datetime(ser, errors='coerce').dt.normalize()
+
+
+def benchmark_date_column(num_rows=5000000, num_days=365):
+    """
+    Compares column_to_date to the per cell conversion on a date column in
+    the formats raw files commonly use.
+
+    :param num_rows: Rows in the column
+    :param num_days: Distinct dates in the column
+    :return: None
+    """
+    days = pd.date_range('2022-01-01', periods=num_days)
+    rng = np.random.default_rng(0)
+    for date_format in ['%m/%d/%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S']:
+        values = days.strftime(date_format).to_numpy(dtype=object)
+        ser = pd.Series(rng.choice(values, num_rows))
+        ser[::1000] = np.nan
+        new_df, new_time = time_func(utl.column_to_date, ser)
+        old_df, old_time = time_func(string_to_date_per_cell, ser)
+        assert new_df.equals(old_df)
+        print('{:<20} rows: {} per cell: {:.2f}s column: {:.2f}s'.format(
+            date_format, num_rows, old_time, new_time))
+
+
+def float_column_per_cell(ser):
+    """
+    The per cell float conversion data_to_type used before money_chars.
+
+    :param ser: The series to convert
+    :return: Series of float values
+    """
+    ser = ser.fillna(0).astype('U')
+    ser = ser.apply(lambda x: x.replace('$', ''))
+    ser = ser.apply(lambda x: x.replace(',', ''))
+    return pd.to_numeric(ser, errors='coerce').astype(float)
+
+
+def benchmark_float_column(num_rows=5000000):
+    """
+    Compares data_to_type float conversion to the per cell conversion on a
+    currency formatted column and on a column that is already float.
+
+    :param num_rows: Rows in the column
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    ser = pd.Series(np.round(rng.random(num_rows) * 10000, 2))
+    for name, col in [('str', ser.map('${:,.2f}'.format)), ('float', ser)]:
+        df = pd.DataFrame({'col': col})
+        new_df, new_time = time_func(utl.data_to_type, df, float_col=['col'])
+        old_df, old_time = time_func(float_column_per_cell, col)
+        assert np.allclose(new_df['col'], old_df)
+        print('{:<20} rows: {} per cell: {:.2f}s column: {:.2f}s'.format(
+            name, num_rows, old_time, new_time))
+
+
+def benchmark_raw_file_cache(num_rows=1000000):
+    """
+    Compares reading a raw csv to reading it from a warm RawFileCache.
+
+    :param num_rows: Rows in the raw file
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'Date': pd.date_range('2022-01-01', periods=num_rows, freq='min'),
+        'Ad Name': rng.choice(['Camp{}_Ad{}'.format(x, x) for x in range(500)],
+                              num_rows),
+        'Impressions': rng.integers(0, 1000, num_rows),
+        'Spend': rng.random(num_rows).round(2)})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, 'raw.csv')
+        df.to_csv(file_name, index=False)
+        raw_cache = fc.RawFileCache(path=os.path.join(tmp_dir, 'cache'))
+        old_df, old_time = time_func(utl.import_read_csv, file_name)
+        raw_cache.load(file_name, [], lambda: old_df)
+        new_df, new_time = time_func(
+            raw_cache.load, file_name, [], lambda: None)
+        assert new_df.equals(old_df)
+    print('{:<20} rows: {} csv: {:.2f}s cache: {:.2f}s'.format(
+        'raw file', num_rows, old_time, new_time))
+
+
+def benchmark_output_file(num_rows=1000000):
+    """
+    Compares writing the output with one to_csv call to write_output_file
+    and reading it back from the csv to reading the parquet sidecar.
+
+    :param num_rows: Rows in the output
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'Date': pd.date_range('2022-01-01', periods=num_rows, freq='min'),
+        'Ad Name': rng.choice(['Camp{}_Ad{}'.format(x, x) for x in range(500)],
+                              num_rows),
+        'Impressions': rng.integers(0, 1000, num_rows),
+        'Net Cost Final': rng.random(num_rows).round(2)})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, 'output.csv')
+        _, old_time = time_func(df.to_csv, file_name, index=False)
+        for compression in [None, 'gzip']:
+            _, new_time = time_func(utl.write_output_file, df, file_name,
+                                    compression=compression, sidecar=True)
+            print('{:<20} rows: {} to_csv: {:.2f}s chunked: {:.2f}s'.format(
+                'write {}'.format(compression), num_rows, old_time, new_time))
+        _, old_time = time_func(utl.import_read_csv, file_name)
+        _, new_time = time_func(utl.read_output_file, file_name)
+    print('{:<20} rows: {} csv: {:.2f}s parquet: {:.2f}s'.format(
+        'read output', num_rows, old_time, new_time))
+
+
+def benchmark_dict_index(num_rows=5000000, num_keys=200000):
+    """
+    Compares the merges Dict.merge and ErrorReport.create did to the
+    DictIndex lookups that replace them.
+
+    :param num_rows: Rows in the data
+    :param num_keys: Placements in the dictionary
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    keys = np.array(['Camp{}_Ad{}_Size{}'.format(x, x % 97, x % 7)
+                     for x in range(num_keys)], dtype=object)
+    dic = dct.Dict()
+    dic.data_dict = pd.DataFrame({dctc.FPN: keys, dctc.PN: keys,
+                                  dctc.CAM: keys, dctc.VEN: 'Vendor'})
+    data_keys = np.append(keys, ['Missing{}'.format(x) for x in range(100)])
+    df = pd.DataFrame({dctc.FPN: rng.choice(data_keys, num_rows),
+                       'Impressions': rng.integers(0, 1000, num_rows)})
+    old_df, old_time = time_func(df.merge, dic.data_dict, on=dctc.FPN,
+                                 how='left')
+    new_df, new_time = time_func(dic.merge, df, dctc.FPN)
+    assert new_df.equals(old_df)
+    print('{:<20} rows: {} merge: {:.2f}s index: {:.2f}s'.format(
+        'dict merge', num_rows, old_time, new_time))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            new_err, new_time = time_func(er.ErrorReport, df, dic, None,
+                                          'err.csv')
+            get_index = er.ErrorReport.get_index
+            er.ErrorReport.get_index = lambda x: None
+            old_err, old_time = time_func(er.ErrorReport, df, dic, None,
+                                          'err.csv')
+            er.ErrorReport.get_index = get_index
+        finally:
+            os.chdir(cwd)
+    assert new_err.get().equals(old_err.get())
+    print('{:<20} rows: {} merge: {:.2f}s index: {:.2f}s'.format(
+        'error report', num_rows, old_time, new_time))
+
+
+def make_processed_frames(num_rows, num_sources):
+    """
+    Builds the frames of data sources as vm_loop collects them, with the
+    low cardinality dictionary columns a processed output carries.
+
+    :param num_rows: Rows across all data sources
+    :param num_sources: Data sources to split the rows over
+    :return: List of dfs
+    """
+    rng = np.random.default_rng(0)
+    dim_cols = [x for x in vm.FrameCollector.category_cols
+                if x not in [dctc.FPN, dctc.PN]][:30]
+    frames = []
+    for source in range(num_sources):
+        size = num_rows // num_sources
+        placements = ['Source{}_Placement{}'.format(source, x)
+                      for x in range(1000)]
+        df = pd.DataFrame({
+            vmc.date: pd.Timestamp('2022-01-01') + pd.to_timedelta(
+                rng.integers(0, 365, size), unit='D'),
+            dctc.FPN: rng.choice(placements, size),
+            vmc.impressions: rng.integers(0, 1000, size).astype(float),
+            vmc.clicks: rng.integers(0, 10, size).astype(float),
+            vmc.cost: rng.random(size).round(2)})
+        df[dctc.PN] = df[dctc.FPN]
+        df[dctc.PFPN] = df[dctc.FPN]
+        for idx, col in enumerate(dim_cols):
+            values = ['{} {}'.format(col, x) for x in range(2 + idx % 20)]
+            df[col] = rng.choice(values, size).astype(object)
+        df[dctc.BM] = rng.choice([cal.BM_CPM, cal.BM_CPC, 'None'], size)
+        df[dctc.BR] = rng.random(size).round(2)
+        df[dctc.PNC] = 1000.0
+        frames.append(df)
+    return frames
+
+
+def benchmark_categorical(num_rows=5000000, num_sources=20):
+    """
+    Compares memory and the time to concat and calculate costs of the
+    processed output with and without categorical dictionary columns.
+
+    :param num_rows: Rows in the output
+    :param num_sources: Data sources the output is combined from
+    :return: None
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            for categorical in [False, True]:
+                frames = make_processed_frames(num_rows, num_sources)
+                collector = vm.FrameCollector(categorical=categorical)
+                _, add_time = time_func(lambda: [collector.add(x)
+                                                 for x in frames])
+                del frames
+                df, concat_time = time_func(collector.concat, pd.DataFrame())
+                memory = df.memory_usage(deep=True).sum() / 1024 ** 2
+                df, calc_time = time_func(cal.calculate_cost, df)
+                results[categorical] = utl.decategorize(df)
+                print('{:<20} rows: {} memory: {:.0f}MB collect: {:.2f}s '
+                      'concat: {:.2f}s costs: {:.2f}s'.format(
+                        'categorical {}'.format(categorical), num_rows,
+                        memory, add_time, concat_time, calc_time))
+        finally:
+            os.chdir(cwd)
+    pd.testing.assert_frame_equal(results[False], results[True])
+
+
+def benchmark_merge_sources(num_rows=1000000, num_sources=20):
+    """
+    Compares merge transforms of many data sources that each read the same
+    lookup file to the same merges with the MergeSourceCache active.
+
+    :param num_rows: Rows in the lookup file
+    :param num_sources: Data sources merging in the lookup file
+    :return: None
+    """
+    keys = ['Camp{}_Ad{}'.format(x, x % 97) for x in range(num_rows)]
+    df = pd.DataFrame({'ad_name': keys[:1000]})
+    transform = 'Merge::lookup.csv::ad_name::key'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            pd.DataFrame({'key': keys, 'label': ['L' + x for x in keys]}
+                         ).to_csv('lookup.csv', index=False)
+            old_dfs, old_time = time_func(
+                lambda: [vm.df_single_transform(df.copy(), transform)
+                         for _ in range(num_sources)])
+            vm.MergeSourceCache.start()
+            new_dfs, new_time = time_func(
+                lambda: [vm.df_single_transform(df.copy(), transform)
+                         for _ in range(num_sources)])
+            vm.MergeSourceCache.stop()
+        finally:
+            os.chdir(cwd)
+    assert all(x.equals(y) for x, y in zip(old_dfs, new_dfs))
+    print('{:<20} rows: {} per source: {:.2f}s cached: {:.2f}s'.format(
+        'merge sources', num_rows, old_time, new_time))
+
+
+def date_split_per_group(df, start_date, end_date, exempt_col):
+    """
+    The DateSplit transform before date_split, with a date_range per row.
+
+    :param df: The df to split
+    :param start_date: Column with the first day, replaced by each day
+    :param end_date: Column with the last day
+    :param exempt_col: List of numeric columns not to divide
+    :return: The df with a row per day
+    """
+    df = utl.data_to_type(df, date_col=[end_date, start_date])
+    df['days'] = (df[end_date] - df[start_date]).dt.days + 1
+    n_cols = [x for x in df.columns if df[x].dtype in ['int64', 'float64']
+              and x not in exempt_col + ['days']]
+    df[n_cols] = df[n_cols].div(df['days'], axis=0)
+    df = df.loc[df.index.repeat(df['days'])]
+    df[start_date] = (df.groupby(level=0)[start_date].transform(
+        lambda x: pd.date_range(start=x.iat[0], periods=len(x))))
+    df = df.drop('days', axis=1)
+    return df.reset_index(drop=True)
+
+
+def benchmark_date_split(num_rows=5000000, max_days=180):
+    """
+    Compares the per row date_range DateSplit to date_split on flights of
+    up to max_days that expand to about num_rows rows.
+
+    :param num_rows: Rows after the split
+    :param max_days: Longest flight in days
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    num_flights = max(num_rows * 2 // max_days, 1)
+    start = pd.Timestamp('2024-01-01') + pd.to_timedelta(
+        rng.integers(0, 365, num_flights), unit='D')
+    end = start + pd.to_timedelta(rng.integers(0, max_days, num_flights),
+                                  unit='D')
+    df = pd.DataFrame({
+        'Placement': ['Line{}'.format(x) for x in range(num_flights)],
+        'Start': start.strftime('%m/%d/%Y'), 'End': end.strftime('%m/%d/%Y'),
+        'Impressions': rng.integers(0, 100000, num_flights),
+        'Rate': rng.integers(1, 20, num_flights)})
+    old_df, old_time = time_func(date_split_per_group, df.copy(), 'Start',
+                                 'End', ['Rate'])
+    new_df, new_time = time_func(vm.date_split, df.copy(), 'Start', 'End',
+                                 ['Rate'])
+    assert new_df.equals(old_df)
+    print('{:<20} rows: {} per row: {:.2f}s vectorized: {:.2f}s'.format(
+        'date split', len(new_df.index), old_time, new_time))
+
+
+def apply_rules_per_index(df, vm_rules, pre_or_post, **kwargs):
+    """
+    The apply_rules loop before RuleEngine, reparsing every rule per call
+    and tracking grouped rows as index lists.
+
+    :param df: The df to apply the rules to
+    :param vm_rules: Dict of rule number to rule column names
+    :param pre_or_post: PRE or POST rules to run
+    :param kwargs: The vendor matrix row with the rule values
+    :return: The df with the rules applied
+    """
+    grouped_q_idx = {}
+    for rule in vm_rules:
+        for item in utl.RULE_CONST:
+            if item not in vm_rules[rule].keys():
+                logging.warning('{} not in vendormatrix for rule {}.  '
+                                'The rule did not run.'.format(item, rule))
+                return df
+        metrics = kwargs[vm_rules[rule][utl.RULE_METRIC]]
+        queries = kwargs[vm_rules[rule][utl.RULE_QUERY]]
+        factor = kwargs[vm_rules[rule][utl.RULE_FACTOR]]
+        if (str(metrics) == 'nan' or str(queries) == 'nan' or
+                str(factor) == 'nan'):
+            continue
+        metrics = metrics.split('::')
+        if metrics[0] != pre_or_post:
+            continue
+        set_column_to_value = False
+        if len(metrics) == 3:
+            set_column_to_value = True
+            if metrics[1] not in df.columns:
+                logging.warning(
+                    '{} not in columns setting to 0.'.format(metrics[1]))
+                df[metrics[1]] = 0
+            if metrics[2] in grouped_q_idx:
+                df.loc[~df.index.isin(grouped_q_idx[metrics[2]]),
+                       metrics[2]] = (
+                    df.loc[~df.index.isin(grouped_q_idx[metrics[2]]),
+                           metrics[1]])
+            else:
+                df[metrics[2]] = df[metrics[1]]
+            metrics[1] = metrics[2]
+        tdf = df
+        metrics = metrics[1].split('|')
+        queries = queries.split('|')
+        for query in queries:
+            query = query.split('::')
+            if len(query) == 1:
+                logging.warning('Malformed query: {} \n In rule: {} \n'
+                                'It may only have one :.  It was not used to'
+                                'filter data'.format(query, rule))
+                continue
+            values = query[1].split(',')
+            if query[0] not in df:
+                logging.warning('{} not in data for rule {}.  '
+                                'The rule did not run.'.format(query[0], rule))
+                return df
+            if query[0] == vmc.date:
+                sd = utl.string_to_date(values[0])
+                ed = utl.string_to_date(values[1])
+                tdf = tdf.loc[(df[query[0]] >= sd) & (df[query[0]] <= ed)]
+            else:
+                if len(query) == 3 and query[2] == 'EXCLUDE':
+                    tdf = tdf.loc[~tdf[query[0]].isin(values)]
+                else:
+                    tdf = tdf.loc[tdf[query[0]].isin(values)]
+        q_idx = list(tdf.index.values)
+        for metric in metrics:
+            if metric not in df:
+                logging.warning('{} not in data for rule {}.  '
+                                'The rule did not run.'.format(metric, rule))
+                continue
+            df = utl.data_to_type(df, float_col=[metric])
+            df.loc[q_idx, metric] = (df.loc[q_idx, metric].astype(float) *
+                                     float(factor))
+            if set_column_to_value:
+                if metric not in grouped_q_idx:
+                    grouped_q_idx[metric] = q_idx
+                else:
+                    grouped_q_idx[metric].extend(q_idx)
+    for metric in grouped_q_idx:
+        if metric not in df:
+            continue
+        df.loc[~df.index.isin(grouped_q_idx[metric]), metric] = (
+                df.loc[~df.index.isin(grouped_q_idx[metric]), metric]
+                .astype(float) * 0)
+    return df
+
+
+def benchmark_vm_rules(num_rows=5000000, num_rules=10):
+    """
+    Compares the per call apply_rules loop to RuleEngine on num_rules rules
+    over num_rows rows, run for a data source with PRE and POST rules.
+
+    :param num_rows: Rows in the df
+    :param num_rules: Number of rules on the vendor matrix row
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    vendors = ['Vendor{}'.format(x) for x in range(num_rules * 2)]
+    df = pd.DataFrame({
+        vmc.date: pd.Timestamp('2024-01-01') + pd.to_timedelta(
+            rng.integers(0, 365, num_rows), unit='D'),
+        dctc.VEN: rng.choice(vendors, num_rows),
+        vmc.impressions: rng.integers(0, 10000, num_rows).astype(float),
+        vmc.cost: rng.random(num_rows) * 100})
+    vm_rules = {}
+    kwargs = {}
+    for idx in range(num_rules):
+        metric = 'POST::{}::{}'.format(vmc.cost, vmc.clicks)
+        query = '{}::{},{}'.format(dctc.VEN, vendors[idx], vendors[-idx - 1])
+        if idx % 2:
+            metric = 'PRE::{}'.format(vmc.impressions)
+            query = '{}::2024-0{}-01,2024-0{}-28'.format(
+                vmc.date, idx % 9 + 1, idx % 9 + 1)
+        vm_rules[idx] = {}
+        for col, value in zip(utl.RULE_CONST, (metric, query, idx + 1)):
+            rule_name = 'RULE_{}_{}'.format(idx, col)
+            vm_rules[idx][col] = rule_name
+            kwargs[rule_name] = value
+
+    def run_rules(func):
+        tdf = func(df.copy(), vm_rules, utl.PRE, **kwargs)
+        return func(tdf, vm_rules, utl.POST, **kwargs)
+    utl.RuleEngine.reset()
+    old_df, old_time = time_func(run_rules, apply_rules_per_index)
+    new_df, new_time = time_func(run_rules, utl.apply_rules)
+    assert new_df.equals(old_df)
+    print('{:<20} rules: {} per index: {:.2f}s masks: {:.2f}s'.format(
+        'vm rules', num_rules, old_time, new_time))
+
+
+def net_cost_final_merge_chain(df, p_col=dctc.PFPN, n_cost=vmc.cost,
+                               p_cost=dctc.PNC):
+    """
+    net_cost_final_calculation before the single pass, merging each step
+    onto the df.
+
+    :param df: The dataframe with all metrics/dimensions
+    :param p_col: The column with the dimension to group by
+    :param n_cost: The column with the metric to be capped
+    :param p_cost: The column with the metric to cap at
+    :return: The dataframe with the metric capped under Net Cost Final
+    """
+    df = cal.net_plan_comp(df, p_col=p_col, n_cost=n_cost, p_cost=p_cost)
+    df = cal.net_cum_sum(df, p_col=p_col, n_cost=n_cost)
+    df = cal.net_sum_date(df, p_col=p_col, n_cost=n_cost)
+    return cal.net_cost_final(df, p_col=p_col, n_cost=n_cost)
+
+
+def benchmark_net_cost_final(num_rows=5000000, num_caps=4):
+    """
+    Compares MetricCap and Net Cost Final with the merge chain to the single
+    pass net_cost_final_calculation for num_caps cap files.
+
+    :param num_rows: Rows in the df
+    :param num_caps: Number of cap files in the cap config
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    num_places = max(num_rows // 100, 1)
+    places = np.array(['Place{}'.format(x) for x in range(num_places)])
+    df = pd.DataFrame({
+        dctc.FPN: rng.choice(places, num_rows),
+        vmc.date: pd.Timestamp('2024-01-01') + pd.to_timedelta(
+            rng.integers(0, 90, num_rows), unit='D'),
+        vmc.cost: rng.random(num_rows) * 100,
+        dctc.PNC: rng.choice([0, 20, 50], num_rows).astype(float)})
+    df[dctc.PFPN] = df[dctc.FPN]
+    config = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for idx in range(num_caps):
+            dim = 'Cap Dim{}'.format(idx)
+            num_dims = max(num_places // (10 ** idx), 1)
+            df[dim] = 'Dim' + (df[dctc.FPN].str[5:].astype(int) %
+                               num_dims).astype(str)
+            file_name = os.path.join(tmp_dir, 'cap{}.csv'.format(idx))
+            cap_df = pd.DataFrame({
+                'dim': ['Dim{}'.format(x) for x in range(num_dims)],
+                'metric': rng.random(num_dims) * 5000 * 10 ** idx})
+            cap_df.to_csv(file_name, index=False)
+            config.append({'file_name': file_name, 'file_dim': 'dim',
+                           'file_metric': 'metric', 'processor_dim': dim,
+                           'processor_metric': 'Cap{}'.format(idx)})
+        config_file = os.path.join(tmp_dir, 'cap_config.csv')
+        pd.DataFrame(config).to_csv(config_file, index=False)
+
+        def run_caps():
+            tdf = cal.MetricCap(config_file).apply_all_caps(df.copy())
+            return cal.net_cost_final_calculation(tdf)
+        single_pass = cal.net_cost_final_calculation
+        cal.net_cost_final_calculation = net_cost_final_merge_chain
+        try:
+            old_df, old_time = time_func(run_caps)
+        finally:
+            cal.net_cost_final_calculation = single_pass
+        new_df, new_time = time_func(run_caps)
+    assert new_df.equals(old_df)
+    print('{:<20} caps: {} merges: {:.2f}s single pass: {:.2f}s'.format(
+        'net cost final', num_caps, old_time, new_time))
+
+
+class SplitTokenizer(object):
+    @staticmethod
+    def get_unigrams_and_bigrams(text):
+        words = text.split()
+        return words + [' '.join(x) for x in zip(words, words[1:])]
+
+
+def make_tfidf_corpus(num_docs, rng):
+    """
+    Synthetic docs of 4 to 20 words drawn from a Zipf distribution.
+
+    :param num_docs: Docs in the corpus
+    :param rng: Numpy random generator
+    :return: List of the doc texts
+    """
+    vocab = np.array(['word{}'.format(x) for x in range(20000)])
+    word_ids = np.minimum(rng.zipf(1.3, num_docs * 20), len(vocab)) - 1
+    lengths = rng.integers(4, 20, num_docs)
+    splits = np.cumsum(lengths)[:-1]
+    return [' '.join(x) for x in np.split(
+        vocab[word_ids[:lengths.sum()]], splits)]
+
+
+def tfidf_dense_search(transformer, matrix, text, top_k=1):
+    """
+    The dense matrix search used before tfidf_matrix was a TermDocMatrix.
+
+    :param transformer: Trained TfIdfTransformer for the query vector
+    :param matrix: Dense docs by terms tf-idf matrix
+    :param text: Text to search matrix for
+    :param top_k: Number of results to return
+    :return: List of the similar documents
+    """
+    query_vec = transformer.compute_vector(text)
+    query_norm = np.linalg.norm(query_vec)
+    if query_norm < 1e-10:
+        return []
+    doc_norms = np.linalg.norm(matrix, axis=1)
+    dots = matrix @ query_vec
+    sims = np.divide(
+        dots, doc_norms * query_norm,
+        out=np.zeros_like(dots, dtype=np.float64),
+        where=doc_norms >= 1e-10)
+    similar_docs = list(enumerate(sims.tolist()))
+    similar_docs.sort(key=lambda x: x[1], reverse=True)
+    return similar_docs[:top_k]
+
+
+def benchmark_tfidf(num_docs=50000, num_queries=100, max_dense_mb=1024):
+    """
+    Trains a TfIdfTransformer on num_docs synthetic docs and reports the
+    size of the sparse matrix against the dense one it replaced and the
+    search time per query.  The dense search only runs if the dense matrix
+    fits in max_dense_mb.
+
+    :param num_docs: Docs in the corpus
+    :param num_queries: Queries to search
+    :param max_dense_mb: Largest dense matrix to build for comparison
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    texts = make_tfidf_corpus(num_docs, rng)
+    queries = [texts[x] for x in rng.integers(0, num_docs, num_queries)]
+    transformer, train_time = time_func(
+        az.TfIdfTransformer, texts=texts, ali_chat=SplitTokenizer())
+    matrix = transformer.tfidf_matrix
+    dense_mb = matrix.shape[0] * matrix.shape[1] * 4 / 1e6
+
+    def run_queries(func, *args):
+        return [func(*args, text=x, top_k=10) for x in queries]
+    new_results, new_time = time_func(run_queries, transformer.search)
+    dense_time = 'skipped'
+    if dense_mb <= max_dense_mb:
+        old_results, old_time = time_func(
+            run_queries, tfidf_dense_search, transformer, matrix.to_dense())
+        for old, new in zip(old_results, new_results):
+            assert np.allclose([x[1] for x in old], [x[1] for x in new])
+        dense_time = '{:.2f}ms'.format(old_time * 1000 / num_queries)
+    print('{:<20} docs: {} terms: {} train: {:.2f}s dense: {:.0f}MB '
+          'sparse: {:.0f}MB dense query: {} sparse query: {:.2f}ms'.format(
+              'tfidf', num_docs, matrix.shape[1], train_time, dense_mb,
+              matrix.nbytes / 1e6, dense_time,
+              new_time * 1000 / num_queries))
+
+
+def bm25_search_per_doc(transformer, text, top_k=1, k1=1.5, b=0.75):
+    """
+    The bm25_search used before the postings, scanning every doc's freq
+    dict.
+
+    :param transformer: Trained TfIdfTransformer
+    :param text: Text to search matrix for
+    :param top_k: Number of results to return
+    :param k1: Term frequency saturation
+    :param b: Doc length normalization
+    :return: List of the similar documents
+    """
+    q_tokens = transformer.ali_chat.get_unigrams_and_bigrams(text)
+    query_freqs = {}
+    for qt in q_tokens:
+        query_freqs[qt] = query_freqs.get(qt, 0) + 1
+    scores = []
+    for doc_idx, freq_dict in enumerate(transformer.doc_freqs):
+        score = 0.0
+        doc_len = transformer.doc_lengths[doc_idx]
+        for term, q_count in query_freqs.items():
+            if term not in freq_dict:
+                continue
+            tf = freq_dict[term]
+            idf_val = transformer.bm25_idf.get(term, 0.0)
+            numerator = tf * (k1 + 1.0)
+            denominator = tf + k1 * (1.0 - b + b * (
+                doc_len / transformer.avg_dl))
+            score += idf_val * (numerator / denominator)
+        scores.append((doc_idx, score))
+    scores.sort(key=lambda x: x[1], reverse=True)
+    return scores[:top_k]
+
+
+def benchmark_bm25(num_docs=50000, num_queries=100, num_models=5):
+    """
+    Compares the per doc bm25 scan and full sort to the postings scores
+    with a top k per model, as AliSearch runs them for each chat model.
+
+    :param num_docs: Docs in the corpus
+    :param num_queries: Queries to search
+    :param num_models: Models the docs are split across
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    texts = make_tfidf_corpus(num_docs, rng)
+    queries = [texts[x] for x in rng.integers(0, num_docs, num_queries)]
+    transformer = az.TfIdfTransformer(texts=texts, ali_chat=SplitTokenizer())
+    models = ['Model{}'.format(x) for x in range(num_models)]
+    transformer_dict = {str(x): {'model': models[x % num_models], 'id': x}
+                        for x in range(num_docs)}
+
+    def run_old():
+        results = []
+        for text in queries:
+            full = bm25_search_per_doc(transformer, text, top_k=num_docs)
+            grouped = {}
+            for doc_idx, score in full:
+                if score > 0:
+                    model_name = transformer_dict[str(doc_idx)]['model']
+                    grouped.setdefault(model_name, []).append(
+                        (doc_idx, score))
+            results.append([grouped.get(x, [])[:10] for x in models])
+        return results
+
+    def run_new():
+        results = []
+        for text in queries:
+            ali_search = az.AliSearch(transformer.ali_chat, transformer,
+                                      transformer_dict)
+            results.append([ali_search._scores_by_model(text, x, 10)['bm25']
+                            for x in models])
+            transformer.ali_chat.transformer_score_cache = None
+        return results
+    old_results, old_time = time_func(run_old)
+    new_results, new_time = time_func(run_new)
+    for old, new in zip(old_results, new_results):
+        for old_model, new_model in zip(old, new):
+            assert np.allclose([x[1] for x in old_model],
+                               [x[1] for x in new_model])
+    print('{:<20} docs: {} models: {} doc scan: {:.2f}ms '
+          'postings: {:.2f}ms'.format(
+              'bm25', num_docs, num_models, old_time * 1000 / num_queries,
+              new_time * 1000 / num_queries))
+
+
+def benchmark_tfidf_update(num_docs=50000, num_updates=100):
+    """
+    Compares retraining a TfIdfTransformer for a changed doc to applying
+    num_updates update_doc calls followed by one compact.
+
+    :param num_docs: Docs in the corpus
+    :param num_updates: Docs changed
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    texts = make_tfidf_corpus(num_docs + num_updates, rng)
+    keys = [('Doc', x) for x in range(num_docs)]
+    transformer = az.TfIdfTransformer(ali_chat=SplitTokenizer())
+    _, train_time = time_func(transformer.train, texts[:num_docs], keys)
+
+    def run_updates():
+        for idx in range(num_updates):
+            transformer.update_doc(keys[idx], texts[num_docs + idx])
+    _, update_time = time_func(run_updates)
+    _, compact_time = time_func(transformer.compact)
+    print('{:<20} docs: {} retrain: {:.2f}s update: {:.2f}ms '
+          'compact: {:.2f}s'.format(
+              'tfidf update', num_docs, train_time,
+              update_time * 1000 / num_updates, compact_time))
+
+
+class WordIndexQuery(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def count(self):
+        return len(self.rows)
+
+    def all(self):
+        return self.rows
+
+
+def benchmark_word_index(num_objects=200000, num_lookups=1000,
+                         num_updates=100):
+    """
+    Compares building a model's word index, what every worker paid on its
+    first lookup, to mapping the shared index another worker saved, and
+    times warm lookups that only read the meta file and single object
+    updates that only save a delta.
+
+    :param num_objects: Rows of the model
+    :param num_lookups: Warm lookups to time
+    :param num_updates: Object updates to time
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    names = make_tfidf_corpus(num_objects, rng)
+    model = type('BenchmarkWidget', (object,), {'query': WordIndexQuery(
+        [az.FakeDbModel(x, idx) for idx, x in enumerate(names)])})
+    ali_chat = az.AliChat()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        az.AliChat.word_index_cache = fc.WordIndexCache(tmp_dir)
+        az.AliChat._WORD_INDEX_CACHE = {}
+        try:
+            _, build_time = time_func(ali_chat.index_db_model_by_word, model)
+            az.AliChat._WORD_INDEX_CACHE = {}
+            _, load_time = time_func(ali_chat.index_db_model_by_word, model)
+
+            def run_lookups():
+                for _ in range(num_lookups):
+                    ali_chat.index_db_model_by_word(model)
+            _, lookup_time = time_func(run_lookups)
+
+            def run_updates():
+                for idx in range(num_updates):
+                    ali_chat.index_object(model, az.FakeDbModel(
+                        names[-idx - 1], idx))
+            _, update_time = time_func(run_updates)
+        finally:
+            az.AliChat.word_index_cache = fc.WordIndexCache()
+            az.AliChat._WORD_INDEX_CACHE = {}
+    print('{:<20} objects: {} build: {:.2f}s shared load: {:.2f}ms '
+          'lookup: {:.3f}ms update: {:.2f}ms'.format(
+              'word index', num_objects, build_time, load_time * 1000,
+              lookup_time * 1000 / num_lookups,
+              update_time * 1000 / num_updates))
+
+
+def main(num_rows=5000000):
+    benchmark_date_column(num_rows)
+    benchmark_float_column(num_rows)
+    benchmark_raw_file_cache(num_rows)
+    benchmark_output_file(num_rows)
+    benchmark_dict_index(num_rows)
+    benchmark_categorical(num_rows)
+    benchmark_merge_sources(num_rows)
+    benchmark_date_split(num_rows)
+    benchmark_vm_rules(num_rows)
+    benchmark_net_cost_final(num_rows)
+    benchmark_tfidf()
+    benchmark_bm25()
+    benchmark_tfidf_update()
+    benchmark_word_index()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
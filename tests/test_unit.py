@@ -1,6 +1,14 @@
 import os
+import io
+import re
 import sys
+import csv
+import copy
+import gzip
 import json
+import time
+import shutil
+import threading
 import yaml
 import types
 import string
@@ -11,9 +19,10 @@ import pandas as pd
 import datetime as dt
 import urllib3.exceptions as url_ex
 from selenium.webdriver.common.by import By
-from processor.main import main
+from processor.main import main, get_args
 import processor.reporting.utils as utl
 import processor.reporting.vendormatrix as vm
+import processor.reporting.filecache as fc
 import processor.reporting.vmcolumns as vmc
 import processor.reporting.dictionary as dct
 import processor.reporting.dictcolumns as dctc
@@ -221,6 +230,33 @@ class TestUtils:
         df = utl.apply_rules(df, vm_rules, utl.POST, **kwargs)
         assert pd.testing.assert_frame_equal(df, ndf) is None
 
+    def test_rule_engine_set_column(self):
+        rules = [('POST::{}::{}'.format(vmc.cost, vmc.clicks),
+                  '{}::a'.format(dctc.VEN), 2),
+                 ('POST::{}::{}'.format(vmc.cost, vmc.clicks),
+                  '{}::2024-01-02,2024-01-03'.format(vmc.date), 3),
+                 ('PRE::{}'.format(vmc.cost), '{}::b'.format(dctc.VEN), 0)]
+        vm_rules = {}
+        kwargs = {}
+        for idx, rule in enumerate(rules):
+            vm_rules[idx] = {}
+            for col, value in zip(utl.RULE_CONST, rule):
+                rule_name = 'RULE_{}_{}'.format(idx, col)
+                vm_rules[idx][col] = rule_name
+                kwargs[rule_name] = value
+        df = pd.DataFrame({
+            vmc.date: pd.date_range('2024-01-01', periods=4),
+            dctc.VEN: ['a', 'b', 'a', 'b'], vmc.cost: [1., 2., 3., 4.]})
+        engine = utl.RuleEngine.get(vm_rules, **kwargs)
+        assert utl.RuleEngine.get(vm_rules, **kwargs) is engine
+        utl.RuleEngine.reset(report=True)
+        df = utl.apply_rules(df, vm_rules, utl.POST, **kwargs)
+        assert df[vmc.clicks].tolist() == [2., 6., 18., 0.]
+        assert df[vmc.cost].tolist() == [1., 2., 3., 4.]
+        assert utl.RuleEngine.reset() == {
+            '0 POST': [1, 2, pytest.approx(0, abs=1)],
+            '1 POST': [1, 2, pytest.approx(0, abs=1)]}
+
     def test_data_to_type(self):
         str_col = 'str_col'
         float_col = 'float_col'
@@ -251,6 +287,100 @@ class TestUtils:
         for col in [str_col, float_col, date_col, int_col]:
             assert pd.testing.assert_series_equal(df[col], ndf[col]) is None
 
+    def test_data_to_type_float(self):
+        values = ['$1,000.50', '1,234', '-$5', 'abc', None, 5, 2.5, '',
+                  np.nan, '1e3', True]
+        df = pd.DataFrame({'a': values, 'b': [float(x) for x in range(
+            len(values))], 'c': range(len(values))})
+        df.loc[1, 'b'] = np.nan
+        expected = [1000.5, 1234.0, -5.0, np.nan, 0.0, 5.0, 2.5, np.nan, 0.0,
+                    1000.0, np.nan]
+        ndf = utl.data_to_type(df.copy(), float_col=['a', 'b', 'c'])
+        assert ndf['a'].tolist() == pytest.approx(expected, nan_ok=True)
+        assert ndf['b'].tolist() == df['b'].fillna(0).tolist()
+        assert ndf['c'].tolist() == [float(x) for x in df['c']]
+        assert (ndf.dtypes == np.float64).all()
+
+    def test_data_to_type_skips_typed_columns(self):
+        df = pd.DataFrame({'a': ['$1', None, '3'], 'b': [1, 2, 3],
+                           'c': ['1/1/2022', None, '2022-01-03 10:00:00']})
+        kwargs = {'float_col': ['a'], 'date_col': ['c'], 'int_col': ['b']}
+        utl.TypeCounter.reset()
+        utl.TodayTracker.reset()
+        df = utl.data_to_type(df, **kwargs)
+        assert utl.TodayTracker.reset()
+        assert utl.TypeCounter.reset() == {
+            ('float', 'converted'): 1, ('date', 'converted'): 1,
+            ('int', 'skipped'): 1}
+        ndf = utl.data_to_type(df.copy(), **kwargs)
+        assert pd.testing.assert_frame_equal(df, ndf) is None
+        assert not utl.TodayTracker.reset()
+        counts = utl.TypeCounter.reset()
+        assert counts == {('float', 'skipped'): 1, ('date', 'skipped'): 1,
+                          ('int', 'skipped'): 1}
+        utl.TypeCounter.merge(counts)
+        msg = utl.TypeCounter.log('Test')
+        assert 'skipped: date 1, float 1, int 1.' in msg
+        assert 'converted: none.' in msg
+
+    @staticmethod
+    def get_date_values():
+        str_list = [
+            '1/1/22', '13/1/22', '1/1/2022', '13/1/2022', '32/13/2022',
+            '/1/2022', '1//2022', '44562', '44562.5', '20220101', '20221301',
+            '01.01.22', '0', '0.0', '2022-01-01 00:00 + UTC',
+            '1/01/2022 00:00', 'PST Sun Jan 01 00:00:00 2022', '2022-01-01',
+            '2022-13-01', '2022-13-13', '2022-01-01 12:30:00',
+            '2022-01-01 25:00:00', '01012022', '1-Jan',
+            'Sat 01Jan2022 00:00 +GMT', '2022-01-01 - 2022-01-31', '2022-01',
+            'Total',
+            '1/0/1900', '1/1/1970', None, np.nan]
+        return str_list
+
+    @pytest.mark.parametrize('fill_empty', [True, False])
+    @pytest.mark.parametrize('kind', ['str', 'datetime', 'float', 'mixed'])
+    def test_column_to_date_matches_string_to_date(self, kind, fill_empty):
+        if kind == 'str':
+            values = self.get_date_values()
+        elif kind == 'datetime':
+            values = [pd.Timestamp(2022, 1, 1), pd.Timestamp(2022, 1, 2, 3),
+                      pd.NaT]
+        elif kind == 'float':
+            values = [44562.0, 44563.5, np.nan, 0.0]
+        else:
+            values = [1, 1.0, True, 44562, 44562.0, '44562', '2022-01-01',
+                      dt.date(2022, 1, 1), pd.Timestamp('2022-01-01'), None]
+        values = list(values) * 3
+        ser = pd.Series(values, index=range(10, 10 + len(values)))
+        ser = ser.sample(frac=1, random_state=0)
+        expected = ser.replace(['1/0/1900', '1/1/1970'], '0')
+        if fill_empty:
+            expected = expected.astype('object').where(
+                expected.notna(), dt.date.today())
+        else:
+            expected = expected.fillna(pd.Timestamp('nat'))
+        expected = expected.astype('U').apply(utl.string_to_date)
+        expected = pd.to_datetime(expected, errors='coerce').dt.normalize()
+        dates = utl.column_to_date(ser, fill_empty)
+        assert pd.testing.assert_series_equal(expected, dates) is None
+
+    def test_strings_to_dates_fast_path(self):
+        values = np.array(['2022-01-31', '2022-31-01', '2022-02-30',
+                           '20220101', '2022-01-01 12:30:00', '2022-1-1'],
+                          dtype=object)
+        expected = [utl.string_to_date(x) for x in values]
+        dates = utl.strings_to_dates(values)
+        assert pd.isna(dates[2])
+        for date, expected_date in zip(dates, expected):
+            assert date is pd.NaT or date == expected_date
+
+    def test_top_k_indices(self):
+        scores = np.random.default_rng(0).integers(0, 5, 50).astype(float)
+        for top_k in [0, 1, 7, 20, 50, 60]:
+            expected = np.argsort(-scores, kind='stable')[:top_k]
+            assert utl.top_k_indices(scores, top_k).tolist() == (
+                expected.tolist())
+
     def test_selenium_wrapper(self):
         sw = utl.SeleniumWrapper()
         test_url = 'https://www.google.com/'
@@ -459,6 +589,25 @@ class TestUtils:
         tdf = utl.col_removal(df, key='None', removal_cols=['ALL'])
         assert vmc.date in tdf.columns
 
+    def test_write_journal(self, tmp_path):
+        file_name = str(tmp_path / 'dict.csv')
+        df = pd.DataFrame({'a': ['1', None], 'b': [1.5, 2]})
+        with utl.WriteJournal():
+            utl.WriteJournal.write(df, file_name)
+            df['a'] = 'x'
+            utl.WriteJournal.write(df, file_name)
+            assert not os.path.isfile(file_name)
+            journal_df = utl.WriteJournal.read(file_name)
+            assert utl.WriteJournal.avoided == 1
+            utl.WriteJournal.remove(file_name)
+            with pytest.raises(OSError):
+                utl.WriteJournal.remove(file_name)
+            assert utl.WriteJournal.read(file_name) is None
+            utl.WriteJournal.write(df, file_name)
+        assert utl.import_read_csv(file_name).equals(journal_df)
+        utl.WriteJournal.remove(file_name)
+        assert not os.path.isfile(file_name)
+
 
 @requires_api_configs
 class TestApis:
@@ -861,7 +1010,401 @@ class TestSimApi:
                                       'desktop_visits']
 
 
+def _make_processor_dir(path, num_sources=4, num_rows=30):
+    """
+    Lays out a minimal processor (vendormatrix, raw files and configs) in
+    path.  The first two sources share a dictionary.
+    """
+    for dir_name in [utl.config_path, utl.raw_path, utl.dict_path,
+                     os.path.join(utl.dict_path, dctc.filepath_tran_config)]:
+        os.makedirs(os.path.join(path, dir_name), exist_ok=True)
+    rule_cols = ['RULE_1_FACTOR', 'RULE_1_METRIC', 'RULE_1_QUERY']
+    cols = [vmc.vendorkey] + vmc.vmkeys + rule_cols
+    rows = []
+    for idx in range(num_sources):
+        file_name = 'source{}.csv'.format(idx)
+        pd.DataFrame({
+            'ad_name': ['Camp{}_Ven{}_{}'.format(idx % 2, x % 3, x % 5)
+                        for x in range(num_rows)],
+            'day': pd.date_range('2024-01-01', periods=num_rows).strftime(
+                '%Y-%m-%d'),
+            'imps': [(x * 37 + idx) % 1000 for x in range(num_rows)],
+            'clk': [(x * 7 + idx) % 100 for x in range(num_rows)],
+            'spend': ['${:,.2f}'.format(x * 101.5) for x in range(num_rows)],
+        }).to_csv(os.path.join(path, utl.raw_path, file_name), index=False)
+        row = {x: '' for x in cols}
+        row.update({
+            vmc.vendorkey: 'API_Rawfile_Source{}'.format(idx),
+            vmc.filename: file_name, vmc.firstrow: 0, vmc.lastrow: 0,
+            vmc.fullplacename: 'ad_name', vmc.placement: 'ad_name',
+            vmc.filenamedict: 'dictionary_{}.csv'.format(max(idx, 1)),
+            vmc.filenameerror: 'error_{}.csv'.format(idx),
+            vmc.startdate: '1/1/2024', vmc.dropcol: 'ALL',
+            vmc.autodicplace: vmc.fullplacename,
+            vmc.autodicord: '|'.join([dctc.CAM, dctc.VEN, dctc.CRE]),
+            vmc.date: 'day', vmc.impressions: 'imps', vmc.clicks: 'clk',
+            vmc.cost: 'spend', 'RULE_1_FACTOR': 0.5,
+            'RULE_1_METRIC': 'POST::{}'.format(vmc.clicks),
+            'RULE_1_QUERY': '{}::Ven1'.format(dctc.VEN)})
+        rows.append(row)
+    row = {x: '' for x in cols}
+    row.update({
+        vmc.vendorkey: vm.plan_key, vmc.filename: 'plannet.csv',
+        vmc.firstrow: 0, vmc.lastrow: 0,
+        vmc.fullplacename: '|'.join([dctc.CAM, dctc.VEN]),
+        vmc.placement: dctc.VEN, vmc.filenamedict: dctc.PFN,
+        vmc.filenameerror: 'PLANNET_ERROR_REPORT.csv',
+        vmc.autodicord: '|'.join([dctc.CAM, dctc.VEN])})
+    rows.append(row)
+    pd.DataFrame(rows, columns=cols).to_csv(
+        os.path.join(path, vm.csv_full_file), index=False)
+    pd.DataFrame({'x': [1]}).to_csv(
+        os.path.join(path, utl.raw_path, 'plannet.csv'), index=False)
+    pd.DataFrame({dctc.DICT_COL_NAME: [dctc.AGY],
+                  dctc.DICT_COL_VALUE: ['Liquid'],
+                  dctc.DICT_COL_DICTNAME: [np.nan]}).to_csv(
+        os.path.join(path, utl.config_path, dctc.filename_con_config),
+        index=False)
+    pd.DataFrame({dctc.RK: ['Vendor'], dctc.FN: ['relational_vendor.csv'],
+                  dctc.KEY: [dctc.VEN], dctc.DEP: [dctc.VT],
+                  dctc.AUTO: [np.nan]}).to_csv(
+        os.path.join(path, utl.config_path, dctc.filename_rel_config),
+        index=False)
+    pd.DataFrame({dctc.DICT_COL_NAME: [dctc.VEN],
+                  dctc.DICT_COL_VALUE: ['Ven2'],
+                  dctc.DICT_COL_NVALUE: ['Vendor Two']}).to_csv(
+        os.path.join(path, utl.dict_path, dctc.filepath_tran_config,
+                     dctc.filename_tran_config), index=False)
+
+
+class _FakeApi(object):
+    """Record the vendor keys pulled and the most pulled at once."""
+    active = 0
+    max_active = 0
+    configs = []
+
+    def __init__(self):
+        self.config = None
+
+    def input_config(self, config):
+        self.config = config
+
+    def get_data(self, sd=None, ed=None, fields=None):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            cls.configs.append(self.config)
+        time.sleep(.05)
+        with cls.lock:
+            cls.active -= 1
+        return pd.DataFrame({'config': [self.config]})
+
+
+class _FakeMatrix(object):
+    def __init__(self, vks):
+        self.vks = vks
+
+    def vendor_set(self, vk):
+        return {vmc.apifile: vk, vmc.startdate: pd.Timestamp('2024-01-01'),
+                vmc.enddate: pd.Timestamp('2024-01-31'),
+                vmc.apifields: ['nan'], vmc.apimerge: 'nan',
+                vmc.filename: vk, vmc.firstrow: 0, vmc.lastrow: 0,
+                vmc.date: 'Date'}
+
+
+class TestImportHandler:
+    @pytest.mark.parametrize('workers, limit', [(1, 1), (4, 1), (4, 2)])
+    def test_api_loop_concurrent(self, workers, limit):
+        apis = {}
+        for key in [vmc.api_fb_key, vmc.api_tw_key]:
+            apis[key] = type('Fake' + key, (_FakeApi,), {
+                'lock': threading.Lock(), 'configs': []})
+        vks = {key: ['{}_{}'.format(key, x) for x in range(4)]
+               for key in apis}
+        handler = ih.ImportHandler(['fb', 'tw'], _FakeMatrix(vks),
+                                   workers=workers, api_limits={'fb': limit})
+        handler.class_list = apis
+        outputs = []
+        handler.output = lambda df, filename, *args: outputs.append(
+            (filename, df['config'][0]))
+        handler.api_loop()
+        assert sorted(outputs) == [(x, x) for x in sorted(sum(
+            vks.values(), []))]
+        assert apis[vmc.api_fb_key].max_active == limit
+        assert apis[vmc.api_tw_key].max_active == 1
+        assert apis[vmc.api_tw_key].configs == vks[vmc.api_tw_key]
+
+
 class TestVendormatrix:
+    @pytest.fixture
+    def processor_dir(self, tmp_path, monkeypatch):
+        _make_processor_dir(str(tmp_path))
+        monkeypatch.chdir(tmp_path)
+        return tmp_path
+
+    def test_vm_loop_workers_matches_serial(self, processor_dir):
+        output = {}
+        for workers in [1, 3]:
+            matrix = vm.VendorMatrix()
+            file_name = 'output_{}.csv'.format(workers)
+            matrix.vm_loop_with_costs(file_name, workers=workers)
+            with open(file_name, 'rb') as f:
+                output[workers] = f.read()
+        assert len(output[1].splitlines()) == 121
+        assert output[1] == output[3]
+
+    def test_vm_rules_compiles_engines(self, processor_dir, monkeypatch):
+        engines = {}
+        monkeypatch.setattr(vm.utl.RuleEngine, 'engines', engines)
+        matrix = vm.VendorMatrix()
+        assert matrix.vm_rules_dict
+        for vk in matrix.vm_df[vmc.vendorkey]:
+            key = vm.utl.RuleEngine.get_key(matrix.vm_rules_dict,
+                                            **matrix.vendor_set(vk))
+            assert key in engines
+
+    def test_vm_loop_categorical(self, processor_dir):
+        output = {}
+        for categorical in [False, True]:
+            file_name = 'output_{}.csv'.format(categorical)
+            df = vm.VendorMatrix().vm_loop_with_costs(
+                file_name, categorical=categorical)
+            with open(file_name, 'rb') as f:
+                output[categorical] = f.read()
+        assert isinstance(df[dctc.VEN].dtype, pd.CategoricalDtype)
+        assert output[False] == output[True]
+
+    @pytest.mark.parametrize('spill', [False, True])
+    def test_frame_collector_categorical(self, spill):
+        frames = [
+            pd.DataFrame({dctc.VEN: ['b', 'a', 'b', None], 'a': [1] * 4}),
+            pd.DataFrame({'a': [2, 3]}),
+            pd.DataFrame({dctc.VEN: ['c', 'c', 'a', 'a'],
+                          dctc.BR: ['1', '1', '2', '2']}),
+        ]
+        df = pd.DataFrame(columns=[vmc.date, dctc.FPN])
+        collector = vm.FrameCollector(spill=spill, categorical=True)
+        expected = vm.FrameCollector(spill=spill)
+        for tdf in frames:
+            collector.add(tdf.copy())
+            expected.add(tdf.copy())
+        result = collector.concat(df)
+        expected = expected.concat(df)
+        assert result[dctc.VEN].cat.categories.tolist() == ['a', 'b', 'c']
+        assert result[dctc.BR].dtype == object
+        pd.testing.assert_frame_equal(utl.decategorize(result), expected)
+
+    @pytest.mark.parametrize('spill', [False, True])
+    def test_frame_collector_matches_incremental_concat(self, spill):
+        frames = [
+            pd.DataFrame({'a': [1, 2], 'b': [1.5, np.nan], 'c': [np.nan] * 2}),
+            pd.DataFrame({'a': [True], 'd': pd.to_datetime(['2024-01-01'])}),
+            pd.DataFrame(columns=['a', 'e']),
+            pd.DataFrame({'b': [np.nan, np.nan]}),
+            pd.DataFrame({'a': [0.5], 'e': ['x'], 'd': [None]}),
+        ]
+        df = pd.DataFrame(columns=[vmc.date, dctc.FPN])
+        expected = df
+        for tdf in frames:
+            expected = pd.concat([expected.dropna(axis=1, how='all'),
+                                  tdf.dropna(axis=1, how='all')],
+                                 ignore_index=True)
+        collector = vm.FrameCollector(spill=spill)
+        for tdf in frames:
+            collector.add(tdf)
+        result = collector.concat(df)
+        pd.testing.assert_frame_equal(result, expected)
+        assert collector.spill_path is None
+
+    def test_vm_loop_raw_cache(self, processor_dir, monkeypatch):
+        raw_cache = fc.RawFileCache()
+        for _ in range(2):
+            expected = vm.VendorMatrix().vm_loop()
+        for _ in range(2):
+            df = vm.VendorMatrix().vm_loop(raw_cache=raw_cache)
+            assert pd.testing.assert_frame_equal(expected, df) is None
+
+            def read_raw_df(*args, **kwargs):
+                raise AssertionError('Raw file read with a warm cache.')
+            monkeypatch.setattr(vm.DataSource, 'read_raw_df', read_raw_df)
+        assert len(os.listdir(raw_cache.path)) == 8
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_vm_loop_source_cache(self, processor_dir, workers):
+        source_cache = fc.SourceCache(explain=True)
+        for _ in range(2):
+            vm.VendorMatrix().vm_loop(source_cache=source_cache)
+        matrix = vm.VendorMatrix()
+        matrix.sort_vendor_list()
+        vendor_keys = [x for x in matrix.vl if x != vm.plan_key]
+        matrix.source_cache = source_cache
+        assert matrix.get_stale_vendor_keys(vendor_keys) == {}
+        raw_file = os.path.join(utl.raw_path, 'source3.csv')
+        raw_df = pd.read_csv(raw_file)
+        raw_df['imps'] = raw_df['imps'] + 1
+        raw_df.to_csv(raw_file, index=False)
+        assert matrix.get_stale_vendor_keys(vendor_keys) == {
+            'API_Rawfile_Source3': ['raw file']}
+        df = vm.VendorMatrix().vm_loop(workers=workers,
+                                       source_cache=source_cache)
+        expected = vm.VendorMatrix().vm_loop()
+        assert pd.testing.assert_frame_equal(expected, df) is None
+        shutil.rmtree(source_cache.path)
+        stale = matrix.get_stale_vendor_keys(vendor_keys)
+        assert all(stale[x] == ['new'] for x in vendor_keys)
+
+    def test_merge_source_cache(self, processor_dir, monkeypatch):
+        keys = ['Camp{}_Ven{}_{}'.format(x % 2, x % 3, x % 5)
+                for x in range(30)]
+        pd.DataFrame({'key': keys, 'label': ['L' + x for x in keys]}).to_csv(
+            'lookup.csv', index=False)
+        vm_df = pd.read_csv(vm.csv_full_file)
+        vm_df[vmc.transform] = vm_df[vmc.transform].astype(object)
+        is_source = vm_df[vmc.vendorkey] != vm.plan_key
+        vm_df.loc[is_source, vmc.transform] = (
+            'Merge::lookup.csv::ad_name::key:::'
+            'MergeReplace::API_Rawfile_Source0::imps::imps|clk')
+        vm_df.to_csv(vm.csv_full_file, index=False)
+        read_source = vm.MergeSourceCache.read_source
+        with monkeypatch.context() as m:
+            m.setattr(vm.MergeSourceCache, 'start',
+                      classmethod(lambda cls, path=None: None))
+            for _ in range(2):
+                expected = vm.VendorMatrix().vm_loop()
+        reads = []
+
+        def count_reads(merge_file, matrix=None):
+            reads.append(merge_file)
+            return read_source(merge_file, matrix)
+        monkeypatch.setattr(vm.MergeSourceCache, 'read_source',
+                            staticmethod(count_reads))
+        df = vm.VendorMatrix().vm_loop()
+        assert sorted(reads) == ['API_Rawfile_Source0', 'lookup.csv']
+        assert pd.testing.assert_frame_equal(expected, df) is None
+        assert vm.MergeSourceCache.path is None
+        vm.df_single_transform(pd.DataFrame({'ad_name': keys}),
+                               'Merge::lookup.csv::ad_name::key')
+        assert len(reads) == 3
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_merge_source_cache_stopped_on_error(self, processor_dir,
+                                                 monkeypatch, workers):
+        paths = []
+        start = vm.MergeSourceCache.start
+
+        def record_start(path=None):
+            paths.append(start(path))
+            return paths[-1]
+
+        def fail_import(self, *args, **kwargs):
+            raise ValueError('bad source')
+        monkeypatch.setattr(vm.MergeSourceCache, 'start',
+                            staticmethod(record_start))
+        monkeypatch.setattr(vm.DataSource, 'import_and_cache_data',
+                            fail_import)
+        monkeypatch.setattr(vm.VendorMatrix, 'vendor_get',
+                            lambda self, vk: fail_import(self))
+        with pytest.raises(ValueError):
+            vm.VendorMatrix().vm_loop(workers=workers)
+        assert paths and not os.path.exists(paths[0])
+        assert not vm.MergeSourceCache.active
+        assert vm.MergeSourceCache.path is None
+
+    def test_source_cache_fingerprint(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        source_cache = fc.SourceCache()
+        params = {vmc.filename: 'raw.csv', vmc.filenamedict: 'dict.csv',
+                  vmc.transform: 'Merge::merge.csv::a::b:::Pivot::c::d'}
+        assert source_cache.get_merge_sources(params[vmc.transform]) == [
+            'merge.csv']
+        df = pd.DataFrame({'a': [1]})
+        fingerprint = source_cache.get_fingerprint(params, {})
+        source_cache.save('vk', df, fingerprint, date_sensitive=True)
+        reasons = source_cache.get_stale_reasons('vk', params, {})
+        assert reasons == []
+        pd.DataFrame({'b': [1]}).to_csv('merge.csv', index=False)
+        new_params = dict(params, **{vmc.filenamedict: 'other.csv'})
+        reasons = source_cache.get_stale_reasons('vk', new_params, {'1': 2})
+        assert reasons == ['dictionary', 'merge sources', 'rules',
+                           'vendor matrix row']
+        ndf = source_cache.load('vk')
+        assert pd.testing.assert_frame_equal(df, ndf) is None
+        monkeypatch.setattr(fc.dt, 'date', type(
+            'date', (dt.date,), {'today': classmethod(
+                lambda cls: dt.date(2000, 1, 1))}))
+        assert source_cache.get_stale_reasons('vk', params, {}) == [
+            'date', 'merge sources']
+
+    def test_raw_file_cache(self, tmp_path):
+        raw_cache = fc.RawFileCache(path=str(tmp_path / 'cache'))
+        file_name = str(tmp_path / 'raw.csv')
+        df = pd.DataFrame({'a': [1, 2], 'b': ['x', None]})
+        df.to_csv(file_name, index=False)
+        reads = []
+
+        def read_func():
+            reads.append(file_name)
+            return pd.read_csv(file_name)
+        for params in [[0, 0], [0, 0], [1, 0]]:
+            ndf = raw_cache.load(file_name, params, read_func)
+            assert pd.testing.assert_frame_equal(df, ndf) is None
+        assert len(reads) == 2
+        key = raw_cache.get_key(file_name, [0, 0])
+        pd.DataFrame({'a': [3]}).to_csv(file_name, index=False)
+        assert raw_cache.get_key(file_name, [0, 0]) != key
+        mixed_df = pd.DataFrame({'a': [1, 'x']})
+        raw_cache.load(file_name, [2, 0], lambda: mixed_df)
+        skip_files = [x for x in os.listdir(raw_cache.path)
+                      if x.endswith(raw_cache.skip_suffix)]
+        assert len(skip_files) == 1
+        raw_cache.max_size = 0
+        assert raw_cache.evict() == 2
+        raw_cache.max_age = -1
+        assert raw_cache.evict() == 2
+        assert not os.listdir(raw_cache.path)
+
+    @pytest.mark.parametrize('compression', [None, 'gzip'])
+    def test_write_output_data(self, tmp_path, compression):
+        file_name = str(tmp_path / vmc.output_file)
+        df = pd.DataFrame({
+            vmc.date: pd.date_range('2024-01-01', periods=5),
+            vmc.vendorkey: ['a', None, 'b', 'c', 'd'],
+            vmc.impressions: [1.5, 2, 3, 4, 5]})
+        vm.VendorMatrix.write_output_data(df, file_name, compression,
+                                          sidecar=True)
+        csv_file = file_name + utl.output_compression.get(compression, '')
+        assert utl.read_output_file(file_name).equals(df)
+        utl.write_output_file(df, file_name, chunk_size=2,
+                              compression=compression)
+        assert not os.path.isfile(utl.get_sidecar_name(file_name))
+        open_func = gzip.open if compression else open
+        with open_func(csv_file, 'rt', encoding='utf-8', newline='') as f:
+            assert f.read() == df.to_csv(index=False)
+        ndf = utl.read_output_file(file_name)
+        assert ndf.equals(utl.import_read_csv(csv_file))
+
+    def test_write_output_removes_other_compressions(self, tmp_path):
+        file_name = str(tmp_path / vmc.output_file)
+        df = pd.DataFrame({vmc.vendorkey: ['a', 'b'], vmc.impressions: [1, 2]})
+        for compression in [None, 'gzip', None]:
+            utl.write_output_file(df, file_name, compression=compression)
+            df[vmc.impressions] += 1
+        assert os.listdir(str(tmp_path)) == [vmc.output_file]
+        utl.write_output_file(df, file_name, compression='gzip')
+        assert os.listdir(str(tmp_path)) == [vmc.output_file + '.gz']
+        assert utl.read_output_file(file_name).equals(df)
+
+    def test_group_vendor_keys(self, processor_dir):
+        matrix = vm.VendorMatrix()
+        vendor_keys = [x for x in matrix.vl if x != vm.plan_key]
+        groups = matrix.group_vendor_keys(vendor_keys)
+        assert sorted(len(x) for x in groups) == [1, 1, 2]
+        shared = [x for x in groups if len(x) == 2][0]
+        assert shared == [x for x in vendor_keys
+                          if x in ['API_Rawfile_Source0',
+                                   'API_Rawfile_Source1']]
+
     def test_ad_cost_calculation(self):
         clicks = 10
         imps = 100
@@ -900,6 +1443,24 @@ class TestVendormatrix:
         assert out['Download - Other Item Count'].tolist() == [9, 9]
         assert 'Download - Other Item Revenue' not in out.columns
 
+    @pytest.mark.parametrize('chunk_size', [1, 4, 1000000])
+    def test_date_split_transform(self, chunk_size):
+        df = pd.DataFrame({
+            'Campaign': ['row_a', 'row_b', 'row_c'],
+            'Start': ['1/30/2024', '2024-02-27', '3/1/2024'],
+            'End': ['2/2/2024', '2024-03-01', '2/29/2024'],
+            'Impressions': [100, 40, 7], 'Rate': [2, 3, 4]}, index=[5, 1, 3])
+        out = vm.date_split(df, 'Start', 'End', ['Rate'],
+                            chunk_size=chunk_size)
+        assert out['Campaign'].tolist() == ['row_a'] * 4 + ['row_b'] * 4
+        assert out['Start'].dt.strftime('%m%d').tolist() == [
+            '0130', '0131', '0201', '0202', '0227', '0228', '0229', '0301']
+        assert out['Impressions'].tolist() == [25.0] * 4 + [10.0] * 4
+        assert out['Rate'].tolist() == [2] * 4 + [3] * 4
+        assert out.index.equals(pd.RangeIndex(8))
+        transform = 'DateSplit::Start::End::Rate'
+        assert vm.df_transform(df, transform).equals(out)
+
     @requires_base_config
     def test_vm_load(self):
         matrix = vm.VendorMatrix()
@@ -1155,6 +1716,38 @@ class TestDictionary:
         assert df[col][1] != new_value
         assert df[col][2] != new_value
 
+    @pytest.mark.parametrize('keys', [
+        ['a', 'b', 'a'], ['a', 'z', 'z'], [], ['a', None]])
+    def test_merge_index(self, keys):
+        dic = dct.Dict()
+        dic.data_dict = pd.DataFrame({
+            dctc.FPN: ['a', 'b', 'c'], dctc.CAM: ['x', None, 'y'],
+            dctc.BUD: [1, 2, 3], dctc.SD: pd.to_datetime(
+                ['2024-01-01', None, '2024-01-03'])})
+        df = pd.DataFrame({dctc.FPN: pd.Series(keys, dtype=object),
+                           'Impressions': range(len(keys))},
+                          index=range(5, 5 + len(keys)))
+        ndf = dic.merge(df, dctc.FPN)
+        assert ndf.equals(df.merge(dic.data_dict, on=dctc.FPN, how='left'))
+        df[dctc.CAM] = 'overlap'
+        ndf = dic.merge(df, dctc.FPN)
+        assert ndf.equals(df.merge(dic.data_dict, on=dctc.FPN, how='left'))
+
+    def test_config_registry(self, tmp_path):
+        dct.ConfigRegistry.reset()
+        file_name = 'config.csv'
+        pd.DataFrame({'a': [1, 2]}).to_csv(tmp_path / file_name, index=False)
+        df = dct.ConfigRegistry.read(file_name, str(tmp_path))
+        df['a'] = 0
+        df = dct.ConfigRegistry.read(file_name, str(tmp_path))
+        assert df['a'].tolist() == [1, 2]
+        assert (dct.ConfigRegistry.parsed, dct.ConfigRegistry.reused) == (1, 1)
+        pd.DataFrame({'a': [3]}).to_csv(tmp_path / file_name, index=False)
+        df = dct.ConfigRegistry.read(file_name, str(tmp_path))
+        assert df['a'].tolist() == [3]
+        assert dct.ConfigRegistry.parsed == 2
+        dct.ConfigRegistry.reset()
+
 
 class TestErrorReport:
     def test_error_report(self, tmp_path_factory):
@@ -1187,6 +1780,24 @@ class TestErrorReport:
         assert not err.data_err.empty
         assert len(err.data_err) == 1
 
+    @pytest.mark.parametrize('pn', [None, 'b', dctc.PN, dctc.FPN, 'c'])
+    def test_error_report_index(self, tmp_path_factory, monkeypatch, pn):
+        file_path = tmp_path_factory.mktemp(utl.error_path)
+        error_filename = '{}/ER_index.csv'.format(file_path)
+        dic = dct.Dict()
+        dic.data_dict = pd.DataFrame({
+            dctc.FPN: ['a_b', 'c  d', None, 'e'], dctc.PN: list('pqrs'),
+            'c': [1, 2, 3, 4]})
+        df = pd.DataFrame({dctc.FPN: ['a_b', 'x', 'c d', None, 'x', 'e '],
+                           'b': list('uvwxyz'), dctc.PN: list('UVWXYZ')},
+                          index=range(2, 8))
+        err = er.ErrorReport(df.copy(), dic, pn, error_filename)
+        assert err.get_index() is dic.index
+        monkeypatch.setattr(er.ErrorReport, 'get_index', lambda x: None)
+        merge_err = er.ErrorReport(df.copy(), dic, pn, error_filename)
+        assert err.get().equals(merge_err.get())
+        assert err.get().index.equals(merge_err.get().index)
+
 
 class TestCalc:
     def test_calculate_cost(self):
@@ -1214,6 +1825,78 @@ class TestCalc:
         df = df[[x for x in edf.columns]]
         assert pd.testing.assert_frame_equal(df, edf) is None
 
+    @staticmethod
+    def get_buy_model_df(num_rows=2000):
+        rng = np.random.default_rng(0)
+        dates = pd.to_datetime(['2024-01-01', '2024-01-05', '2024-01-10',
+                                '2024-01-15', None])
+        models = np.array(cal.BUY_MODELS + ['Other'], dtype=object)
+        df = pd.DataFrame({dctc.BM: rng.choice(models, num_rows)})
+        for col in [vmc.date, dctc.PD, dctc.PD2, dctc.PD3, dctc.PD4]:
+            df[col] = rng.choice(dates, num_rows)
+        metrics = [dctc.BR, dctc.BR2, dctc.BR3, dctc.BR4, dctc.BR5,
+                   vmc.impressions, vmc.clicks, vmc.views, vmc.views100,
+                   vmc.landingpage, vmc.view_imps, vmc.cost, vmc.conv1,
+                   vmc.newuser, vmc.signup, vmc.engagements, cal.CLI_PD,
+                   cal.IMP_PD]
+        for col in metrics:
+            df[col] = rng.random(num_rows) * 100
+            df.loc[rng.random(num_rows) < .05, col] = np.nan
+        return df
+
+    @pytest.mark.parametrize('drop_cols', [[], [vmc.engagements]])
+    def test_net_cost_engine_matches_net_cost(self, drop_cols):
+        df = self.get_buy_model_df().drop(columns=drop_cols)
+        df = df[df[dctc.BM].isin(cal.BUY_MODELS)]
+        expected = pd.to_numeric(df.apply(cal.net_cost, axis=1))
+        result = cal.net_cost_engine(df)
+        pd.testing.assert_series_equal(result, expected.astype(float))
+
+    def test_net_cost_engine_rate_columns(self):
+        df = self.get_buy_model_df()
+        df[dctc.AM] = df[dctc.BM]
+        df[dctc.AR] = df[dctc.BR] * 2
+        df[vmc.AD_COST] = 1.0
+        kwargs = {'cost_col': vmc.AD_COST, 'bm_col': dctc.AM,
+                  'br_col': dctc.AR}
+        expected = pd.to_numeric(df.apply(cal.net_cost, axis=1, **kwargs))
+        result = cal.net_cost_engine(df, **kwargs)
+        pd.testing.assert_series_equal(result, expected.astype(float))
+
+    @pytest.mark.parametrize('n_cost', [vmc.cost, vmc.AD_COST])
+    def test_net_cost_final_matches_merge_chain(self, n_cost):
+        rng = np.random.default_rng(0)
+        num_rows = 2000
+        places = np.array(['p{}'.format(x) for x in range(20)] + [None],
+                          dtype=object)
+        df = pd.DataFrame({
+            dctc.PFPN: rng.choice(places, num_rows),
+            vmc.date: pd.Timestamp('2024-01-01') + pd.to_timedelta(
+                rng.integers(0, 30, num_rows), unit='D'),
+            vmc.cost: rng.random(num_rows) * 100,
+            vmc.AD_COST: rng.random(num_rows) * 100,
+            dctc.PNC: rng.choice([np.nan, 0, 5, 20, 50], num_rows),
+            dctc.UNC: rng.choice([True, False, np.nan], num_rows)})
+        df.loc[rng.random(num_rows) < .05, vmc.date] = pd.NaT
+        kwargs = {'p_col': dctc.PFPN, 'n_cost': n_cost}
+        expected = cal.net_plan_comp(df.copy(), **kwargs)
+        expected = cal.net_cum_sum(expected, **kwargs)
+        expected = cal.net_sum_date(expected, **kwargs)
+        expected = cal.net_cost_final(expected, **kwargs)
+        result = cal.net_cost_final_calculation(df.copy(), **kwargs)
+        assert (result[cal.NCF] != result[n_cost]).any()
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_add_buy_model(self, monkeypatch):
+        monkeypatch.setattr(cal, 'BUY_MODELS', cal.BUY_MODELS[:])
+        monkeypatch.setattr(cal, 'NET_COST_MODELS', cal.NET_COST_MODELS.copy())
+        cal.add_buy_model('CPI', [(None, cal.rate_times(vmc.download))])
+        df = pd.DataFrame({dctc.BM: ['CPI', cal.BM_CPC],
+                           dctc.BR: [2.0, 3.0], vmc.download: [5, 0],
+                           vmc.clicks: [0, 4], vmc.cost: [0.0, 0.0]})
+        df = cal.net_cost_calculation(df)
+        assert df[vmc.cost].tolist() == [10.0, 12.0]
+
     def test_prog_fees_calculation(self):
         prog_fee = .05
         net_cost = 100
@@ -1238,6 +1921,13 @@ class TestCalc:
         assert ndf[cal.CLI_PD][0] == (click_one / (click_one + click_two))
 
 
+class _SplitAliChat(object):
+    @staticmethod
+    def get_unigrams_and_bigrams(text):
+        words = text.lower().replace('?', '').split()
+        return words + [' '.join(x) for x in zip(words, words[1:])]
+
+
 class TestAnalyze:
     vm_df = None
     
@@ -1971,6 +2661,17 @@ class TestAnalyze:
         aly = az.Analyze(df=df, matrix=vm.VendorMatrix())
         aly.do_all_analysis()
 
+    def test_load_df_from_categorical_sidecar(self, tmp_path):
+        file_name = str(tmp_path / vmc.output_file)
+        df = pd.DataFrame({vmc.vendorkey: ['a', 'b', 'a'],
+                           vmc.impressions: [1.0, 2.0, 3.0]})
+        cat_df = df.astype({vmc.vendorkey: 'category'})
+        vm.VendorMatrix.write_output_data(cat_df, file_name, sidecar=True)
+        aly = az.Analyze(file_name=file_name)
+        assert aly.df[vmc.vendorkey].dtype == object
+        aly.df.loc[0, vmc.vendorkey] = 'c'
+        assert aly.df[vmc.vendorkey].tolist() == ['c', 'b', 'a']
+
     def test_train_tfidf(self):
         texts = ['The file type for raw files are csv',
                  'Add 40 to the topline',
@@ -1983,6 +2684,111 @@ class TestAnalyze:
         bm25_scores = transformer.bm25_search(user_text, top_k=top_k)
         assert bm25_scores
 
+    def test_tfidf_sparse_matches_dense(self):
+        import pickle
+        texts = ['The file type for raw files are csv',
+                 'Add 40 to the topline', 'Add raw file on the import tab',
+                 'raw raw file', 'nothing in common here']
+        user_text = 'Where do I add a raw file?'
+        transformer = az.TfIdfTransformer(texts=texts,
+                                          ali_chat=_SplitAliChat())
+        dense = transformer.tfidf_matrix.to_dense()
+        assert transformer.tfidf_matrix.nbytes < dense.nbytes * 2
+        query_vec = transformer.compute_vector(user_text)
+        sims = (dense @ query_vec) / (np.linalg.norm(dense, axis=1) *
+                                      np.linalg.norm(query_vec))
+        expected = sorted(enumerate(sims.tolist()), key=lambda x: x[1],
+                          reverse=True)
+        scores = transformer.search(user_text, top_k=len(texts))
+        assert [x[0] for x in scores] == [x[0] for x in expected]
+        assert np.allclose([x[1] for x in scores], [x[1] for x in expected])
+        state = dict(transformer.__dict__, tfidf_matrix=dense)
+        del state['doc_norms']
+        old = pickle.loads(pickle.dumps(transformer))
+        old.__setstate__(state)
+        assert isinstance(old.tfidf_matrix, az.TermDocMatrix)
+        assert old.search(user_text, top_k=len(texts)) == scores
+
+    def test_bm25_postings_matches_doc_scan(self):
+        texts = ['The file type for raw files are csv',
+                 'Add 40 to the topline', 'Add raw file on the import tab',
+                 'raw raw file', 'nothing in common here', 'add add add']
+        user_text = 'add raw file raw'
+        transformer = az.TfIdfTransformer(texts=texts,
+                                          ali_chat=_SplitAliChat())
+        q_tokens = set(_SplitAliChat.get_unigrams_and_bigrams(user_text))
+        expected = []
+        for doc_idx, freq_dict in enumerate(transformer.doc_freqs):
+            norm = 1.5 * (.25 + .75 * (transformer.doc_lengths[doc_idx] /
+                                       transformer.avg_dl))
+            expected.append(sum(
+                transformer.bm25_idf[x] * freq_dict[x] * 2.5 /
+                (freq_dict[x] + norm) for x in q_tokens if x in freq_dict))
+        scores = transformer.bm25_search(user_text, top_k=len(texts))
+        order = np.argsort(-np.array(expected), kind='stable')
+        assert [x[0] for x in scores] == order.tolist()
+        assert np.allclose([x[1] for x in scores],
+                           np.array(expected)[order])
+        bm25_idf = transformer.bm25_idf
+        for key in ['term_counts', 'bm25_idf_values', 'bm25_norms']:
+            del transformer.__dict__[key]
+        transformer.build_bm25_index(bm25_idf)
+        assert transformer.bm25_search(user_text, top_k=3) == scores[:3]
+
+    def test_tfidf_incremental_matches_retrain(self):
+        texts = ['The file type for raw files are csv',
+                 'Add 40 to the topline', 'Add raw file on the import tab',
+                 'raw raw file', 'nothing in common here']
+        keys = [('Doc', x) for x in range(len(texts))]
+        transformer = az.TfIdfTransformer(ali_chat=_SplitAliChat())
+        transformer.train(texts[:3], keys=keys[:3])
+        transformer.add_doc(texts[3], key=keys[3])
+        transformer.add_doc('placeholder text', key=keys[4])
+        transformer.update_doc(keys[4], texts[4])
+        transformer.delete_doc(keys[1])
+        assert transformer.delete_doc(keys[1]) is None
+        live = [0, 2, 3, 4]
+        retrained = az.TfIdfTransformer(ali_chat=_SplitAliChat())
+        retrained.train([texts[x] for x in live],
+                        keys=[keys[x] for x in live])
+        user_text = 'add a raw file'
+        for model in [transformer, retrained]:
+            scores = model.bm25_search(user_text, top_k=10)
+            scores = {model.doc_keys[x]: y for x, y in scores
+                      if model.doc_keys[x]}
+            if model is transformer:
+                incremental = scores
+        assert incremental.keys() == scores.keys()
+        assert np.allclose([incremental[x] for x in scores],
+                           list(scores.values()))
+        doc_map = transformer.compact()
+        assert list(doc_map.items()) == [(0, 0), (2, 1), (3, 2), (5, 3)]
+        assert transformer.search(user_text, top_k=4) == retrained.search(
+            user_text, top_k=4)
+
+    def test_ali_search_top_k_per_model(self):
+        texts = ['raw file {}'.format(x) for x in range(10)] + [
+            'add raw file', 'nothing here']
+        transformer_dict = {
+            str(x): {'model': 'Note' if x % 3 else 'Task', 'id': x + 100}
+            for x in range(len(texts))}
+        ali_chat = _SplitAliChat()
+        transformer = az.TfIdfTransformer(texts=texts, ali_chat=ali_chat)
+        ali_search = az.AliSearch(ali_chat, transformer=transformer,
+                                  transformer_dict=transformer_dict)
+        message = 'add a raw file'
+        for model_name in ['Note', 'Task']:
+            by_model = ali_search._scores_by_model(message, model_name, 2)
+            for key, full in [
+                    ('bm25', transformer.bm25_search(message, len(texts))),
+                    ('tfidf', transformer.search(message, len(texts)))]:
+                expected = [x for x in full if x[1] > 0 and
+                            transformer_dict[str(x[0])]['model'] ==
+                            model_name]
+                assert by_model[key] == expected[:2]
+        assert ali_search._scores_by_model(message, 'Other', 2) == {
+            'bm25': [], 'tfidf': []}
+
     @requires_base_config
     def test_do_analysis_and_fix_processor(self):
         output_dfs = [pd.DataFrame(),
@@ -1995,6 +2801,24 @@ class TestAnalyze:
             assert not fixes_to_run
 
 
+class _FakeRowQuery(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = {'count': 0, 'all': 0}
+
+    def count(self):
+        self.calls['count'] += 1
+        return len(self.rows)
+
+    def all(self):
+        self.calls['all'] += 1
+        return list(self.rows)
+
+
+class _FakeWidget(object):
+    query = None
+
+
 class TestAliChat:
     def test_index_db_model_by_word(self):
         word_str = 'item'
@@ -2007,6 +2831,215 @@ class TestAliChat:
         for i in range(item_num):
             assert word_idx[str(i)] == [i]
 
+    def test_index_object_updates_indexes(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(az.AliChat, 'word_index_cache',
+                            fc.WordIndexCache(str(tmp_path)))
+        rows = [az.FakeDbModel('alpha widget', 1),
+                az.FakeDbModel('beta widget', 2)]
+        _FakeWidget.query = _FakeRowQuery(rows)
+        transformer = az.TfIdfTransformer(texts=[x.name for x in rows],
+                                          ali_chat=_SplitAliChat())
+        transformer_dict = {str(i): {'model': '_FakeWidget', 'id': x.id}
+                            for i, x in enumerate(rows)}
+        ali_chat = az.AliChat(transformer=transformer,
+                              transformer_dict=transformer_dict)
+        ali_chat.corpus_compact_ratio = 1
+        az.AliChat.invalidate_word_index()
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        rows.append(az.FakeDbModel('gamma widget', 3))
+        ali_chat.index_object(_FakeWidget, rows[-1])
+        rows[0].name = 'delta widget'
+        ali_chat.index_object(_FakeWidget, rows[0])
+        rows.pop(1)
+        ali_chat.unindex_object(_FakeWidget, 2)
+        word_idx = ali_chat.index_db_model_by_word(_FakeWidget)
+        assert _FakeWidget.query.calls['all'] == 1
+        assert word_idx.to_dicts()[0] == {
+            'delta': [1], 'widget': [3, 1], 'gamma': [3]}
+        for text, model_id in [('gamma', 3), ('delta', 1)]:
+            scores = transformer.bm25_search(text, top_k=1)
+            assert transformer_dict[str(scores[0][0])]['id'] == model_id
+        assert transformer.bm25_search('beta', top_k=1)[0][1] == 0
+        assert len(transformer.deleted) == 2
+        ali_chat.compact_search_corpus()
+        assert sorted(x['id'] for x in transformer_dict.values()) == [1, 3]
+        assert transformer.search('delta', top_k=1)[0][0] == int(
+            [k for k, v in transformer_dict.items() if v['id'] == 1][0])
+        az.AliChat.invalidate_word_index()
+
+    def test_word_index_shared_on_disk(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(az.AliChat, 'word_index_cache',
+                            fc.WordIndexCache(str(tmp_path)))
+        monkeypatch.setattr(az.AliChat, '_WORD_INDEX_CACHE', {})
+        rows = [az.FakeDbModel('alpha widget', 1),
+                az.FakeDbModel('beta widget', 2)]
+        _FakeWidget.query = _FakeRowQuery(rows)
+        calls = _FakeWidget.query.calls
+        ali_chat = az.AliChat()
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        monkeypatch.setattr(az.AliChat, '_WORD_INDEX_CACHE', {})
+        word_idx = ali_chat.index_db_model_by_word(_FakeWidget)
+        assert isinstance(word_idx.term_ids, np.memmap)
+        assert word_idx['widget'] == [1, 2] and 'gamma' not in word_idx
+        assert calls == {'count': 1, 'all': 1}
+        monkeypatch.setattr(ali_chat, 'word_index_ttl', 0)
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        assert calls == {'count': 2, 'all': 1}
+        rows.append(az.FakeDbModel('gamma widget', 3))
+        assert ali_chat.index_db_model_by_word(_FakeWidget)['gamma'] == [3]
+        assert calls['all'] == 2
+        monkeypatch.setattr(ali_chat, 'word_index_ttl', 600)
+        monkeypatch.setattr(_FakeWidget, 'ali_change_token',
+                            staticmethod(lambda: 'v2'), raising=False)
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        assert calls['all'] == 3
+        az.AliChat.invalidate_word_index(['_FakeWidget'])
+        assert not os.listdir(str(tmp_path)) or all(
+            x.endswith('.lock') for x in os.listdir(str(tmp_path)))
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        assert calls['all'] == 4
+
+    def test_word_index_patch_saves_delta(self, monkeypatch, tmp_path):
+        cache = fc.WordIndexCache(str(tmp_path))
+        monkeypatch.setattr(az.AliChat, 'word_index_cache', cache)
+        monkeypatch.setattr(az.AliChat, '_WORD_INDEX_CACHE', {})
+        rows = [az.FakeDbModel('alpha widget', 1),
+                az.FakeDbModel('beta widget', 2)]
+        _FakeWidget.query = _FakeRowQuery(rows)
+        ali_chat = az.AliChat()
+        ali_chat.word_index_delta_max = 3
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        key = ('_FakeWidget', False)
+        version = cache.load_meta(key)['version']
+        rows.append(az.FakeDbModel('gamma widget', 3))
+        ali_chat.index_object(_FakeWidget, rows[-1])
+        stale = dict(az.AliChat._WORD_INDEX_CACHE)
+        rows[0].name = 'delta widget'
+        ali_chat.index_object(_FakeWidget, rows[0])
+        meta = cache.load_meta(key)
+        assert meta['version'] == version and meta['delta_seq'] == 2
+        assert meta['row_count'] == 3
+        assert sorted(x for x in os.listdir(cache.get_version_dir(
+            key, version)) if x.startswith('delta')) == ['delta_2.json']
+        az.AliChat._WORD_INDEX_CACHE.update(stale)
+        word_idx = ali_chat.index_db_model_by_word(_FakeWidget)
+        assert word_idx.term_ids is stale[key][1].term_ids
+        assert word_idx['widget'] == [2, 3, 1] and word_idx['delta'] == [1]
+        assert 'alpha' not in word_idx and word_idx.get('alpha') is None
+        monkeypatch.setattr(az.AliChat, '_WORD_INDEX_CACHE', {})
+        word_idx = ali_chat.index_db_model_by_word(_FakeWidget)
+        assert isinstance(word_idx.term_ids, np.memmap)
+        assert word_idx.to_dicts() == (
+            {'beta': [2], 'widget': [2, 3, 1], 'gamma': [3], 'delta': [1]},
+            {2: ['beta', 'widget'], 3: ['gamma', 'widget'],
+             1: ['delta', 'widget']})
+        rows.pop(1)
+        ali_chat.unindex_object(_FakeWidget, 2)
+        meta = cache.load_meta(key)
+        assert meta['version'] != version and 'delta_seq' not in meta
+        assert not os.path.exists(cache.get_version_dir(key, version))
+        word_idx = ali_chat.index_db_model_by_word(_FakeWidget)
+        assert not word_idx.delta_words and not word_idx.removed
+        assert word_idx['widget'] == [3, 1] and 'beta' not in word_idx
+        assert meta['row_count'] == 2
+        assert _FakeWidget.query.calls['all'] == 1
+
+    def test_word_index_term_storage(self, tmp_path):
+        long_word = 'x' * 200
+        id_words = {x: ['w{}'.format(x), 'café'] for x in range(100)}
+        id_words[100] = [long_word]
+        word_idx = {'café': list(range(100)), long_word: [100]}
+        word_idx.update({'w{}'.format(x): [x] for x in range(100)})
+        index = fc.WordIndex.from_dict(word_idx, id_words)
+        total = sum(len(x.encode('utf-8')) for x in word_idx)
+        assert index.term_text.nbytes == total
+        cache = fc.WordIndexCache(str(tmp_path))
+        meta = cache.save(('Widget', False), index, {'token': ''})
+        index = cache.load(('Widget', False), meta)
+        assert isinstance(index.term_text, np.memmap)
+        assert index.to_dicts() == (word_idx, id_words)
+        assert index['café'] == list(range(100)) and index[long_word] == [100]
+        assert 'caf' not in index and 'zz' not in index and len(index) == 102
+
+    def test_word_index_update_with_token_and_str_ids(
+            self, monkeypatch, tmp_path):
+        monkeypatch.setattr(az.AliChat, 'word_index_cache',
+                            fc.WordIndexCache(str(tmp_path)))
+        monkeypatch.setattr(az.AliChat, '_WORD_INDEX_CACHE', {})
+        rows = [az.FakeDbModel('alpha widget', 1)]
+        _FakeWidget.query = _FakeRowQuery(rows)
+        calls = _FakeWidget.query.calls
+        monkeypatch.setattr(_FakeWidget, 'ali_change_token',
+                            staticmethod(lambda: len(rows)), raising=False)
+        ali_chat = az.AliChat()
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        rows.append(az.FakeDbModel('beta widget', 2))
+        ali_chat.index_object(_FakeWidget, rows[-1])
+        word_idx = ali_chat.index_db_model_by_word(_FakeWidget)
+        assert word_idx['beta'] == [2]
+        assert calls['all'] == 1
+        rows[:] = [az.FakeDbModel('alpha widget', 'a1'),
+                   az.FakeDbModel('beta widget', 'b2')]
+        az.AliChat.invalidate_word_index()
+        ali_chat.index_db_model_by_word(_FakeWidget)
+        assert ali_chat.index_db_model_by_word(_FakeWidget)['beta'] == ['b2']
+        rows.pop()
+        ali_chat.unindex_object(_FakeWidget, 'b2')
+        assert 'beta' not in ali_chat.index_db_model_by_word(_FakeWidget)
+        assert calls == {'count': 2, 'all': 2}
+
+    def test_load_db_objects_in_one_query(self):
+        import sqlalchemy as sqa
+        from sqlalchemy import orm
+        base = orm.declarative_base()
+
+        class Parent(base):
+            __tablename__ = 'parent'
+            id = sqa.Column(sqa.Integer, primary_key=True)
+            name = sqa.Column(sqa.String)
+
+        class Widget(base):
+            __tablename__ = 'widget'
+            id = sqa.Column(sqa.Integer, primary_key=True)
+            widget_name = sqa.Column(sqa.String)
+            parent_id = sqa.Column(sqa.ForeignKey('parent.id'))
+            parent = orm.relationship(Parent)
+
+            @property
+            def name(self):
+                return '{} {}'.format(self.parent.name, self.widget_name)
+
+            def get_url(self):
+                return '/widget/{}'.format(self.id)
+
+            @staticmethod
+            def ali_load_options():
+                return [orm.joinedload(Widget.parent)]
+        engine = sqa.create_engine('sqlite://')
+        base.metadata.create_all(engine)
+        session = orm.sessionmaker(bind=engine)()
+        session.add_all([
+            Widget(id=x, widget_name='w{}'.format(x),
+                   parent=Parent(id=x, name='p{}'.format(x)))
+            for x in range(1, 6)])
+        session.commit()
+        session.expunge_all()
+        statements = []
+        sqa.event.listen(engine, 'before_cursor_execute',
+                         lambda *args: statements.append(args[2]))
+        ali_chat = az.AliChat()
+        ali_chat.db = types.SimpleNamespace(session=session)
+        model_ids = {3: None, 1: None, 9: None, 5: None}
+        _, html_response = ali_chat.convert_model_ids_to_message(
+            Widget, model_ids)
+        assert len(statements) == 1
+        assert html_response.index('p3 w3') < html_response.index('p1 w1')
+        assert '4.  <a href="/widget/5"' in html_response
+        assert ali_chat.get_db_object(Widget, 1).name == 'p1 w1'
+        assert ali_chat.get_db_object(Widget, 9) is None
+        assert len(statements) == 1
+
 
 default_col_names = [
     '"lqadb"."event"."eventname"',
@@ -2199,6 +3232,51 @@ conv_event_sum_cols = [
 ]
 
 
+class _FakeIdDB(object):
+    """Serve ids of names from a dict and record the names read."""
+    def __init__(self, ids):
+        self.ids = ids
+        self.reads = []
+        self.closed = 0
+
+    def read_rds(self, table, select_col, where_col, where_val):
+        self.reads.append(list(where_val))
+        data = [(self.ids[table][x], x) for x in where_val
+                if x in self.ids[table]]
+        return pd.DataFrame(data=data, columns=[select_col, where_col])
+
+    def pool_copy(self):
+        return self
+
+    def close(self):
+        self.closed += 1
+
+
+class _FakeCopyCursor(object):
+    """Load COPY FROM STDIN into sqlite, reading data as postgres would."""
+    text_escapes = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r',
+                    't': '\t', 'v': '\v'}
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def copy_expert(self, sql, file):
+        table, cols = re.match(r'COPY (\w+) \((.*?)\)', sql).groups()
+        if 'FORMAT csv' in sql:
+            rows = [[None if x == '' else x for x in row]
+                    for row in csv.reader(file)]
+        else:
+            rows = [[None if x == '\\N' else re.sub(
+                r'\\(.)', lambda m: self.text_escapes.get(
+                    m.group(1), m.group(1)), x) for x in line.split('\t')]
+                    for line in file.read().splitlines()]
+        self.cursor.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+            table, cols, ', '.join(['?'] * len(rows[0]))), rows)
+
+
 class TestExport:
 
     @pytest.mark.parametrize(
@@ -2485,12 +3563,182 @@ class TestExport:
         append_tables = sb.get_active_event_tables(metrics)
         assert set(append_tables) == set(expected_tables)
 
+    @staticmethod
+    def write_schema(tmp_path, monkeypatch):
+        monkeypatch.setattr(exp, 'config_path', str(tmp_path) + '/')
+        fpn = 'fullplacement:fullplacementid:fullplacementname'
+        pd.DataFrame({
+            exc.table: ['event', 'fullplacement', 'plan', 'vendor',
+                        'campaign'],
+            exc.pk: ['eventid:eventname', 'fullplacementid:fullplacementname',
+                     'planid:planname', 'vendorid:vendorname',
+                     'campaignid:campaignname'],
+            exc.columns: ['eventname TEXT,impressions REAL',
+                          'fullplacementname TEXT', 'planname TEXT',
+                          'vendorname TEXT', 'campaignname TEXT'],
+            exc.fk: [fpn, 'vendor:vendorid:vendorname,'
+                          'campaign:campaignid:campaignname', fpn, None,
+                     None]}).to_csv(tmp_path / 'schema.csv', index=False)
+        return exp.DBSchema('schema.csv')
+
+    def test_upload_levels(self, tmp_path, monkeypatch):
+        dbs = self.write_schema(tmp_path, monkeypatch)
+        assert dbs.get_upload_levels() == [
+            ['vendor', 'campaign'], ['fullplacement'], ['event', 'plan']]
+        dbs.config[exc.fk]['vendor'] = {'event': ['eventid', 'eventname']}
+        assert dbs.get_upload_levels() == [
+            ['campaign'], ['event'], ['vendor'], ['fullplacement'], ['plan']]
+
+    def test_id_map_cache(self, tmp_path, monkeypatch):
+        dbu = exp.DBUpload()
+        dbu.dbs = self.write_schema(tmp_path, monkeypatch)
+        dbu.db = _FakeIdDB({'vendor': {'v1': 1, 'v2': 2, 'v3': 3}})
+        id_config = {'vendor': ['vendorid', 'vendorname']}
+        lookups = [(['v1', 'v2'], [1, 2]), (['v2', 'v3', 'v2'], [2, 3]),
+                   (['v1', 'v4'], [1]), (['v4'], [])]
+        for names, ids in lookups:
+            df = dbu.format_and_read_rds(
+                'vendor', id_config, pd.DataFrame({'vendorname': names}))
+            assert df['vendorid'].tolist() == ids
+        assert dbu.db.reads == [['v1', 'v2'], ['v3'], ['v4']]
+
+    def test_id_map_lock_per_table(self, tmp_path, monkeypatch):
+        dbu = exp.DBUpload()
+        dbu.dbs = self.write_schema(tmp_path, monkeypatch)
+        dbu.db = _FakeIdDB({'vendor': {'v1': 1}, 'campaign': {'c1': 2}})
+        read_rds = dbu.db.read_rds
+        campaign_read = threading.Event()
+
+        def blocking_read_rds(table, *args):
+            if table == 'vendor':
+                assert campaign_read.wait(5)
+            df = read_rds(table, *args)
+            campaign_read.set()
+            return df
+
+        dbu.db.read_rds = blocking_read_rds
+        results = {}
+
+        def read_ids(table, id_col, name_col, name):
+            table_dbu = copy.copy(dbu)
+            table_dbu.dbs = copy.copy(dbu.dbs)
+            df = table_dbu.format_and_read_rds(
+                table, {table: [id_col, name_col]},
+                pd.DataFrame({name_col: [name]}))
+            results[table] = df[id_col].tolist()
+
+        threads = [
+            threading.Thread(target=read_ids, args=x) for x in
+            [('vendor', 'vendorid', 'vendorname', 'v1'),
+             ('campaign', 'campaignid', 'campaignname', 'c1')]]
+        threads[0].start()
+        time.sleep(.05)
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+        assert results == {'vendor': [1], 'campaign': [2]}
+
+    def test_staged_update_and_delete(self, tmp_path):
+        db = exp.DB()
+        db.conn_string = 'sqlite:///{}'.format(tmp_path / 'lqadb.db')
+        db.schema = 'main'
+        db.host = 'localhost'
+        db.connect()
+        db.cursor.execute('CREATE TABLE vendor (vendorid INTEGER, '
+                          'vendorname TEXT, uploadid INTEGER, cost REAL)')
+        rows = [(1, 'a', 1, 1.), (2, 'b', 1, 2.), (3, 'c', 1, 3.),
+                (4, 'b', 2, 4.)]
+        db.cursor.executemany('INSERT INTO vendor VALUES (?, ?, ?, ?)', rows)
+        db.connection.commit()
+        dbu = exp.DBUpload()
+        dbu.db = db
+        dbu.name = 'vendorname'
+        dbu.id_col = 'vendorid'
+        dbu.dft = types.SimpleNamespace(upload_id=1)
+        df_rds = pd.DataFrame({'vendorname': ['a', 'b', 'c'],
+                               'uploadid': 1, 'cost': [1., 2., 3.]})
+        ul_df = pd.DataFrame({'vendorname': ['a', 'b', 'd'],
+                              'uploadid': 1, 'cost': [1., 5., 4.]})
+        df = pd.merge(df_rds, ul_df, how='outer', on='vendorname',
+                      indicator=True).reset_index()
+        dbu.update_rows(df, df_rds.columns, 'vendor')
+        dbu.delete_rows(df, 'vendor')
+        db.connect()
+        db.cursor.execute('SELECT * FROM vendor ORDER BY vendorid')
+        assert db.cursor.fetchall() == [
+            (1, 'a', 1, 1.), (2, 'b', 1, 5.), (4, 'b', 2, 4.)]
+        db.cursor.execute('SELECT name FROM sqlite_temp_master')
+        assert db.cursor.fetchall() == []
+        db.close()
+
+    def test_staged_copy_keeps_quotes_and_backslashes(self, tmp_path):
+        db = exp.DB()
+        db.conn_string = 'sqlite:///{}'.format(tmp_path / 'lqadb.db')
+        db.schema = 'main'
+        db.host = 'localhost'
+        connect = db.connect
+
+        def copy_connect():
+            connect()
+            db.cursor = _FakeCopyCursor(db.cursor)
+
+        db.connect = copy_connect
+        db.connect()
+        db.cursor.execute('CREATE TABLE vendor (vendorname TEXT, note TEXT)')
+        names = ['Banner 15" x', 'a\\b', 'c,d\tx', 'plain']
+        db.cursor.executemany('INSERT INTO vendor VALUES (?, ?)',
+                              [(x, 'old') for x in names])
+        db.connection.commit()
+        df = pd.DataFrame({'vendorname': names[:3],
+                           'note': ['say "hi"', 'x\\y', None]})
+        assert db.update_rows_staged('vendor', ['note'], df,
+                                     'vendorname') == 3
+        db.connect()
+        db.cursor.execute('SELECT * FROM vendor')
+        assert db.cursor.fetchall() == [
+            ('Banner 15" x', 'say "hi"'), ('a\\b', 'x\\y'),
+            ('c,d\tx', None), ('plain', 'old')]
+        db.delete_rows_staged('vendor', 'note', "'x\\y'",
+                              pd.DataFrame({'vendorname': names[1:2]}))
+        db.connect()
+        db.cursor.execute('SELECT vendorname FROM vendor')
+        assert [x[0] for x in db.cursor.fetchall()] == [
+            'Banner 15" x', 'c,d\tx', 'plain']
+        db.close()
+
+    def test_upload_tables_concurrent(self, monkeypatch):
+        uploads = {}
+        lock = threading.Lock()
+
+        def upload_table_to_db(self, table):
+            time.sleep(.05)
+            with lock:
+                uploads[table] = (self.dbs, threading.get_ident())
+        monkeypatch.setattr(exp.DBUpload, 'upload_table_to_db',
+                            upload_table_to_db)
+        dbu = exp.DBUpload(workers=3)
+        dbu.dbs = types.SimpleNamespace()
+        dbu.db = _FakeIdDB({})
+        dbu.upload_tables_concurrent(['vendor', 'campaign', 'country'])
+        assert sorted(uploads) == ['campaign', 'country', 'vendor']
+        schema_ids = set(id(x[0]) for x in uploads.values())
+        assert len(schema_ids) == 3 and id(dbu.dbs) not in schema_ids
+        assert len(set(x[1] for x in uploads.values())) == 3
+        assert dbu.db.closed == 3
+
 
 class TestRun:
     @requires_base_config
     def test_blank_run(self):
         main('--analyze')
 
+    def test_api_limits_args(self):
+        args = get_args('--api_limits fb:2 aw:10')
+        assert dict(args.api_limits) == {'fb': 2, 'aw': 10}
+        for value in ['fb', 'fb:', ':2', 'fb:two']:
+            with pytest.raises(SystemExit):
+                get_args('--api_limits {}'.format(value))
+
 
 class TestImportPlanData:
     @requires_base_config